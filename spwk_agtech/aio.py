@@ -0,0 +1,276 @@
+import asyncio
+import inspect
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import threading
+import types
+
+from .pcse_env import PcseEnv
+
+
+def _worker(conn, env_fn):
+    """ Worker process loop. Receives batches of requests and answers them in one message
+
+    Args:
+        conn (Connection): pipe end of the worker
+        env_fn (callable): factory of environments, called with the kwargs of make_env
+    """
+    envs = {}
+    while True:
+        try:
+            batch = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if batch is None:
+            break
+
+        results = []
+        for req_id, env_id, cmd, arg in batch:
+            try:
+                if cmd == "make":
+                    envs[env_id] = env_fn(**arg)
+                    value = (envs[env_id].observation_space, envs[env_id].action_space)
+                elif cmd == "reset":
+                    value = envs[env_id].reset()
+                elif cmd == "step":
+                    value = envs[env_id].step(arg)
+                elif cmd == "getattr":
+                    value = getattr(envs[env_id], arg)
+                elif cmd == "close":
+                    envs.pop(env_id).close()
+                    value = None
+                else:
+                    raise ValueError(f"Unknown command {cmd}")
+                results.append((req_id, True, value))
+            except Exception as e:
+                results.append((req_id, False, e))
+        conn.send(results)
+
+    for env in envs.values():
+        env.close()
+    conn.close()
+
+
+class _Worker:
+    """ Host-side handle of one worker process """
+
+    def __init__(self, ctx, env_fn):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker, args=(child_conn, env_fn), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.pending = []
+        self.futures = {}
+        self.n_envs = 0
+        self.reader = None
+
+
+class AsyncEnvPool:
+    """ Managed pool of worker processes hosting environments behind an asyncio API
+
+    Each environment lives in one worker process and all of its requests are routed there.
+    Requests issued in the same event loop iteration for the same worker are batched in a
+    single message, and at most max_inflight requests are outstanding at any time
+    (further requests wait, which gives backpressure to the callers).
+
+    Example:
+        async with AsyncEnvPool(processes=4) as pool:
+            envs = [await pool.make_env() for _ in range(100)]
+            results = await asyncio.gather(*[run_episode(env, policy) for env in envs])
+
+    Args:
+        processes (int, optional): number of worker processes. Defaults to None (os.cpu_count()).
+        max_inflight (int, optional): maximum number of outstanding requests. Defaults to 256.
+        max_batch (int, optional): maximum number of requests per message. Defaults to 64.
+        env_fn (callable, optional): picklable factory of environments. Defaults to None (PcseEnv).
+        mp_context (str, optional): multiprocessing start method. Defaults to None (platform default).
+    """
+
+    def __init__(
+        self,
+        processes=None,
+        max_inflight=256,
+        max_batch=64,
+        env_fn=None,
+        mp_context=None,
+    ):
+        self.processes = processes or os.cpu_count()
+        self.max_inflight = max_inflight
+        self.max_batch = max_batch
+        self.env_fn = env_fn or PcseEnv
+        self.ctx = mp.get_context(mp_context)
+        self.workers = []
+        self._ids = itertools.count()
+        self._loop = None
+        self._slots = None
+
+    async def start(self):
+        if self.workers:
+            return self
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_inflight)
+        for _ in range(self.processes):
+            worker = _Worker(self.ctx, self.env_fn)
+            worker.reader = threading.Thread(
+                target=self._read_results, args=(worker,), daemon=True
+            )
+            worker.reader.start()
+            self.workers.append(worker)
+        return self
+
+    async def close(self):
+        for worker in self.workers:
+            try:
+                worker.conn.send(None)
+            except (OSError, BrokenPipeError):
+                pass
+        for worker in self.workers:
+            await self._loop.run_in_executor(None, worker.process.join, 5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
+        self.workers = []
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def make_env(self, **env_kwargs):
+        """ Create an environment in the least loaded worker
+
+        Args:
+            env_kwargs: keyword arguments passed to env_fn (e.g. lat, long)
+
+        Returns:
+            AsyncPcseEnv: handle of the remote environment
+        """
+        await self.start()
+        worker = min(self.workers, key=lambda w: w.n_envs)
+        worker.n_envs += 1
+        env_id = next(self._ids)
+        observation_space, action_space = await self._request(
+            worker, env_id, "make", env_kwargs
+        )
+        return AsyncPcseEnv(self, worker, env_id, observation_space, action_space)
+
+    async def _request(self, worker, env_id, cmd, arg=None):
+        await self._slots.acquire()
+        try:
+            req_id = next(self._ids)
+            future = self._loop.create_future()
+            worker.futures[req_id] = future
+            if not worker.pending:
+                self._loop.call_soon(self._flush, worker)
+            worker.pending.append((req_id, env_id, cmd, arg))
+            if len(worker.pending) >= self.max_batch:
+                self._flush(worker)
+            return await future
+        finally:
+            self._slots.release()
+
+    def _flush(self, worker):
+        if not worker.pending:
+            return
+        batch, worker.pending = worker.pending, []
+        try:
+            worker.conn.send(batch)
+        except (OSError, BrokenPipeError) as e:
+            self._fail(worker, e)
+
+    def _read_results(self, worker):
+        while True:
+            try:
+                results = worker.conn.recv()
+            except (EOFError, OSError) as e:
+                results, error = None, e
+            try:
+                if results is None:
+                    self._loop.call_soon_threadsafe(self._fail, worker, error)
+                    return
+                self._loop.call_soon_threadsafe(self._resolve, worker, results)
+            except RuntimeError:
+                # event loop already closed
+                return
+
+    def _resolve(self, worker, results):
+        for req_id, ok, value in results:
+            future = worker.futures.pop(req_id, None)
+            if future is None or future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _fail(self, worker, error):
+        if worker.futures:
+            logging.error(f"Worker {worker.process.pid} is not reachable: {error}")
+        for future in worker.futures.values():
+            if not future.done():
+                future.set_exception(RuntimeError(f"Worker process died: {error}"))
+        worker.futures.clear()
+
+
+class AsyncPcseEnv:
+    """ Asyncio handle of an environment hosted in an AsyncEnvPool worker
+
+    Mirrors the gym interface with awaitable methods (areset, astep, aclose).
+    """
+
+    def __init__(self, pool, worker, env_id, observation_space, action_space):
+        self.pool = pool
+        self.worker = worker
+        self.env_id = env_id
+        self.observation_space = observation_space
+        self.action_space = action_space
+
+    async def areset(self):
+        return await self.pool._request(self.worker, self.env_id, "reset")
+
+    async def astep(self, action):
+        return await self.pool._request(self.worker, self.env_id, "step", action)
+
+    async def aget(self, name):
+        """ Get an attribute of the remote environment (e.g. "profit")"""
+        return await self.pool._request(self.worker, self.env_id, "getattr", name)
+
+    async def aclose(self):
+        await self.pool._request(self.worker, self.env_id, "close")
+        self.worker.n_envs -= 1
+
+
+async def run_episode(env, policy, test=True):
+    """ Asyncio counterpart of pcse_runner. Return actions and rewards after running environment
+
+    Args:
+        env (AsyncPcseEnv): remote PCSE environment
+        policy (function or class): fixed_policy (function) or trained (class) or optimized model (class).
+            Coroutine functions and awaitable get_action results are supported.
+        test (bool, optional): if True, no stochastic. Defaults to True.
+
+    Returns:
+        tuple(list, list): list of actions and list of rewards
+    """
+
+    actions = []
+    rewards = []
+    obs = await env.areset()
+    done = False
+    while done is not True:
+        if isinstance(policy, types.FunctionType):
+            act = policy(obs, env)
+        else:
+            act = policy.get_action(obs, test=test)
+        if inspect.isawaitable(act):
+            act = await act
+
+        obs, reward, done, info = await env.astep(act)
+        actions.append(act)
+        rewards.append(reward)
+    return actions, rewards
@@ -0,0 +1,227 @@
+import datetime
+import logging
+import os
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from math import asin, cos, pi, radians, sin, sqrt
+
+import numpy as np
+import pcse.crop.assimilation
+import pcse.crop.phenology
+import pcse.util
+from pcse.settings import settings
+from pcse.util import doy
+
+# Columns of an astro table, one row per day of year (row 0 is unused)
+ASTRO_COLUMNS = ["DAYL", "DAYLP", "SINLD", "COSLD", "DSINBE", "ANGOT", "SC"]
+
+AstroResults = namedtuple(
+    "AstroResults", "DAYL, DAYLP, SINLD, COSLD, DIFPP, ATMTR, DSINBE, ANGOT"
+)
+
+# Tables loaded in this process by latitude, as arrays and as lists of rows
+_tables = {}
+_rows = {}
+
+
+def _astro_row(iday, latitude):
+    """ Radiation-independent part of pcse.util.astro, same operations in the same order """
+    RAD = radians(1.0)
+    ANGLE = -4.0
+    DEC = -asin(sin(23.45 * RAD) * cos(2.0 * pi * (float(iday) + 10.0) / 365.0))
+    SC = 1370.0 * (1.0 + 0.033 * cos(2.0 * pi * float(iday) / 365.0))
+    SINLD = sin(RAD * latitude) * sin(DEC)
+    COSLD = cos(RAD * latitude) * cos(DEC)
+    AOB = SINLD / COSLD
+    if abs(AOB) <= 1.0:
+        DAYL = 12.0 * (1.0 + 2.0 * asin(AOB) / pi)
+        DSINB = 3600.0 * (DAYL * SINLD + 24.0 * COSLD * sqrt(1.0 - AOB**2) / pi)
+        DSINBE = 3600.0 * (
+            DAYL * (SINLD + 0.4 * (SINLD**2 + COSLD**2 * 0.5))
+            + 12.0 * COSLD * (2.0 + 3.0 * 0.4 * SINLD) * sqrt(1.0 - AOB**2) / pi
+        )
+    else:
+        DAYL = 24.0 if AOB > 1.0 else 0.0
+        DSINB = 3600.0 * (DAYL * SINLD)
+        DSINBE = 3600.0 * (DAYL * (SINLD + 0.4 * (SINLD**2 + COSLD**2 * 0.5)))
+    AOB_CORR = (-sin(ANGLE * RAD) + SINLD) / COSLD
+    if abs(AOB_CORR) <= 1.0:
+        DAYLP = 12.0 * (1.0 + 2.0 * asin(AOB_CORR) / pi)
+    else:
+        DAYLP = 24.0 if AOB_CORR > 1.0 else 0.0
+    return DAYL, DAYLP, SINLD, COSLD, DSINBE, SC * DSINB, SC
+
+
+def astro_table_filename(latitude):
+    """ Cache file of the astro table of a latitude, next to the weather cache files
+
+    The latitude is written as the repr of a float, so 35, 35.0 and np.float64(35.0) share a
+    file while distinct latitudes (whose tables differ) never do.
+    """
+    return os.path.join(
+        settings.METEO_CACHE_DIR, f"AstroTable_LAT{float(latitude)!r}.npy"
+    )
+
+
+def build_astro_table(latitude):
+    """ Astronomical variables of every day of year at a latitude
+
+    Args:
+        latitude (float): latitude
+
+    Returns:
+        np.ndarray: (367, len(ASTRO_COLUMNS)) table indexed by day of year
+    """
+
+    if abs(latitude) > 90.0:
+        raise RuntimeError("Latitude not between -90 and 90")
+    table = np.full((367, len(ASTRO_COLUMNS)), np.nan)
+    for iday in range(1, 367):
+        table[iday] = _astro_row(iday, latitude)
+    return table
+
+
+def load_astro_table(latitude):
+    """ Astro table of a latitude, from memory, the cache file or built (and cached)
+
+    Args:
+        latitude (float): latitude
+
+    Returns:
+        np.ndarray: (367, len(ASTRO_COLUMNS)) table indexed by day of year
+    """
+
+    table = _tables.get(latitude)
+    if table is not None:
+        return table
+    path = astro_table_filename(latitude)
+    try:
+        table = np.load(path)
+    except (IOError, ValueError):
+        table = build_astro_table(latitude)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp{os.getpid()}.npy"
+            np.save(tmp, table)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning(f"Failed to write astro table {path} due to: {e}")
+    _tables[latitude] = table
+    _rows[latitude] = table.tolist()
+    return table
+
+
+def astro(day, latitude, radiation):
+    """ pcse.util.astro from the astro table of the latitude
+
+    Only the atmospheric transmission and the diffuse irradiation depend on the radiation, they
+    are the only values computed per call.
+
+    Args:
+        day (datetime.date): day
+        latitude (float): latitude
+        radiation (float): daily global incoming radiation in J/m2/day
+
+    Returns:
+        AstroResults: as pcse.util.astro
+    """
+
+    rows = _rows.get(latitude)
+    if rows is None:
+        load_astro_table(latitude)
+        rows = _rows[latitude]
+    DAYL, DAYLP, SINLD, COSLD, DSINBE, ANGOT, SC = rows[doy(day)]
+    ATMTR = radiation / ANGOT if DAYL > 0.0 else 0.0
+    if ATMTR > 0.75:
+        FRDIF = 0.23
+    elif ATMTR > 0.35:
+        FRDIF = 1.33 - 1.46 * ATMTR
+    elif ATMTR > 0.07:
+        FRDIF = 1.0 - 2.3 * (ATMTR - 0.07) ** 2
+    else:
+        FRDIF = 1.0
+    DIFPP = FRDIF * ATMTR * 0.5 * SC
+    return AstroResults(DAYL, DAYLP, SINLD, COSLD, DIFPP, ATMTR, DSINBE, ANGOT)
+
+
+def daylength(day, latitude, angle=-4):
+    """ pcse.util.daylength from the astro table of the latitude (photoperiodic angle of -4) """
+    if angle != -4:
+        return pcse.util.daylength(day, latitude, angle)
+    rows = _rows.get(latitude)
+    if rows is None:
+        load_astro_table(latitude)
+        rows = _rows[latitude]
+    return rows[doy(day)][1]
+
+
+def install_astro_tables():
+    """ Make the PCSE crop modules read daylength and astro from the astro tables
+
+    Assimilation and phenology of every engine of this process then look the astronomical
+    variables up by latitude and day of year instead of evaluating them at every step (the astro
+    cache of PCSE is keyed by radiation too, so it misses on almost every day).
+    """
+
+    pcse.crop.assimilation.astro = astro
+    pcse.crop.phenology.daylength = daylength
+
+
+def uninstall_astro_tables():
+    """ Restore the PCSE astro and daylength functions """
+    pcse.crop.assimilation.astro = pcse.util.astro
+    pcse.crop.phenology.daylength = pcse.util.daylength
+
+
+@contextmanager
+def astro_tables_installed():
+    """ install_astro_tables() for the duration of a block, the previous functions are restored
+
+    PcseEnv(astro_tables=True) wraps its engine calls in it, so other PCSE users of the process
+    keep the PCSE functions.
+    """
+
+    saved = pcse.crop.assimilation.astro, pcse.crop.phenology.daylength
+    install_astro_tables()
+    try:
+        yield
+    finally:
+        pcse.crop.assimilation.astro, pcse.crop.phenology.daylength = saved
+
+
+def benchmark_astro(episodes=3, calls=10000, **env_kwargs):
+    """ Time PCSE astro against the astro tables, per call and per episode
+
+    Args:
+        episodes (int, optional): episodes per variant. Defaults to 3.
+        calls (int, optional): astro calls per variant, with a new radiation every call as in a
+            season. Defaults to 10000.
+        env_kwargs: keyword arguments of PcseEnv
+
+    Returns:
+        dict: seconds per astro call and per no-management episode without ("pcse_") and with ("table_") tables
+    """
+
+    from .pcse_env import PcseEnv
+    from .sweep import no_management_policy
+    from .utils import pcse_runner
+
+    day = datetime.date(1988, 6, 1)
+    latitude = env_kwargs.get("lat", 35)
+    load_astro_table(latitude)
+    results = {}
+    for name, function in (("pcse", pcse.util.astro), ("table", astro)):
+        start = time.perf_counter()
+        for ix in range(calls):
+            function(day, latitude, 1.0e7 + ix)
+        results[f"{name}_astro_call"] = (time.perf_counter() - start) / calls
+
+    env_kwargs = {k: v for k, v in env_kwargs.items() if k != "astro_tables"}
+    for name in ("pcse", "table"):
+        env = PcseEnv(astro_tables=name == "table", **env_kwargs)
+        start = time.perf_counter()
+        for _ in range(episodes):
+            pcse_runner(env, no_management_policy)
+        results[f"{name}_episode"] = (time.perf_counter() - start) / episodes
+    return results
@@ -0,0 +1,477 @@
+import numpy as np
+import pandas as pd
+
+NUTRIENTS = ["N", "P", "K"]
+ORGANS = ["LV", "ST", "RT", "SO"]
+
+# Reference variables compared by validate_against_pcse
+WATERBALANCE_STATES = ["SM", "SS", "W", "WLOW", "WWLOW", "WTRAT", "EVST", "EVWT"]
+WATERBALANCE_STATES += ["TSR", "RAINT", "WDRT", "TOTINF", "TOTIRR", "PERCT", "LOSST"]
+WATERBALANCE_RATES = ["EVS", "EVW", "WTRA", "RIN", "PERC", "LOSS", "DW", "DWLOW"]
+WATERBALANCE_RATES += ["DSS", "DTSR"]
+
+
+def _stack(providers, name, n):
+    return np.array([float(p[name]) for p in providers] * (n // len(providers)))
+
+
+def _providers(parameters, n):
+    """ List of parameter providers and batch size """
+    providers = parameters if isinstance(parameters, (list, tuple)) else [parameters]
+    n = n or len(providers)
+    if n % len(providers):
+        raise ValueError(f"Batch size {n} is not a multiple of {len(providers)}.")
+    return providers, n
+
+
+def _batch(value, n):
+    """ Scalar or (n,) value as a (n,) float array """
+    return np.broadcast_to(np.asarray(value, dtype=np.float64), (n,))
+
+
+def _limit(low, high, value):
+    """ pcse.util.limit over arrays """
+    return np.where(value < low, low, np.where(value < high, value, high))
+
+
+class BatchAfgen:
+    """ pcse.util.Afgen over a batch, one interpolation table per member
+
+    Tables are given as PCSE XY lists and padded to the longest one, so every call is a few array
+    operations whatever the batch size.
+
+    Args:
+        tables (list): one XY list per member
+    """
+
+    def __init__(self, tables):
+        from pcse.util import Afgen
+
+        afgens = [Afgen(table) for table in tables]
+        size = max(len(a.x_list) for a in afgens)
+        n = len(afgens)
+        self.x = np.full((n, size), np.inf)
+        self.y = np.zeros((n, size))
+        self.slopes = np.zeros((n, size))
+        self.last = np.zeros(n, dtype=np.int64)
+        for ix, a in enumerate(afgens):
+            self.x[ix, : len(a.x_list)] = a.x_list
+            self.y[ix, : len(a.y_list)] = a.y_list
+            self.slopes[ix, : len(a.slopes)] = a.slopes
+            self.last[ix] = len(a.x_list) - 1
+
+    def __call__(self, value):
+        rows = np.arange(len(self.last))
+        value = np.asarray(value, dtype=np.float64)
+        # bisect_left - 1
+        i = np.clip((self.x < value[:, None]).sum(axis=1) - 1, 0, None)
+        result = self.y[rows, i] + self.slopes[rows, i] * (value - self.x[rows, i])
+        result = np.where(
+            value >= self.x[rows, self.last], self.y[rows, self.last], result
+        )
+        return np.where(value <= self.x[:, 0], self.y[:, 0], result)
+
+
+class BatchWaterbalanceFD:
+    """ pcse.soil.classic_waterbalance.WaterbalanceFD over a batch of fields
+
+    States and rates are arrays of shape (n,) named as in PCSE (SM, W, WLOW, EVS, ...). A day is
+    advanced as in pcse.engine.Engine: integrate() with the rates of the previous day, then
+    calc_rates() with the driving variables of the new day.
+
+    Crop inputs are NaN for members without a crop (the reference module then finds no TRA and RD
+    in the kiosk and uses the potential evaporation rates and the default rooting depth).
+
+    Args:
+        parameters (ParameterProvider or list): parameters shared by all members or one provider
+            per member (repeated if n is a multiple of their number)
+        n (int, optional): batch size. Defaults to None (number of providers).
+    """
+
+    DEFAULT_RD = 10.0
+
+    def __init__(self, parameters, n=None):
+        providers, n = _providers(parameters, n)
+        self.n = n
+        names = ["SMFCF", "SM0", "SMW", "CRAIRC", "SOPE", "KSUB", "RDMSOL", "IFUNRN"]
+        names += ["SSMAX", "SSI", "WAV", "NOTINF", "SMLIM"]
+        p = {name: _stack(providers, name, n) for name in names}
+        self.params = p
+        self.NINFTB = BatchAfgen([[0.0, 0.0, 0.5, 0.0, 1.5, 1.0]] * n)
+
+        SMLIM = _limit(p["SMW"], p["SM0"], p["SMLIM"])
+        RD = np.full(n, self.DEFAULT_RD)
+        self.RDM = np.maximum(RD, p["RDMSOL"])
+        self.RDold = RD
+
+        self.SS = p["SSI"].copy()
+        self.SM = _limit(p["SMW"], SMLIM, p["SMW"] + p["WAV"] / RD)
+        self.W = self.SM * RD
+        self.WI = self.W.copy()
+        self.WLOW = _limit(
+            0.0, p["SM0"] * (self.RDM - RD), p["WAV"] + self.RDM * p["SMW"] - self.W
+        )
+        self.WLOWI = self.WLOW.copy()
+        self.WWLOW = self.W + self.WLOW
+        self.DSLR = np.where(
+            self.SM >= p["SMW"] + 0.5 * (p["SMFCF"] - p["SMW"]), 1.0, 5.0
+        )
+        self.RINold = np.zeros(n)
+        self.DSOS = np.zeros(n, dtype=np.int64)
+        for name in WATERBALANCE_STATES[5:]:
+            setattr(self, name, np.zeros(n))
+        for name in WATERBALANCE_RATES + ["RIRR", "DRAINT"]:
+            setattr(self, name, np.zeros(n))
+
+    def _rooting_depth(self, rd):
+        if rd is None:
+            return np.full(self.n, self.DEFAULT_RD)
+        return np.where(np.isnan(rd), self.DEFAULT_RD, rd)
+
+    def calc_rates(
+        self, rain, e0, es0, irrigation=0.0, tra=None, evwmx=None, evsmx=None, rd=None
+    ):
+        """ Rates of the day
+
+        Args:
+            rain (np.ndarray): RAIN in cm/day
+            e0 (np.ndarray): E0 in cm/day
+            es0 (np.ndarray): ES0 in cm/day
+            irrigation (np.ndarray, optional): effective irrigation (amount * efficiency) in cm.
+                Defaults to 0.
+            tra (np.ndarray, optional): crop transpiration TRA. Defaults to None (no crop).
+            evwmx (np.ndarray, optional): EVWMX of the crop. Defaults to None (no crop).
+            evsmx (np.ndarray, optional): EVSMX of the crop. Defaults to None (no crop).
+            rd (np.ndarray, optional): rooting depth RD of the crop. Defaults to None (no crop).
+        """
+        p = self.params
+        rain, e0, es0 = (_batch(v, self.n) for v in (rain, e0, es0))
+        nan = np.full(self.n, np.nan)
+        tra = nan if tra is None else _batch(tra, self.n)
+        crop = ~np.isnan(tra)
+        self.RIRR = _batch(irrigation, self.n)
+        self.WTRA = np.where(crop, tra, 0.0)
+        EVWMX = np.where(crop, nan if evwmx is None else evwmx, e0)
+        EVSMX = np.where(crop, nan if evsmx is None else evsmx, es0)
+
+        # evaporation from the water layer, or from the soil after (or days after) infiltration
+        surface = self.SS > 1.0
+        wet = ~surface & (self.RINold >= 1)
+        dry = ~surface & ~wet
+        self.EVW = np.where(surface, EVWMX, 0.0)
+        EVSMXT = EVSMX * (np.sqrt(self.DSLR + 1) - np.sqrt(self.DSLR))
+        self.EVS = np.where(
+            wet, EVSMX, np.where(dry, np.minimum(EVSMX, EVSMXT + self.RINold), 0.0)
+        )
+        self.DSLR = np.where(wet, 1.0, np.where(dry, self.DSLR + 1, self.DSLR))
+
+        RINPRE = np.where(
+            p["IFUNRN"] == 0,
+            (1.0 - p["NOTINF"]) * rain,
+            (1.0 - p["NOTINF"] * self.NINFTB(rain)) * rain,
+        )
+        RINPRE = RINPRE + self.RIRR + self.SS
+        RINPRE = np.where(
+            self.SS > 0.1, np.minimum(p["SOPE"], RINPRE + self.RIRR - self.EVW), RINPRE
+        )
+
+        RD = self._rooting_depth(rd)
+        WE = p["SMFCF"] * RD
+        PERC1 = _limit(0.0, p["SOPE"], (self.W - WE) - self.WTRA - self.EVS)
+        WELOW = p["SMFCF"] * (self.RDM - RD)
+        self.LOSS = _limit(0.0, p["KSUB"], (self.WLOW - WELOW + PERC1))
+        PERC2 = ((self.RDM - RD) * p["SM0"] - self.WLOW) + self.LOSS
+        self.PERC = np.minimum(PERC1, PERC2)
+
+        self.RIN = np.minimum(
+            RINPRE, (p["SM0"] - self.SM) * RD + self.WTRA + self.EVS + self.PERC
+        )
+        self.RINold = self.RIN
+        self.DW = self.RIN - self.WTRA - self.EVS - self.PERC
+        self.DWLOW = self.PERC - self.LOSS
+
+        # no negative W, soil evaporation is reduced instead
+        Wtmp = self.W + self.DW
+        negative = Wtmp < 0.0
+        self.EVS = np.where(negative, self.EVS + Wtmp, self.EVS)
+        self.DW = np.where(negative, -self.W, self.DW)
+
+        SStmp = rain + self.RIRR - self.EVW - self.RIN
+        self.DSS = np.minimum(SStmp, (p["SSMAX"] - self.SS))
+        self.DTSR = SStmp - self.DSS
+        self.DRAINT = rain
+
+    def integrate(self, rd=None, delt=1.0):
+        """ States of the next day
+
+        Args:
+            rd (np.ndarray, optional): rooting depth RD of the crop after its integration.
+                Defaults to None (no crop).
+            delt (float, optional): time step in days. Defaults to 1.
+        """
+        p = self.params
+        self.WTRAT = self.WTRAT + self.WTRA * delt
+        self.EVWT = self.EVWT + self.EVW * delt
+        self.EVST = self.EVST + self.EVS * delt
+        self.RAINT = self.RAINT + self.DRAINT * delt
+        self.TOTINF = self.TOTINF + self.RIN * delt
+        self.TOTIRR = self.TOTIRR + self.RIRR * delt
+        self.SS = self.SS + self.DSS * delt
+        self.TSR = self.TSR + self.DTSR * delt
+        W = self.W + self.DW * delt
+        self.PERCT = self.PERCT + self.PERC * delt
+        self.LOSST = self.LOSST + self.LOSS * delt
+        WLOW = self.WLOW + self.DWLOW * delt
+        self.WWLOW = W + WLOW * delt
+
+        # water moves between the root zone and the lower zone with the rooting depth
+        RD = self._rooting_depth(rd)
+        RDchange = RD - self.RDold
+        with np.errstate(divide="ignore", invalid="ignore"):
+            WDR = np.where(
+                RDchange > 0.001,
+                np.minimum(WLOW, WLOW * RDchange / (p["RDMSOL"] - self.RDold)),
+                W * RDchange / self.RDold,
+            )
+        self.WLOW = WLOW - WDR
+        self.W = W + WDR
+        self.WDRT = self.WDRT + WDR
+
+        self.SM = self.W / RD
+        self.DSOS = np.where(self.SM >= (p["SM0"] - p["CRAIRC"]), self.DSOS + 1, 0)
+        self.RDold = RD
+
+    def balance(self):
+        """ Checksums of the root zone (WBALRT) and of the whole system (WBALTT), ~0 if closed """
+        WBALRT = self.TOTINF + self.WI + self.WDRT - self.EVST - self.WTRAT
+        WBALRT = WBALRT - self.PERCT - self.W
+        WBALTT = (
+            self.params["SSI"]
+            + self.RAINT
+            + self.TOTIRR
+            + self.WI
+            - self.W
+            + self.WLOWI
+        )
+        WBALTT = WBALTT - self.WLOW - self.WTRAT - self.EVWT - self.EVST - self.TSR
+        return WBALRT, WBALTT - self.LOSST - self.SS
+
+
+class BatchNPK:
+    """ N/P/K demand, uptake and soil supply of WofostNPK over a batch of fields
+
+    Array version of pcse.crop.nutrients NPK_Demand_Uptake and NPK_Soil_Dynamics. Nutrients are
+    along one axis (NUTRIENTS) and organs along another (ORGANS):
+        soil, avail (n, 3): NSOIL/PSOIL/KSOIL and NAVAIL/PAVAIL/KAVAIL
+        demand (n, 3, 4): NDEMLV ... KDEMSO
+        uptake (n, 3): RNUPTAKE, RPUPTAKE, RKUPTAKE
+        organ_uptake (n, 3, 4): RNULV ... RKUSO
+        fixation (n,): RNFIX
+    The crop growth itself (biomass, N/P/K amounts in organs, translocation) stays in the crop
+    model, its states are inputs. A day is integrate() then calc_rates(), as in the engine.
+
+    Args:
+        parameters (ParameterProvider or list): parameters with an active crop, shared by all
+            members or one provider per member (repeated if n is a multiple of their number)
+        n (int, optional): batch size. Defaults to None (number of providers).
+    """
+
+    def __init__(self, parameters, n=None):
+        providers, n = _providers(parameters, n)
+        self.n = n
+
+        def stack(pattern):
+            return np.stack([_stack(providers, pattern % k, n) for k in NUTRIENTS], 1)
+
+        self.soil_base = stack("%sSOILBASE")
+        self.soil_base_fr = stack("%sSOILBASE_FR")
+        self.background = stack("BG_%s_SUPPLY")
+        self.max_lv = [
+            BatchAfgen([p[f"{k}MAXLV_TB"] for p in providers] * (n // len(providers)))
+            for k in NUTRIENTS
+        ]
+        self.max_st_fr = stack("%sMAXST_FR")
+        self.max_rt_fr = stack("%sMAXRT_FR")
+        self.max_so = stack("%sMAXSO")
+        self.tc = stack("TC%sT")
+        self.nfix_fr = _stack(providers, "NFIX_FR", n)
+        self.dvs_stop = _stack(providers, "DVS_NPK_STOP", n)
+
+        self.soil = self.soil_base.copy()
+        self.avail = np.zeros((n, 3))
+        self.demand = np.zeros((n, 3, 4))
+        self.uptake = np.zeros((n, 3))
+        self.organ_uptake = np.zeros((n, 3, 4))
+        self.fixation = np.zeros(n)
+        self.rsoil = np.zeros((n, 3))
+        self.ravail = np.zeros((n, 3))
+
+    def calc_rates(self, dvs, rftra, translocatable, fertilizer=0.0):
+        """ Rates of the day
+
+        Args:
+            dvs (np.ndarray): DVS of the crop
+            rftra (np.ndarray): RFTRA of the crop
+            translocatable (np.ndarray): (n, 3) N/P/K TRANSLOCATABLE of the crop
+            fertilizer (np.ndarray, optional): (n, 3) effective N/P/K fertilizer supply
+                (amount * recovery) in kg/ha. Defaults to 0.
+        """
+        demand = self.demand
+        total = demand[..., 0] + demand[..., 1] + demand[..., 2]
+        self.organ_uptake[..., 3] = np.minimum(demand[..., 3], translocatable) / self.tc
+
+        active = np.where((dvs < self.dvs_stop) & (rftra > 0.01), 1.0, 0.0)
+        self.fixation = np.maximum(0.0, self.nfix_fr * total[:, 0]) * active
+        fixed = np.zeros((self.n, 3))
+        fixed[:, 0] = self.fixation
+        self.uptake = (
+            np.maximum(0.0, np.minimum(total - fixed, self.avail)) * active[:, None]
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            share = demand[..., :3] / total[..., None]
+        self.organ_uptake[..., :3] = np.where(
+            total[..., None] == 0.0, 0.0, share * (self.uptake + fixed)[..., None]
+        )
+
+        self.rsoil = -np.maximum(
+            0.0,
+            np.minimum(self.soil_base_fr * self.soil_base * active[:, None], self.soil),
+        )
+        self.ravail = fertilizer + self.background - self.uptake - self.rsoil
+
+    def integrate(self, dvs, biomass, amounts):
+        """ States of the next day
+
+        Args:
+            dvs (np.ndarray): DVS of the crop after its integration
+            biomass (np.ndarray): (n, 4) WLV, WST, WRT, WSO of the crop after its integration
+            amounts (np.ndarray): (n, 3, 4) ANLV ... AKSO of the crop after its integration
+        """
+        self.soil = self.soil + self.rsoil
+        self.avail = self.avail + self.ravail
+
+        max_lv = np.stack([table(dvs) for table in self.max_lv], 1)
+        maximum = np.stack(
+            [
+                max_lv,
+                self.max_st_fr * max_lv,
+                self.max_rt_fr * max_lv,
+                np.broadcast_to(self.max_so, max_lv.shape),
+            ],
+            2,
+        )
+        self.demand = np.maximum(maximum * biomass[:, None, :] - amounts, 0.0)
+
+
+def _crop_inputs(engine):
+    """ Crop variables of the reference engine read by the water balance and NPK modules """
+    kiosk = engine.kiosk
+
+    def get(name):
+        return kiosk[name] if name in kiosk else np.nan
+
+    npk = engine.crop.npk_soil_dynamics.rates if engine.crop is not None else None
+    return {
+        "TRA": get("TRA"),
+        "EVWMX": get("EVWMX"),
+        "EVSMX": get("EVSMX"),
+        "RD": get("RD"),
+        "DVS": get("DVS"),
+        "RFTRA": get("RFTRA"),
+        "translocatable": [get(f"{k}TRANSLOCATABLE") for k in NUTRIENTS],
+        "biomass": [get(f"W{o}") for o in ORGANS],
+        "amounts": [[get(f"A{k}{o}") for o in ORGANS] for k in NUTRIENTS],
+        "fertilizer": [getattr(npk, f"FERT_{k}_SUPPLY", 0.0) for k in NUTRIENTS],
+    }
+
+
+def _reference(engine):
+    """ Water balance and NPK variables of the reference engine """
+    soil = engine.soil
+    values = {k: getattr(soil.states, k) for k in WATERBALANCE_STATES}
+    values.update({k: getattr(soil.rates, k) for k in WATERBALANCE_RATES})
+    if engine.crop is not None:
+        npk_soil = engine.crop.npk_soil_dynamics
+        uptake = engine.crop.npk_crop_dynamics.demand_uptake
+        for k in NUTRIENTS:
+            values[f"{k}SOIL"] = getattr(npk_soil.states, f"{k}SOIL")
+            values[f"{k}AVAIL"] = getattr(npk_soil.states, f"{k}AVAIL")
+            values[f"R{k}UPTAKE"] = getattr(uptake.rates, f"R{k}UPTAKE")
+            for o in ORGANS:
+                values[f"{k}DEM{o}"] = getattr(uptake.states, f"{k}DEM{o}")
+                values[f"R{k}U{o}"] = getattr(uptake.rates, f"R{k}U{o}")
+        values["RNFIX"] = uptake.rates.RNFIX
+    return values
+
+
+def _batched(water, npk):
+    """ Same variables as _reference from the batch, (n,) arrays """
+    values = {k: getattr(water, k) for k in WATERBALANCE_STATES + WATERBALANCE_RATES}
+    for i, k in enumerate(NUTRIENTS):
+        values[f"{k}SOIL"] = npk.soil[:, i]
+        values[f"{k}AVAIL"] = npk.avail[:, i]
+        values[f"R{k}UPTAKE"] = npk.uptake[:, i]
+        for j, o in enumerate(ORGANS):
+            values[f"{k}DEM{o}"] = npk.demand[:, i, j]
+            values[f"R{k}U{o}"] = npk.organ_uptake[:, i, j]
+    values["RNFIX"] = npk.fixation
+    return values
+
+
+def validate_against_pcse(engine, advance=None, n=1, max_days=400):
+    """ Replay a reference PCSE run with the batched water balance and NPK core
+
+    The batch (n identical members) is driven with the weather, irrigation, fertilizer and crop
+    variables of the reference engine and compared with the states and rates of the reference
+    WaterbalanceFD and NPK modules every day, until the crop finishes.
+
+    Args:
+        engine (Engine): freshly initialized Wofost71_NPK engine with an emerged crop, e.g.
+            PcseEnv.engine after reset()
+        advance (function, optional): advances the reference by one day and returns True when
+            the run ended, e.g. the done flag of a PcseEnv.step. Defaults to None (engine.run(1)).
+        n (int, optional): batch size. Defaults to 1.
+        max_days (int, optional): maximum number of days. Defaults to 400.
+
+    Returns:
+        pd.Series: maximum absolute deviation per variable
+    """
+
+    advance = advance or (lambda: engine.run(1))
+    water = BatchWaterbalanceFD(engine.parameterprovider, n)
+    npk = BatchNPK(engine.parameterprovider, n)
+    deviation = {}
+
+    def rates(inputs):
+        drv = engine.drv
+        crop = [np.full(n, inputs[k]) for k in ("TRA", "EVWMX", "EVSMX", "RD")]
+        water.calc_rates(drv.RAIN, drv.E0, drv.ES0, engine.soil.rates.RIRR, *crop)
+        npk.calc_rates(
+            np.full(n, inputs["DVS"]),
+            np.full(n, inputs["RFTRA"]),
+            np.full((n, 3), inputs["translocatable"]),
+            np.full((n, 3), inputs["fertilizer"]),
+        )
+
+    def compare():
+        reference = _reference(engine)
+        batched = _batched(water, npk)
+        for name, value in reference.items():
+            error = np.max(np.abs(batched[name] - value))
+            deviation[name] = max(deviation.get(name, 0.0), error)
+
+    rates(_crop_inputs(engine))
+    compare()
+    for _ in range(max_days):
+        if advance() or engine.crop is None or engine.flag_terminate:
+            break
+        inputs = _crop_inputs(engine)
+        water.integrate(np.full(n, inputs["RD"]))
+        npk.integrate(
+            np.full(n, inputs["DVS"]),
+            np.full((n, 4), inputs["biomass"]),
+            np.full((n, 3, 4), inputs["amounts"]),
+        )
+        rates(inputs)
+        compare()
+    return pd.Series(deviation).sort_index()
@@ -0,0 +1,259 @@
+import copy
+import datetime
+import os
+from collections import namedtuple
+
+import pandas as pd
+from pcse.engine import Engine
+
+from .pcse_env import load_parameters, pcse_data_dir
+from .utils import NASAPowerWeatherDataFetcher
+
+CampaignResult = namedtuple("CampaignResult", ["seasons", "output", "terminal"])
+
+
+def _date(value):
+    if isinstance(value, str):
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+    return value
+
+
+def campaign(
+    start_date,
+    crop_start_date=None,
+    crop_name="wheat",
+    variety_name="winter-wheat",
+    crop_start_type="emergence",
+    crop_end_type="maturity",
+    crop_end_date=None,
+    max_duration=300,
+    irrigation=None,
+    fertilization=None,
+):
+    """ One campaign of an agromanagement (same layout as PcseEnv)
+
+    Every campaign has an irrigation and an N/P/K timed event table, so send_actions2engine can
+    add events to whatever campaign is running.
+
+    Args:
+        start_date (str or date): start of the campaign
+        crop_start_date (str or date, optional): emergence/sowing date. Defaults to None (start_date).
+        crop_name (str, optional): crop. Defaults to "wheat".
+        variety_name (str, optional): variety. Defaults to "winter-wheat".
+        crop_start_type (str, optional): "emergence" or "sowing". Defaults to "emergence".
+        crop_end_type (str, optional): "maturity", "harvest" or "earliest". Defaults to "maturity".
+        crop_end_date (str or date, optional): harvest date. Defaults to None.
+        max_duration (int, optional): max days of the crop cycle. Defaults to 300.
+        irrigation (dict, optional): {date: cm of water}. Defaults to None.
+        fertilization (dict, optional): {date: (N, P, K) in kg/ha}. Defaults to None.
+
+    Returns:
+        dict: {start date: campaign definition}
+    """
+
+    start_date = _date(start_date)
+    crop_start_date = _date(crop_start_date) or start_date
+    irrigation = irrigation or {}
+    fertilization = fertilization or {}
+
+    irrigation_table = [{start_date: {"amount": 0, "efficiency": 0.7}}]
+    irrigation_table += [
+        {_date(day): {"amount": amount, "efficiency": 0.7}}
+        for day, amount in sorted(irrigation.items())
+    ]
+    npk_table = [
+        {
+            start_date: {
+                "N_amount": 0,
+                "P_amount": 0,
+                "K_amount": 0,
+                "N_recovery": 0.7,
+                "P_recovery": 0.7,
+                "K_recovery": 0.7,
+            }
+        }
+    ]
+    npk_table += [
+        {
+            _date(day): {
+                "N_amount": n,
+                "P_amount": p,
+                "K_amount": k,
+                "N_recovery": 0.7,
+                "P_recovery": 0.7,
+                "K_recovery": 0.7,
+            }
+        }
+        for day, (n, p, k) in sorted(fertilization.items())
+    ]
+
+    return {
+        start_date: {
+            "CropCalendar": {
+                "crop_name": crop_name,
+                "variety_name": variety_name,
+                "crop_start_date": crop_start_date,
+                "crop_start_type": crop_start_type,
+                "crop_end_date": _date(crop_end_date),
+                "crop_end_type": crop_end_type,
+                "max_duration": max_duration,
+            },
+            "TimedEvents": [
+                {
+                    "event_signal": "irrigate",
+                    "name": "Irrigation application table",
+                    "comment": "All irrigation amounts in cm",
+                    "events_table": irrigation_table,
+                },
+                {
+                    "event_signal": "apply_npk",
+                    "name": "Timed N/P/K application table",
+                    "comment": "All fertilizer amounts in kg/ha",
+                    "events_table": npk_table,
+                },
+            ],
+            "StateEvents": None,
+        }
+    }
+
+
+def successive_seasons(first_year, n_seasons, month_day="01-01", **campaign_kwargs):
+    """ Agromanagement of the same crop grown every year, e.g. successive winter-wheat seasons
+
+    Args:
+        first_year (int): year of the first campaign
+        n_seasons (int): number of campaigns
+        month_day (str, optional): start (and emergence) of every campaign. Defaults to "01-01".
+        campaign_kwargs: keyword arguments of campaign, shared by all campaigns
+
+    Returns:
+        list: agromanagement for Engine / run_campaigns
+    """
+
+    return [
+        campaign(f"{first_year + ix}-{month_day}", **campaign_kwargs)
+        for ix in range(n_seasons)
+    ]
+
+
+def rotation(crops, first_year, month_day="01-01", **campaign_kwargs):
+    """ Agromanagement of a crop rotation, one campaign per year
+
+    Rotations of different crops need crop parameters of all crops, i.e. a ParameterProvider
+    built on a MultiCropDataProvider (e.g. pcse.fileinput.YAMLCropDataProvider).
+
+    Args:
+        crops (list): list of (crop_name, variety_name)
+        first_year (int): year of the first campaign
+        month_day (str, optional): start (and emergence) of every campaign. Defaults to "01-01".
+        campaign_kwargs: keyword arguments of campaign, shared by all campaigns
+
+    Returns:
+        list: agromanagement for Engine / run_campaigns
+    """
+
+    return [
+        campaign(
+            f"{first_year + ix}-{month_day}",
+            crop_name=crop_name,
+            variety_name=variety_name,
+            **campaign_kwargs,
+        )
+        for ix, (crop_name, variety_name) in enumerate(crops)
+    ]
+
+
+def _leftover_npk(engine):
+    """ N/P/K left in the soil at the end of the last crop cycle (NSOIL + NAVAIL) """
+    for rec in reversed(engine.get_output()):
+        if rec["NSOIL"] is not None:
+            return {
+                f"{n}SOILBASE": rec[f"{n}SOIL"] + (rec[f"{n}AVAIL"] or 0) for n in "NPK"
+            }
+    return {}
+
+
+def run_campaigns(
+    agromanagement,
+    lat=35,
+    long=128,
+    weather=None,
+    parameterprovider=None,
+    carry_npk=True,
+    overrides=None,
+):
+    """ Run all campaigns of an agromanagement in one engine
+
+    The soil water balance runs through all campaigns, only the crop is re-initialized at each
+    crop start. The soil N/P/K pools of WOFOST NPK belong to the crop and restart from
+    NSOILBASE/PSOILBASE/KSOILBASE every crop cycle, so with carry_npk the N/P/K left at the end
+    of a crop cycle becomes the base soil supply of the next one.
+
+    The engine runs on a copy of parameterprovider. PCSE clears parameter overrides when a crop
+    finishes, so overrides set on parameterprovider only hold for the first crop cycle: pass
+    them with overrides instead, they are applied again (with the carried N/P/K) before every
+    campaign start.
+
+    Args:
+        agromanagement (list): campaigns (see campaign, successive_seasons, rotation)
+        lat (int or float, optional): latitude. Defaults to 35.
+        long (int or float, optional): longitude. Defaults to 128.
+        weather (WeatherDataProvider, optional): weather. Defaults to None (NASA POWER of lat/long).
+        parameterprovider (ParameterProvider, optional): parameters. Defaults to None (load_parameters()).
+        carry_npk (bool, optional): carry N/P/K over to the next crop cycle. Defaults to True.
+        overrides (dict, optional): parameter overrides of every crop cycle. Defaults to None.
+
+    Returns:
+        CampaignResult: per-season summary (pd.DataFrame, one row per crop cycle), daily output
+            (pd.DataFrame indexed by day) and terminal output (dict)
+    """
+
+    if weather is None:
+        weather = NASAPowerWeatherDataFetcher(lat, long)
+    if parameterprovider is None:
+        params = load_parameters()
+    else:
+        params = copy.deepcopy(parameterprovider)
+    overrides = dict(overrides or {})
+    for name, value in overrides.items():
+        params.set_override(name, value)
+
+    engine = Engine(
+        params,
+        weather,
+        agromanagement,
+        config=os.path.join(pcse_data_dir, "Wofost71_NPK.conf"),
+    )
+    starts = [list(c.keys())[0] for c in agromanagement if c is not None]
+    for next_start in starts[1:]:
+        # the previous crop has finished (and its overrides were cleared), the next crop
+        # starts tomorrow with the overrides of the cycle
+        engine.run(days=(next_start - engine.day).days - 1)
+        cycle = dict(overrides)
+        if carry_npk:
+            cycle.update(_leftover_npk(engine))
+        params.clear_override()
+        for name, value in cycle.items():
+            params.set_override(name, value)
+    engine.run_till_terminate()
+
+    output = pd.DataFrame(engine.get_output()).set_index("day")
+    seasons = pd.DataFrame(engine.get_summary_output())
+    seasons.insert(0, "campaign_start", starts[: len(seasons)])
+    # soil state at the last day of each crop cycle
+    end_days = seasons["DOM"].where(seasons["DOM"].notna(), seasons["DOH"])
+    for varname in (
+        "SM",
+        "WWLOW",
+        "NSOIL",
+        "NAVAIL",
+        "PSOIL",
+        "PAVAIL",
+        "KSOIL",
+        "KAVAIL",
+    ):
+        seasons[varname] = [
+            output[varname].get(day) if pd.notna(day) else None for day in end_days
+        ]
+    terminal = engine.get_terminal_output()
+    return CampaignResult(seasons=seasons, output=output, terminal=terminal)
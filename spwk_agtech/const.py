@@ -158,3 +158,13 @@ ACTIONS = {
         "unit": "kg/ha",
     },
 }
+
+WEATHER_ACTIONS = ["IRRAD", "TMIN", "TMAX", "VAP", "RAIN", "E0", "ES0", "ET0", "WIND"]
+MANAGEMENT_ACTIONS = ["IRRIGATE", "N", "P", "K"]
+
+# Named subsets of ACTIONS for PcseEnv(controlled_actions=...)
+ACTION_SUBSETS = {
+    "all": list(ACTIONS.keys()),
+    "weather": WEATHER_ACTIONS,
+    "management": MANAGEMENT_ACTIONS,
+}
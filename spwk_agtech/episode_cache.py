@@ -0,0 +1,225 @@
+import hashlib
+import logging
+import os
+import pickle
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from .fork import fork_env
+
+EpisodeResult = namedtuple(
+    "EpisodeResult", ["rewards", "profit", "obs", "done", "steps"]
+)
+
+
+def config_digest(env, config=None):
+    """ Hash of everything but the actions that determines an episode of env
+
+    The weather is identified by the type of env.ref_weather and its location: two custom
+    providers of the same type and location (e.g. perturbed copies of one site) need a config.
+    Parameter overrides are read when the digest is taken, episodes run on their own copy of
+    them (check pcse_env.copy_parameters) so they do not change while the cache runs env.
+
+    Args:
+        env (PcseEnv): environment
+        config (object, optional): extra hashable description (e.g. of a custom weather).
+            Defaults to None.
+
+    Returns:
+        hashlib object: sha1 to be updated with the actions
+    """
+
+    overrides = None
+    if env.parameterprovider is not None:
+        overrides = sorted(dict(env.parameterprovider._override).items())
+    weather = env.ref_weather
+    key = (
+        env.lat,
+        env.long,
+        env.crop_name,
+        env.variety_name,
+        env.campaign_start_date,
+        env.emergence_date,
+        overrides,
+        (
+            f"{type(weather).__module__}.{type(weather).__qualname__}",
+            getattr(weather, "latitude", None),
+            getattr(weather, "longitude", None),
+        ),
+        getattr(env, "termination", None),
+        config,
+    )
+    return hashlib.sha1(repr(key).encode())
+
+
+class EpisodeCache:
+    """ Memoization of deterministic PcseEnv episodes keyed by their action sequence
+
+    Episodes are keyed by a hash of the env config and of the denormalized actions, so schedules
+    that only differ by clipping share their results. evaluate() returns stored outcomes of
+    sequences already run, otherwise resumes from the longest cached prefix state (engine
+    snapshots taken every snapshot_every steps, check fork.py) and only simulates the rest.
+    Both outcomes and snapshots are evicted in LRU order.
+
+    Outcomes can be persisted with save() and are loaded back when path exists. Snapshots hold
+    live engines and stay in memory.
+
+    Example:
+        cache = EpisodeCache(path="episodes.pkl")
+        for schedule in candidates:
+            result = cache.evaluate(env, schedule)
+        cache.save()
+
+    Args:
+        maxsize (int, optional): max number of stored outcomes. Defaults to 4096.
+        max_snapshots (int, optional): max number of stored prefix states. Defaults to 64.
+        snapshot_every (int, optional): steps between prefix states, 0 disables them. Defaults to 16.
+        path (str, optional): pickle file of the outcomes. Defaults to None (memory only).
+    """
+
+    def __init__(self, maxsize=4096, max_snapshots=64, snapshot_every=16, path=None):
+        self.maxsize = maxsize
+        self.max_snapshots = max_snapshots
+        self.snapshot_every = snapshot_every
+        self.path = path
+        self.results = OrderedDict()
+        self.snapshots = OrderedDict()
+        self.stats = {"hits": 0, "resumed": 0, "misses": 0, "steps": 0}
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self.results)
+
+    def _put(self, store, maxsize, key, value):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > maxsize:
+            store.popitem(last=False)
+
+    def prefix_keys(self, env, actions, config=None):
+        """ Keys of all prefixes of an action sequence
+
+        Args:
+            env (PcseEnv): environment
+            actions (np.ndarray): normalized actions of shape (n, action dims)
+            config (object, optional): check config_digest. Defaults to None.
+
+        Returns:
+            list: n + 1 keys, keys[k] is the key of the first k actions
+        """
+        physical = env.denorm(np.asarray(actions, dtype=np.float32), "act")
+        digest = config_digest(env, config)
+        keys = [digest.hexdigest()]
+        for action in physical:
+            digest.update(action.tobytes())
+            keys.append(digest.hexdigest())
+        return keys
+
+    def evaluate(self, env, actions, config=None):
+        """ Run (or look up) the episode of env with a sequence of actions
+
+        Actions after the end of the episode are ignored. If the episode does not end within
+        the actions, the result of the partial episode is returned with done False.
+
+        Args:
+            env (PcseEnv): environment, reset when the episode has to be run from the start
+            actions (np.ndarray): normalized actions of shape (n, action dims)
+            config (object, optional): check config_digest. Defaults to None.
+
+        Returns:
+            EpisodeResult: rewards, profit, last observation, done and number of steps
+        """
+
+        actions = np.asarray(actions, dtype=np.float32)
+        keys = self.prefix_keys(env, actions, config)
+        n = len(actions)
+
+        for k, key in enumerate(keys):
+            result = self.results.get(key)
+            if result is not None and (result.done or k == n):
+                self.results.move_to_end(key)
+                self.stats["hits"] += 1
+                return result
+
+        start = 0
+        for k in range(n, 0, -1):
+            if keys[k] in self.snapshots:
+                start = k
+                break
+        if start:
+            snapshot, rewards = self.snapshots[keys[start]]
+            self.snapshots.move_to_end(keys[start])
+            work = fork_env(snapshot)
+            rewards = list(rewards)
+            self.stats["resumed"] += 1
+        else:
+            work = env
+            work.reset()
+            rewards = []
+            self.stats["misses"] += 1
+
+        done = work.done
+        for k in range(start, n):
+            if done:
+                break
+            _, reward, done, _ = work.step(actions[k])
+            rewards.append(reward)
+            self.stats["steps"] += 1
+            if (
+                not done
+                and self.snapshot_every
+                and (k + 1) % self.snapshot_every == 0
+                and keys[k + 1] not in self.snapshots
+            ):
+                self._put(
+                    self.snapshots,
+                    self.max_snapshots,
+                    keys[k + 1],
+                    (fork_env(work), tuple(rewards)),
+                )
+
+        result = EpisodeResult(
+            rewards=tuple(rewards),
+            profit=work.profit,
+            obs=work.obs.copy(),
+            done=done,
+            steps=len(rewards),
+        )
+        self._put(self.results, self.maxsize, keys[len(rewards)], result)
+        return result
+
+    def clear(self):
+        """ Drop all outcomes and snapshots """
+        self.results.clear()
+        self.snapshots.clear()
+
+    def save(self, path=None):
+        """ Write the outcomes to a pickle file (atomic replace)
+
+        Args:
+            path (str, optional): file. Defaults to None (self.path).
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path to save the episode cache.")
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, "wb") as f:
+            pickle.dump(dict(self.results), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        """ Add the outcomes of a pickle file written by save()
+
+        Args:
+            path (str): file
+        """
+        try:
+            with open(path, "rb") as f:
+                results = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logging.error(f"Cannot load episode cache {path}: {e}")
+            return
+        for key, result in results.items():
+            self._put(self.results, self.maxsize, key, EpisodeResult(*result))
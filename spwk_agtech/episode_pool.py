@@ -0,0 +1,319 @@
+import collections
+import logging
+import multiprocessing as mp
+import os
+import queue
+import time
+
+import pandas as pd
+
+from .pcse_env import PcseEnv, load_parameters
+from .sweep import episode_summary, no_management_policy
+from .utils import pcse_runner
+
+# Keys of a task read by the workers, other keys are copied to the result row
+TASK_FIELDS = ("design", "env_kwargs", "policy", "trajectory")
+# Seconds between liveness checks of the workers while waiting for results
+POLL_INTERVAL = 1.0
+
+
+class _EpisodeRunner:
+    """ Worker-side state: the environments of the worker, one per distinct env_kwargs
+
+    Environments are kept with their own parsed ParameterProvider and reused by later tasks with
+    the same env_kwargs. The least recently used one is dropped beyond max_envs.
+    """
+
+    def __init__(self, worker, policy, env_kwargs, max_envs):
+        self.worker = worker
+        self.policy = policy
+        self.env_kwargs = env_kwargs
+        self.max_envs = max_envs
+        self.envs = collections.OrderedDict()
+
+    def env(self, env_kwargs):
+        kwargs = {**self.env_kwargs, **(env_kwargs or {})}
+        key = repr(sorted(kwargs.items()))
+        if key in self.envs:
+            self.envs.move_to_end(key)
+            return self.envs[key]
+        env = PcseEnv(parameterprovider=load_parameters(), **kwargs)
+        self.envs[key] = env
+        if len(self.envs) > self.max_envs:
+            self.envs.popitem(last=False)[1].close()
+        return env
+
+    def run(self, ix, task):
+        start = time.perf_counter()
+        design = task.get("design") or {}
+        env = self.env(task.get("env_kwargs"))
+        params = env.parameterprovider
+        params.clear_override()
+        for name, value in design.items():
+            params.set_override(name, value)
+        try:
+            actions, rewards = pcse_runner(env, task.get("policy") or self.policy)
+        finally:
+            params.clear_override()
+
+        row = {"run": ix, "worker": self.worker}
+        row.update((k, v) for k, v in task.items() if k not in TASK_FIELDS)
+        row.update(design)
+        row.update(episode_summary(env, actions, rewards))
+        if task.get("trajectory"):
+            row["actions"] = actions
+            row["rewards"] = rewards
+        row["seconds"] = time.perf_counter() - start
+        return row
+
+    def close(self):
+        for env in self.envs.values():
+            env.close()
+        self.envs.clear()
+
+
+def _worker(worker, tasks, results, policy, env_kwargs, max_envs):
+    """ Worker process loop. Takes one task at a time from the shared queue until None
+
+    Args:
+        worker (int): worker index, reported in the rows
+        tasks (Queue): shared queue of (ix, task) items
+        results (Queue): queue of (ix, ok, row or exception) items
+        policy (function or class): default policy of the tasks
+        env_kwargs (dict): default keyword arguments of PcseEnv
+        max_envs (int): environments kept by the worker
+    """
+    runner = _EpisodeRunner(worker, policy, env_kwargs, max_envs)
+    while True:
+        try:
+            item = tasks.get()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if item is None:
+            break
+        ix, task = item
+        try:
+            results.put((ix, True, runner.run(ix, task)))
+        except Exception as e:
+            results.put((ix, False, e))
+    runner.close()
+
+
+class EpisodePool:
+    """ Process pool running whole episodes pulled from a shared queue, in completion order
+
+    Episodes end at very different lengths (maturity or the 365-day limit, depending on the
+    weather and management), so lockstep vectorization (pcse_batch_runner) and pre-assigned
+    chunks leave cores waiting on the longest episode. Here every worker takes the next episode
+    from one shared task queue as soon as it finishes the previous one: an idle worker always
+    picks up the remaining work, and throughput tracks the total simulated days rather than the
+    slowest episode. Results are yielded as they complete.
+
+    Workers keep their environments (and parsed parameters) between tasks, one per distinct
+    env_kwargs, so a task only costs the reset and the episode. At most max_queued tasks are
+    queued at a time, so tasks can be a lazy iterable of any length.
+
+    A task is a dict with optional keys:
+        design (dict): parameter overrides of the episode (see sweep.parameter_grid)
+        env_kwargs (dict): keyword arguments of PcseEnv, merged over the pool's env_kwargs
+        policy (function or class): picklable policy, see pcse_runner. Defaults to the pool's policy.
+        trajectory (bool): also return the "actions" and "rewards" of the episode
+    Other keys (e.g. "seed", "site") are copied to the result row.
+
+    Example:
+        tasks = [{"env_kwargs": {"lat": lat, "long": long}, "site": i} for i, (lat, long) in enumerate(sites)]
+        with EpisodePool(processes=8) as pool:
+            for row in pool.imap_unordered(tasks):
+                print(row["run"], row["profit"])
+
+    Args:
+        processes (int, optional): number of worker processes, 1 runs in this process.
+            Defaults to None (os.cpu_count()).
+        policy (function or class, optional): default policy. Defaults to no_management_policy.
+        env_kwargs (dict, optional): default keyword arguments of PcseEnv. Defaults to None.
+        max_queued (int, optional): tasks queued ahead of the workers. Defaults to None (4 per process).
+        max_envs (int, optional): environments kept per worker. Defaults to 8.
+        mp_context (str, optional): multiprocessing start method. Defaults to None (platform default).
+    """
+
+    def __init__(
+        self,
+        processes=None,
+        policy=no_management_policy,
+        env_kwargs=None,
+        max_queued=None,
+        max_envs=8,
+        mp_context=None,
+    ):
+        self.processes = processes or os.cpu_count()
+        self.policy = policy
+        self.env_kwargs = env_kwargs or {}
+        self.max_queued = max_queued or 4 * self.processes
+        self.max_envs = max_envs
+        self.ctx = mp.get_context(mp_context)
+        self.workers = []
+        self.stats = {}
+        self._tasks = None
+        self._results = None
+        self._runner = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        if self.processes == 1:
+            if self._runner is None:
+                self._runner = _EpisodeRunner(
+                    0, self.policy, self.env_kwargs, self.max_envs
+                )
+            return self
+        if self.workers:
+            return self
+        self._tasks = self.ctx.Queue()
+        self._results = self.ctx.Queue()
+        for worker in range(self.processes):
+            process = self.ctx.Process(
+                target=_worker,
+                args=(
+                    worker,
+                    self._tasks,
+                    self._results,
+                    self.policy,
+                    self.env_kwargs,
+                    self.max_envs,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self.workers.append(process)
+        return self
+
+    def close(self):
+        """ Stop the workers, after their current task """
+        if self._runner is not None:
+            self._runner.close()
+            self._runner = None
+        for _ in self.workers:
+            self._tasks.put(None)
+        for process in self.workers:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self._stop()
+
+    def terminate(self):
+        """ Stop the workers now, abandoning queued tasks """
+        for process in self.workers:
+            process.terminate()
+        for process in self.workers:
+            process.join()
+        self._stop()
+
+    def _stop(self):
+        for q in (self._tasks, self._results):
+            if q is not None:
+                q.close()
+                q.cancel_join_thread()
+        self.workers = []
+        self._tasks = None
+        self._results = None
+
+    def _get(self):
+        while True:
+            try:
+                return self._results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                dead = [p.exitcode for p in self.workers if not p.is_alive()]
+                if dead:
+                    raise RuntimeError(
+                        f"{len(dead)} worker(s) exited (exit codes {dead})."
+                    )
+
+    def imap_unordered(self, tasks):
+        """ Run one episode per task, yielding the result rows in completion order
+
+        If an episode raises, its exception is raised here and the workers are terminated (the
+        next call starts new ones).
+
+        Args:
+            tasks (iterable): task dicts (see EpisodePool), None for a default task
+
+        Yields:
+            dict: "run" (index of the task), "worker", the extra keys and design of the task,
+                episode_summary, "seconds" of the worker, and "actions" and "rewards" if asked
+        """
+
+        self.start()
+        start = time.perf_counter()
+        self.stats = {"episodes": 0, "days": 0, "busy": 0.0}
+        tasks = enumerate(task or {} for task in tasks)
+        if self.processes == 1:
+            for ix, task in tasks:
+                yield self._record(self._runner.run(ix, task), start)
+            return
+
+        pending = 0
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and pending < self.max_queued:
+                    item = next(tasks, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    self._tasks.put(item)
+                    pending += 1
+                if not pending:
+                    break
+                ix, ok, result = self._get()
+                pending -= 1
+                if not ok:
+                    raise result
+                yield self._record(result, start)
+        finally:
+            if pending:
+                # abandoned (exception or generator closed): queued tasks must not leak into
+                # the next call
+                self.terminate()
+
+    def _record(self, row, start):
+        stats = self.stats
+        stats["episodes"] += 1
+        stats["days"] += row["days"]
+        stats["busy"] += row["seconds"]
+        stats["seconds"] = time.perf_counter() - start
+        stats["days_per_second"] = stats["days"] / stats["seconds"]
+        stats["utilization"] = stats["busy"] / (stats["seconds"] * self.processes)
+        return row
+
+    def run(self, tasks, output=None):
+        """ Run all tasks and collect the rows (see imap_unordered)
+
+        Tasks may have different keys (designs, extra keys, trajectories), missing values of a
+        row are NaN.
+
+        Args:
+            tasks (iterable): task dicts (see EpisodePool)
+            output (str, optional): CSV file the rows are written to at the end. Defaults to None.
+
+        Returns:
+            pd.DataFrame: one row per task, in task order
+        """
+
+        rows = list(self.imap_unordered(tasks))
+        df = pd.DataFrame(rows)
+        if rows:
+            df = df.sort_values("run").reset_index(drop=True)
+        if output is not None:
+            df.to_csv(output, index=False)
+        stats = self.stats
+        if stats.get("episodes"):
+            logging.info(
+                f"{stats['episodes']} episodes, {stats['days']} days in "
+                f"{stats['seconds']:.1f} s ({stats['days_per_second']:.0f} days/s, "
+                f"{stats['utilization']:.0%} utilization)"
+            )
+        return df
@@ -0,0 +1,254 @@
+import datetime
+
+import gym
+import numpy as np
+from gym.spaces import Box
+
+from .const import MANAGEMENT_ACTIONS, OBSERVATIONS, WEATHER_ACTIONS
+from .scaling import ACTION_SCALING
+
+# Features in the order they are concatenated after the observation
+FEATURES = [
+    "weather_mean",
+    "weather_std",
+    "cumulative_inputs",
+    "days_since_emergence",
+    "deltas",
+]
+
+# Cumulative IRRIGATE (cm), N, P, K (kg/ha) mapped to 1 in the features
+INPUT_SCALE = np.array([50, 200, 200, 200], dtype=np.float32)
+
+_WEATHER_SCALING = ACTION_SCALING.subset(list(range(len(WEATHER_ACTIONS))))
+
+
+class RingBuffer:
+    """ Fixed-size ring buffers over a batch with running sum and sum of squares
+
+    push() is O(1) in the window size, mean() and std() are read from the running sums.
+
+    Args:
+        n (int): batch size
+        size (int): window size
+        dim (int): values per push
+    """
+
+    def __init__(self, n, size, dim):
+        self.size = size
+        self.data = np.zeros((n, size, dim), dtype=np.float64)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.sum = np.zeros((n, dim), dtype=np.float64)
+        self.sumsq = np.zeros((n, dim), dtype=np.float64)
+
+    def reset(self, index=slice(None)):
+        self.data[index] = 0
+        self.count[index] = 0
+        self.sum[index] = 0
+        self.sumsq[index] = 0
+
+    def push(self, values):
+        """ Add one row per batch member, returns the rows leaving the window (or zeros) """
+        rows = np.arange(len(self.count))
+        pos = self.count % self.size
+        old = self.data[rows, pos].copy()
+        self.data[rows, pos] = values
+        self.sum += values - old
+        self.sumsq += values * values - old * old
+        self.count += 1
+        return old
+
+    def oldest(self):
+        """ Oldest row of each window (the first one while the window fills) """
+        rows = np.arange(len(self.count))
+        pos = np.where(self.count < self.size, 0, self.count % self.size)
+        return self.data[rows, pos]
+
+    def mean(self):
+        return self.sum / np.maximum(np.minimum(self.count, self.size), 1)[:, None]
+
+    def std(self):
+        var = self.sumsq / np.maximum(np.minimum(self.count, self.size), 1)[:, None]
+        return np.sqrt(np.maximum(var - self.mean() ** 2, 0))
+
+
+class BatchFeatures:
+    """ Incremental derived features of a batch of environments
+
+    Features are updated from the step data only (no engine output DataFrame):
+        weather_mean / weather_std: rolling stats of the normalized weather over window days
+        cumulative_inputs: IRRIGATE, N, P, K applied since reset, divided by INPUT_SCALE
+        days_since_emergence: days since emergence / 365
+        deltas: normalized observation minus the one lag days before
+
+    Args:
+        n (int): batch size
+        features (list, optional): subset of FEATURES. Defaults to None (all).
+        window (int, optional): days of the rolling weather stats. Defaults to 7.
+        lag (int, optional): days of the observation deltas. Defaults to 7.
+    """
+
+    def __init__(self, n, features=None, window=7, lag=7):
+        self.features = [k for k in FEATURES if features is None or k in features]
+        unknown = set(features or []) - set(FEATURES)
+        if unknown:
+            raise ValueError(f"Unknown feature(s) {unknown}. Check FEATURES.")
+        self.n = n
+        self.weather = RingBuffer(n, window, len(WEATHER_ACTIONS))
+        self.history = RingBuffer(n, lag, len(OBSERVATIONS))
+        self.inputs = np.zeros((n, len(MANAGEMENT_ACTIONS)), dtype=np.float64)
+        self.days = np.zeros(n, dtype=np.float64)
+        self.obs = np.zeros((n, len(OBSERVATIONS)), dtype=np.float64)
+
+        n_obs, n_weather = len(OBSERVATIONS), len(WEATHER_ACTIONS)
+        bounds = {
+            "weather_mean": ([-1] * n_weather, [1] * n_weather),
+            "weather_std": ([0] * n_weather, [1] * n_weather),
+            "cumulative_inputs": ([0] * 4, [np.inf] * 4),
+            "days_since_emergence": ([0], [np.inf]),
+            "deltas": ([-2] * n_obs, [2] * n_obs),
+        }
+        low = [-1] * n_obs + sum((bounds[k][0] for k in self.features), [])
+        high = [1] * n_obs + sum((bounds[k][1] for k in self.features), [])
+        self.observation_space = Box(
+            low=np.array(low, dtype=np.float32), high=np.array(high, dtype=np.float32)
+        )
+
+    def reset(self, obs, index=slice(None)):
+        """ Start new episodes
+
+        Args:
+            obs (np.ndarray): first normalized observations of the reset members
+            index (slice or array, optional): reset members. Defaults to all.
+
+        Returns:
+            np.ndarray: features of the reset members
+        """
+        self.weather.reset(index)
+        self.history.reset(index)
+        self.inputs[index] = 0
+        self.days[index] = 0
+        self.obs[index] = obs
+        return self.features_of()[index]
+
+    def update(self, obs, weather, actions, days):
+        """ Advance all members by one step
+
+        Args:
+            obs (np.ndarray): (n, 11) normalized observations after the step
+            weather (np.ndarray): (n, 9) physical weather of the simulated day (NaN if unknown)
+            actions (np.ndarray): (n, 13) physical actions of the step
+            days (np.ndarray): (n,) days since emergence
+
+        Returns:
+            np.ndarray: (n, features) float32 features
+        """
+        if "deltas" in self.features:
+            self.history.push(self.obs)
+        if "weather_mean" in self.features or "weather_std" in self.features:
+            self.weather.push(np.nan_to_num(_WEATHER_SCALING.norm(weather)))
+        self.inputs += np.nan_to_num(np.asarray(actions, dtype=np.float64)[:, 9:])
+        self.days[:] = days
+        self.obs[:] = obs
+        return self.features_of()
+
+    def features_of(self):
+        parts = [self.obs]
+        for name in self.features:
+            if name == "weather_mean":
+                parts.append(self.weather.mean())
+            elif name == "weather_std":
+                parts.append(self.weather.std())
+            elif name == "cumulative_inputs":
+                parts.append(self.inputs / INPUT_SCALE)
+            elif name == "days_since_emergence":
+                parts.append(self.days[:, None] / 365)
+            elif name == "deltas":
+                parts.append(self.obs - self.history.oldest())
+        return np.concatenate(parts, axis=1).astype(np.float32)
+
+
+def _step_data(env, action):
+    """ Physical weather of the simulated day, physical action and days since emergence """
+    drv = env.engine.drv
+    weather = np.array([getattr(drv, k, np.nan) for k in WEATHER_ACTIONS])
+    emergence = datetime.datetime.strptime(env.emergence_date, "%Y-%m-%d").date()
+    days = max((env.engine.day - emergence).days, 0)
+    return weather, env.denorm(np.asarray(action, dtype=np.float32), "act"), days
+
+
+class FeatureWrapper(gym.Wrapper):
+    """ PcseEnv with the observation extended by incremental derived features (see BatchFeatures)
+
+    Args:
+        env (PcseEnv): environment
+        features (list, optional): subset of FEATURES. Defaults to None (all).
+        window (int, optional): days of the rolling weather stats. Defaults to 7.
+        lag (int, optional): days of the observation deltas. Defaults to 7.
+    """
+
+    def __init__(self, env, features=None, window=7, lag=7):
+        super().__init__(env)
+        self.state = BatchFeatures(1, features, window, lag)
+        self.observation_space = self.state.observation_space
+
+    def reset(self, **kwargs):
+        obs = self.env.reset(**kwargs)
+        return self.state.reset(obs[None])[0]
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        weather, physical, days = _step_data(self.env, action)
+        features = self.state.update(obs[None], weather[None], physical[None], [days])
+        return features[0], reward, done, info
+
+
+class BatchFeatureWrapper:
+    """ List of PcseEnv stepped together with batched features
+
+    Finished environments are reset automatically: the returned observation is then the first
+    one of the next episode and the last one is in info["terminal_observation"].
+
+    Args:
+        envs (list): list of PcseEnv
+        features (list, optional): subset of FEATURES. Defaults to None (all).
+        window (int, optional): days of the rolling weather stats. Defaults to 7.
+        lag (int, optional): days of the observation deltas. Defaults to 7.
+    """
+
+    def __init__(self, envs, features=None, window=7, lag=7):
+        self.envs = list(envs)
+        self.state = BatchFeatures(len(self.envs), features, window, lag)
+        self.observation_space = self.state.observation_space
+        self.action_space = self.envs[0].action_space
+
+    def reset(self):
+        obs = np.stack([env.reset() for env in self.envs])
+        return self.state.reset(obs)
+
+    def step(self, actions):
+        """ Step all environments
+
+        Args:
+            actions (np.ndarray): (n, action dims) normalized actions
+
+        Returns:
+            tuple(np.ndarray, np.ndarray, np.ndarray, list): features, rewards, dones, infos
+        """
+        n = len(self.envs)
+        obs = np.zeros((n, len(OBSERVATIONS)), dtype=np.float32)
+        weather = np.zeros((n, len(WEATHER_ACTIONS)))
+        physical = np.zeros((n, len(ACTION_SCALING)))
+        days = np.zeros(n)
+        rewards = np.zeros(n)
+        dones = np.zeros(n, dtype=bool)
+        infos = []
+        for ix, (env, action) in enumerate(zip(self.envs, actions)):
+            obs[ix], rewards[ix], dones[ix], info = env.step(action)
+            weather[ix], physical[ix], days[ix] = _step_data(env, action)
+            infos.append(info)
+
+        features = self.state.update(obs, weather, physical, days)
+        for ix in np.flatnonzero(dones):
+            infos[ix]["terminal_observation"] = features[ix].copy()
+            features[ix] = self.state.reset(self.envs[ix].reset()[None], [ix])[0]
+        return features, rewards, dones, infos
@@ -0,0 +1,181 @@
+import copy
+
+from pcse.base import VariableKiosk, WeatherDataProvider
+from pcse.decorators import descript
+from pcse.pydispatch import dispatcher
+from pcse.traitlets import HasTraits
+
+from .metrics import EnvMetrics
+from .pcse_env import copy_parameters
+
+
+class OverlayWeatherDataProvider(WeatherDataProvider):
+    """ Copy-on-read view of a reference WeatherDataProvider
+
+    Weather data containers are copied from the reference provider the first time a day is
+    requested and kept in a private store, so changes made to them (e.g. by send_actions2engine)
+    never reach the reference. Creating an overlay costs nothing, unlike a deepcopy of the
+    whole weather history.
+
+    Args:
+        base (WeatherDataProvider): reference weather, never modified
+    """
+
+    def __init__(self, base):
+        WeatherDataProvider.__init__(self)
+        self.base = base
+        self.latitude = base.latitude
+        self.longitude = base.longitude
+        self.elevation = base.elevation
+        self.angstA = base.angstA
+        self.angstB = base.angstB
+        self.ETmodel = base.ETmodel
+        self.description = base.description
+
+    @property
+    def first_date(self):
+        return self.base.first_date
+
+    @property
+    def last_date(self):
+        return self.base.last_date
+
+    @property
+    def missing(self):
+        return self.base.missing
+
+    def export(self):
+        weather_data = []
+        for rec in self.base.export():
+            wdc = self(rec["DAY"])
+            weather_data.append(
+                {k: getattr(wdc, k) for k in wdc.__slots__ if hasattr(wdc, k)}
+            )
+        return weather_data
+
+    def __call__(self, day, member_id=0):
+        keydate = self.check_keydate(day)
+        wdc = self.store.get((keydate, member_id))
+        if wdc is None:
+            wdc = copy.copy(self.base(keydate, member_id))
+            self.store[(keydate, member_id)] = wdc
+        return wdc
+
+    def __deepcopy__(self, memo):
+        overlay = OverlayWeatherDataProvider(self.base)
+        overlay.store = {k: copy.copy(v) for k, v in self.store.items()}
+        return overlay
+
+
+def _rebind(handler, memo):
+    """ Bound method of the clone corresponding to a bound method of the original """
+    owner = getattr(handler, "__self__", None)
+    if owner is None or id(owner) not in memo:
+        return handler
+    return getattr(memo[id(owner)], handler.__func__.__name__)
+
+
+def clone_engine(engine, weatherdataprovider=None):
+    """ In-memory copy of a running PCSE engine
+
+    A plain deepcopy of an engine does not run: PCSE objects are registered in the variable
+    kiosk by id(), signals are connected through the global dispatcher, published variables
+    are updated through trait observers (dropped when copying) and the state/rate decorators
+    cache wrappers bound to the original objects. These are all re-created for the clone.
+    The clone gets its own parameter provider over the same parsed parameters (check
+    copy_parameters), as PCSE clears the overrides when the crop finishes. The model
+    configuration is shared with the original, and so are the rows of the daily output (they
+    are never modified once appended, the clone gets its own list).
+
+    Args:
+        engine (Engine): engine to clone
+        weatherdataprovider (WeatherDataProvider, optional): weather of the clone.
+            Defaults to None (deepcopy of the weather of engine).
+
+    Returns:
+        Engine: independent engine in the same state
+    """
+
+    if weatherdataprovider is None:
+        weatherdataprovider = copy.deepcopy(engine.weatherdataprovider)
+
+    old_kiosk = engine.kiosk
+    new_kiosk = VariableKiosk()
+    dict.update(new_kiosk, old_kiosk)
+    params = copy_parameters(engine.parameterprovider)
+    params._ncrops_activated = engine.parameterprovider._ncrops_activated
+    memo = {
+        id(engine.weatherdataprovider): weatherdataprovider,
+        id(engine.parameterprovider): params,
+        id(engine.mconf): engine.mconf,
+        id(old_kiosk): new_kiosk,
+        id(engine._saved_output): list(engine._saved_output),
+    }
+    clone = copy.deepcopy(engine, memo)
+
+    # kiosk registrations are keyed by id() of the state/rate objects
+    for attr in (
+        "registered_states",
+        "registered_rates",
+        "published_states",
+        "published_rates",
+    ):
+        registrations = getattr(old_kiosk, attr)
+        setattr(
+            new_kiosk,
+            attr,
+            {k: id(memo[v]) if v in memo else v for k, v in registrations.items()},
+        )
+
+    # deepcopy keeps the originals alive in memo[id(memo)]
+    for obj in memo[id(memo)]:
+        new = memo.get(id(obj))
+        if isinstance(obj, HasTraits) and obj._trait_notifiers:
+            for name, types in obj._trait_notifiers.items():
+                for type_, handlers in types.items():
+                    for handler in handlers:
+                        new.observe(_rebind(handler, memo), names=name, type=type_)
+        # drop wrappers cached by @prepare_rates/@prepare_states, they are bound to obj
+        new_dict = getattr(new, "__dict__", None)
+        if new_dict:
+            for name in list(new_dict):
+                if any(
+                    isinstance(klass.__dict__.get(name), descript)
+                    for klass in type(new).__mro__
+                ):
+                    del new_dict[name]
+
+    for signal, receivers in dispatcher.connections.get(id(old_kiosk), {}).items():
+        for receiver in receivers:
+            receiver = receiver()
+            if receiver is not None:
+                dispatcher.connect(_rebind(receiver, memo), signal, sender=new_kiosk)
+
+    return clone
+
+
+def fork_env(env):
+    """ Independent copy of a PcseEnv in the middle of an episode
+
+    The copy shares the reference weather and parsed parameters of env (with its own
+    overrides), and continues from the same engine state, observation, accumulated profit and termination predicate state.
+    Predicates are copied so stepping the fork leaves env untouched, and the fork has its own
+    metrics (new EnvMetrics with the buckets and prefix of env's) and no renderer.
+
+    Args:
+        env (PcseEnv): environment to fork (after reset)
+
+    Returns:
+        PcseEnv: forked environment
+    """
+
+    forked = copy.copy(env)
+    forked.termination = copy.deepcopy(env.termination)
+    if env.metrics is not None:
+        forked.metrics = EnvMetrics(env.metrics.buckets, env.metrics.prefix)
+        forked._timer = forked.metrics.timer
+    forked._renderer = None
+    forked.weather = OverlayWeatherDataProvider(env.ref_weather)
+    forked.engine = clone_engine(env.engine, forked.weather)
+    forked.params = forked.engine.parameterprovider
+    return forked
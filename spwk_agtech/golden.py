@@ -0,0 +1,369 @@
+import argparse
+import asyncio
+import time
+
+import numpy as np
+import pandas as pd
+
+from .aio import AsyncEnvPool
+from .const import ACTIONS, MANAGEMENT_ACTIONS, OBSERVATIONS, WEATHER_ACTIONS
+from .fork import OverlayWeatherDataProvider, fork_env
+from .pcse_env import PcseEnv, load_parameters
+from .shared_weather import (
+    ArrayWeatherDataProvider,
+    SharedWeatherDataProvider,
+    SharedWeatherStore,
+    _pack_weather,
+)
+from .utils import NASAPowerWeatherDataFetcher, pcse_batch_runner
+
+# Seeds of the golden action sequences, seed 0 is the no-management episode
+GOLDEN_SEEDS = (0, 1, 2, 3)
+# Compared variables, the observations then the reward of every step and the final profit
+VARIABLES = list(OBSERVATIONS) + ["reward", "profit"]
+
+
+def action_sequences(
+    seeds=GOLDEN_SEEDS, length=366, event_rate=0.05, weather_rate=0.02
+):
+    """ Seeded sequences of normalized actions, longer than any episode
+
+    Irrigation and N/P/K are applied on random days (none for seed 0). Odd seeds also override
+    the reference weather with random values on random days.
+
+    Args:
+        seeds (tuple, optional): seeds. Defaults to GOLDEN_SEEDS.
+        length (int, optional): steps per sequence. Defaults to 366.
+        event_rate (float, optional): probability of an application per day and input. Defaults to 0.05.
+        weather_rate (float, optional): probability of a weather override per day and variable.
+            Defaults to 0.02.
+
+    Returns:
+        dict: {seed: (length, 13) float32 array}
+    """
+
+    sequences = {}
+    n_weather, n_management = len(WEATHER_ACTIONS), len(MANAGEMENT_ACTIONS)
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        actions = np.full((length, len(ACTIONS)), np.nan, dtype=np.float32)
+        actions[:, n_weather:] = -1
+        if seed:
+            events = rng.random((length, n_management)) < event_rate
+            amounts = rng.uniform(-1, 1, events.shape)
+            actions[:, n_weather:] = np.where(events, amounts, -1)
+        if seed % 2:
+            events = rng.random((length, n_weather)) < weather_rate
+            values = rng.uniform(-0.5, 0.5, events.shape)
+            actions[:, :n_weather] = np.where(events, values, np.nan)
+        sequences[seed] = actions
+    return sequences
+
+
+def _trajectory(obs, rewards, profit):
+    return {
+        "obs": np.array(obs, dtype=np.float64).reshape(-1, len(OBSERVATIONS)),
+        "reward": np.array(rewards, dtype=np.float64),
+        "profit": float(profit),
+    }
+
+
+def replay(env, actions, start=0):
+    """ Step env through actions until the episode ends
+
+    Args:
+        env (PcseEnv): environment, reset first unless start > 0
+        actions (np.ndarray): normalized actions
+        start (int, optional): steps already taken by env. Defaults to 0.
+
+    Returns:
+        tuple(list, list): observations and rewards of the steps taken
+    """
+
+    if not start:
+        env.reset()
+    obs, rewards = [], []
+    for action in actions[start:]:
+        next_obs, reward, done, _ = env.step(action)
+        obs.append(next_obs)
+        rewards.append(reward)
+        if done:
+            break
+    return obs, rewards
+
+
+def _run_envs(make_env, sequences):
+    trajectories = {}
+    for seed, actions in sequences.items():
+        env = make_env()
+        obs, rewards = replay(env, actions)
+        trajectories[seed] = _trajectory(obs, rewards, env.profit)
+    return trajectories
+
+
+def reference_mode(sequences, weather):
+    """ Upstream execution: PCSE astro, CABO files parsed and weather deep-copied at reset """
+    return _run_envs(lambda: PcseEnv(weather=weather), sequences)
+
+
+def astro_tables_mode(sequences, weather):
+    return _run_envs(lambda: PcseEnv(weather=weather, astro_tables=True), sequences)
+
+
+def cached_parameters_mode(sequences, weather):
+    params = load_parameters()
+    return _run_envs(
+        lambda: PcseEnv(weather=weather, parameterprovider=params), sequences
+    )
+
+
+def overlay_weather_mode(sequences, weather):
+    overlay = OverlayWeatherDataProvider(weather)
+    params = load_parameters()
+    return _run_envs(
+        lambda: PcseEnv(weather=overlay, parameterprovider=params), sequences
+    )
+
+
+def array_weather_mode(sequences, weather):
+    array = ArrayWeatherDataProvider(
+        _pack_weather(weather),
+        weather.latitude,
+        weather.longitude,
+        weather.elevation,
+        weather.angstA,
+        weather.angstB,
+        weather.ETmodel,
+        weather.description,
+    )
+    params = load_parameters()
+    return _run_envs(
+        lambda: PcseEnv(weather=array, parameterprovider=params), sequences
+    )
+
+
+def shared_weather_mode(sequences, weather):
+    params = load_parameters()
+    with SharedWeatherStore() as store:
+        shared = SharedWeatherDataProvider(store.add(weather))
+        return _run_envs(
+            lambda: PcseEnv(weather=shared, parameterprovider=params), sequences
+        )
+
+
+def metrics_mode(sequences, weather):
+    params = load_parameters()
+    return _run_envs(
+        lambda: PcseEnv(weather=weather, parameterprovider=params, metrics=True),
+        sequences,
+    )
+
+
+def fork_mode(sequences, weather, at=60):
+    """ Episodes continued in a fork (check fork.py) of the environment after at steps """
+    params = load_parameters()
+    trajectories = {}
+    for seed, actions in sequences.items():
+        env = PcseEnv(weather=weather, parameterprovider=params)
+        obs, rewards = replay(env, actions[:at])
+        if not env.done:
+            forked = fork_env(env)
+            more_obs, more_rewards = replay(forked, actions, start=at)
+            obs, rewards, env = obs + more_obs, rewards + more_rewards, forked
+        trajectories[seed] = _trajectory(obs, rewards, env.profit)
+    return trajectories
+
+
+def batch_mode(sequences, weather):
+    """ All sequences in lockstep with pcse_batch_runner """
+    params = load_parameters()
+    seeds = list(sequences)
+    envs = [PcseEnv(weather=weather, parameterprovider=params) for _ in seeds]
+    index = {id(env): seed for env, seed in zip(envs, seeds)}
+    seen = {seed: [] for seed in seeds}
+
+    def policy(obs, running):
+        acts = []
+        for ob, env in zip(obs, running):
+            seed = index[id(env)]
+            acts.append(sequences[seed][len(seen[seed])])
+            seen[seed].append(ob.copy())
+        return np.stack(acts)
+
+    _, rewards = pcse_batch_runner(envs, policy)
+    return {
+        seed: _trajectory(seen[seed][1:] + [env.obs], rewards[ix], env.profit)
+        for ix, (seed, env) in enumerate(zip(seeds, envs))
+    }
+
+
+def async_pool_mode(sequences, weather, processes=2):
+    """ Remote environments of an AsyncEnvPool (worker processes load their own weather) """
+
+    async def run(env, actions):
+        obs, rewards = [], []
+        await env.areset()
+        for action in actions:
+            next_obs, reward, done, _ = await env.astep(action)
+            obs.append(next_obs)
+            rewards.append(reward)
+            if done:
+                break
+        profit = await env.aget("profit")
+        return _trajectory(obs, rewards, profit)
+
+    async def main():
+        async with AsyncEnvPool(processes=processes) as pool:
+            envs = [await pool.make_env() for _ in sequences]
+            results = await asyncio.gather(
+                *[run(env, actions) for env, actions in zip(envs, sequences.values())]
+            )
+        return dict(zip(sequences, results))
+
+    return asyncio.run(main())
+
+
+# Execution modes compared to the reference, each one runs all sequences
+MODES = {
+    "reference": reference_mode,
+    "astro_tables": astro_tables_mode,
+    "cached_parameters": cached_parameters_mode,
+    "overlay_weather": overlay_weather_mode,
+    "array_weather": array_weather_mode,
+    "shared_weather": shared_weather_mode,
+    "metrics": metrics_mode,
+    "fork": fork_mode,
+    "batch": batch_mode,
+    "async_pool": async_pool_mode,
+}
+
+
+def record_golden(path=None, seeds=GOLDEN_SEEDS, weather=None):
+    """ Reference trajectories of the seeded action sequences at the bundled site
+
+    Args:
+        path (str, optional): .npz file to save them to. Defaults to None.
+        seeds (tuple, optional): seeds of action_sequences. Defaults to GOLDEN_SEEDS.
+        weather (WeatherDataProvider, optional): weather. Defaults to None (bundled site).
+
+    Returns:
+        dict: {seed: {"actions", "obs", "reward", "profit"}}
+    """
+
+    weather = weather or NASAPowerWeatherDataFetcher(35, 128)
+    sequences = action_sequences(seeds)
+    golden = reference_mode(sequences, weather)
+    for seed, actions in sequences.items():
+        golden[seed]["actions"] = actions
+    if path is not None:
+        arrays = {"seeds": np.array(list(golden))}
+        for seed, trajectory in golden.items():
+            arrays.update({f"{seed}_{k}": v for k, v in trajectory.items()})
+        np.savez_compressed(path, **arrays)
+    return golden
+
+
+def load_golden(path):
+    """ Trajectories saved by record_golden """
+    with np.load(path) as f:
+        return {
+            int(seed): {
+                "actions": f[f"{seed}_actions"],
+                "obs": f[f"{seed}_obs"],
+                "reward": f[f"{seed}_reward"],
+                "profit": float(f[f"{seed}_profit"]),
+            }
+            for seed in f["seeds"]
+        }
+
+
+def deviations(golden, trajectories):
+    """ Max absolute deviation per variable over all steps and sequences
+
+    Returns:
+        dict: {variable: deviation} of VARIABLES and "steps" (max difference of episode length)
+    """
+
+    result = dict.fromkeys(VARIABLES, 0.0)
+    result["steps"] = 0
+    for seed, expected in golden.items():
+        actual = trajectories[seed]
+        n = min(len(expected["reward"]), len(actual["reward"]))
+        result["steps"] = max(
+            result["steps"], abs(len(expected["reward"]) - len(actual["reward"]))
+        )
+        obs = np.abs(actual["obs"][:n] - expected["obs"][:n])
+        for ix, name in enumerate(OBSERVATIONS):
+            result[name] = max(result[name], float(obs[:, ix].max(initial=0)))
+        reward = np.abs(actual["reward"][:n] - expected["reward"][:n])
+        result["reward"] = max(result["reward"], float(reward.max(initial=0)))
+        profit = abs(actual["profit"] - expected["profit"])
+        result["profit"] = max(result["profit"], profit)
+    return result
+
+
+def check_modes(golden=None, modes=None, weather=None, tolerance=1e-9):
+    """ Replay the golden sequences through execution modes
+
+    Args:
+        golden (dict or str, optional): trajectories of record_golden or its .npz file.
+            Defaults to None (recorded now).
+        modes (list, optional): names of MODES, or {name: mode function}. Defaults to None (all).
+        weather (WeatherDataProvider, optional): weather. Defaults to None (bundled site).
+        tolerance (float, optional): max deviation of a passing mode. Defaults to 1e-9.
+
+    Returns:
+        pd.DataFrame: one row per mode with the max deviation of each variable, "steps",
+            "seconds", "speedup" (seconds of the reference mode / seconds) and "ok"
+    """
+
+    weather = weather or NASAPowerWeatherDataFetcher(35, 128)
+    if golden is None:
+        golden = record_golden(weather=weather)
+    elif isinstance(golden, str):
+        golden = load_golden(golden)
+    if modes is None:
+        modes = MODES
+    elif not isinstance(modes, dict):
+        modes = {name: MODES[name] for name in modes}
+    sequences = {seed: trajectory["actions"] for seed, trajectory in golden.items()}
+
+    rows = []
+    for name, mode in modes.items():
+        start = time.perf_counter()
+        trajectories = mode(sequences, weather)
+        row = {"mode": name, **deviations(golden, trajectories)}
+        row["seconds"] = time.perf_counter() - start
+        rows.append(row)
+    report = pd.DataFrame(rows).set_index("mode")
+    if "reference" in report.index:
+        report["speedup"] = report.loc["reference", "seconds"] / report["seconds"]
+    report["ok"] = (report[VARIABLES].max(axis=1) <= tolerance) & (report["steps"] == 0)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m spwk_agtech.golden",
+        description="Record golden PcseEnv trajectories and check execution modes against them.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="record the reference trajectories")
+    record.add_argument("path", help=".npz file")
+    check = commands.add_parser("check", help="replay the trajectories in every mode")
+    check.add_argument("path", help=".npz file written by record")
+    check.add_argument("--modes", nargs="*", choices=list(MODES), help="default: all")
+    check.add_argument("--tolerance", type=float, default=1e-9)
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        record_golden(args.path)
+        return 0
+    report = check_modes(args.path, args.modes, tolerance=args.tolerance)
+    with pd.option_context("display.max_columns", None, "display.width", None):
+        print(report)
+    return 0 if report.ok.all() else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,342 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from pcse.base import WeatherDataContainer
+from pcse.exceptions import PCSEError
+from pcse.settings import settings
+
+from .nasapower import reference_ET_arrays, tdew_to_hpa
+from .shared_weather import WEATHER_FIELDS, ArrayWeatherDataProvider
+
+try:
+    import xarray
+except ImportError:  # NetCDF archives need xarray (and netCDF4 or h5netcdf)
+    xarray = None
+
+# Columns read from local archives, in PCSE names. VAP can be given as TDEW instead and TEMP
+# defaults to the mean of TMIN and TMAX.
+INPUT_VARIABLES = ["TMIN", "TMAX", "TEMP", "IRRAD", "RAIN", "WIND", "VAP", "TDEW"]
+
+# Units of the input columns by default
+DEFAULT_UNITS = {
+    "TMIN": "C",
+    "TMAX": "C",
+    "TEMP": "C",
+    "TDEW": "C",
+    "IRRAD": "MJ/m2/day",
+    "RAIN": "mm/day",
+    "WIND": "m/s",
+    "VAP": "hPa",
+}
+
+# Conversions to the PCSE units (C, J/m2/day, cm/day, m/s, hPa), CF spellings included
+UNIT_CONVERSIONS = {
+    "C": lambda x: x,
+    "degC": lambda x: x,
+    "K": lambda x: x - 273.15,
+    "J/m2/day": lambda x: x,
+    "kJ/m2/day": lambda x: x * 1e3,
+    "MJ/m2/day": lambda x: x * 1e6,
+    "W/m2": lambda x: x * 86400.0,
+    "W m-2": lambda x: x * 86400.0,
+    "cm/day": lambda x: x,
+    "mm/day": lambda x: x / 10.0,
+    "mm": lambda x: x / 10.0,
+    "kg m-2 s-1": lambda x: x * 86400.0 / 10.0,
+    "m/s": lambda x: x,
+    "m s-1": lambda x: x,
+    "hPa": lambda x: x,
+    "kPa": lambda x: x * 10.0,
+    "Pa": lambda x: x / 100.0,
+}
+
+
+def convert_units(values, units=None):
+    """ Input columns converted to the PCSE weather variables
+
+    Args:
+        values (dict): arrays of INPUT_VARIABLES
+        units (dict, optional): units of the arrays, missing ones are DEFAULT_UNITS. Defaults to None.
+
+    Returns:
+        dict: TMIN, TMAX, TEMP, IRRAD, RAIN, WIND and VAP arrays in PCSE units
+    """
+
+    units = {**DEFAULT_UNITS, **(units or {})}
+    converted = {}
+    for varname, value in values.items():
+        if varname not in INPUT_VARIABLES:
+            continue
+        unit = units[varname]
+        if unit not in UNIT_CONVERSIONS:
+            raise ValueError(
+                f"Unknown unit {unit!r} of {varname}. Check UNIT_CONVERSIONS."
+            )
+        converted[varname] = UNIT_CONVERSIONS[unit](np.asarray(value, dtype=np.float64))
+
+    if "VAP" not in converted:
+        if "TDEW" not in converted:
+            raise ValueError("Either VAP or TDEW is required to compute VAP.")
+        valid = ~np.isnan(converted["TDEW"])
+        vap = np.full_like(converted["TDEW"], np.nan)
+        vap[valid] = tdew_to_hpa(converted["TDEW"][valid])
+        converted["VAP"] = vap
+    converted.pop("TDEW", None)
+    if "TEMP" not in converted:
+        converted["TEMP"] = (converted["TMIN"] + converted["TMAX"]) / 2.0
+    missing = {"TMIN", "TMAX", "IRRAD", "RAIN", "WIND"} - set(converted)
+    if missing:
+        raise ValueError(f"Missing weather variable(s) {sorted(missing)}.")
+    return converted
+
+
+def weather_array(
+    days, values, latitude, elevation, angstA=0.29, angstB=0.49, ETmodel="PM"
+):
+    """ (days, WEATHER_FIELDS) array of one site, with the reference ET computed at once
+
+    Args:
+        days (np.ndarray): datetime64 days, in any order (the last row of a repeated day wins)
+        values (dict): arrays of PCSE weather variables (see convert_units)
+        latitude (float): latitude
+        elevation (float): elevation in m
+        angstA (float, optional): Angstrom A. Defaults to 0.29.
+        angstB (float, optional): Angstrom B. Defaults to 0.49.
+        ETmodel (str, optional): "PM"|"P". Defaults to "PM".
+
+    Returns:
+        np.ndarray: one row per day from the first to the last day, rows of missing days are NaN
+    """
+
+    days = np.asarray(days, dtype="datetime64[D]")
+    # proleptic Gregorian ordinals (1970-01-01 is 719163)
+    ordinals = days.astype(np.int64) + 719163
+    columns = np.column_stack([values[k] for k in WEATHER_FIELDS[1:] if k in values])
+    valid = ~np.isnan(columns).any(axis=1)
+    days, ordinals = days[valid], ordinals[valid]
+    values = {k: np.asarray(v)[valid] for k, v in values.items()}
+    if not len(days):
+        raise ValueError("No complete day of weather.")
+
+    try:
+        E0, ES0, ET0 = reference_ET_arrays(
+            days,
+            latitude,
+            elevation,
+            values["TMIN"],
+            values["TMAX"],
+            values["IRRAD"],
+            values["VAP"],
+            values["WIND"],
+            angstA,
+            angstB,
+            ETmodel,
+        )
+    except ValueError as e:
+        msg = "Failed to calculate reference ET values due to error: %s" % e
+        raise PCSEError(msg)
+    values = {**values, "E0": E0 / 10.0, "ES0": ES0 / 10.0, "ET0": ET0 / 10.0}
+
+    if settings.METEO_RANGE_CHECKS:
+        for key, value in values.items():
+            vmin, vmax = WeatherDataContainer.ranges[key]
+            outside = ~((vmin <= value) & (value <= vmax))
+            if outside.any():
+                msg = (
+                    "Value (%s) for meteo variable '%s' outside allowed range (%s, %s)."
+                )
+                raise PCSEError(msg % (value[outside][0], key, vmin, vmax))
+
+    first = ordinals.min()
+    data = np.full((ordinals.max() - first + 1, len(WEATHER_FIELDS)), np.nan)
+    data[:, 0] = np.arange(first, first + len(data))
+    rows = ordinals - first
+    for ix, varname in enumerate(WEATHER_FIELDS[1:], start=1):
+        data[rows, ix] = values[varname]
+    return data
+
+
+class _SiteColumns:
+    """ Chunks of the columns of each site, concatenated once the archive is read """
+
+    def __init__(self):
+        self.chunks = {}
+
+    def add(self, site, columns):
+        self.chunks.setdefault(site, []).append(columns)
+
+    def sites(self):
+        for site, chunks in self.chunks.items():
+            yield site, {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0]}
+
+
+def _providers(site_columns, sites, units, angstA, angstB, ETmodel, description):
+    providers = {}
+    for site, columns in site_columns.sites():
+        info = sites[site]
+        try:
+            values = convert_units(columns, units)
+            data = weather_array(
+                columns["DAY"],
+                values,
+                info["lat"],
+                info["elev"],
+                angstA,
+                angstB,
+                ETmodel,
+            )
+        except (ValueError, PCSEError) as e:
+            logging.warning(f"Skipping weather of site {site!r} due to: {e}")
+            continue
+        providers[site] = ArrayWeatherDataProvider(
+            data,
+            info["lat"],
+            info["long"],
+            info["elev"],
+            angstA,
+            angstB,
+            ETmodel,
+            [f"{description} (site {site!r})"],
+        )
+    return providers
+
+
+def read_weather_csv(
+    path,
+    columns=None,
+    units=None,
+    sites=None,
+    chunksize=500000,
+    angstA=0.29,
+    angstB=0.49,
+    ETmodel="PM",
+    **read_csv_kwargs,
+):
+    """ Weather of many sites from a long CSV file (one row per site and day), in one pass
+
+    The file is streamed in chunks of rows, the columns of each site are converted to PCSE units
+    and the reference ET of each site is computed at once over all its days.
+
+    Args:
+        path (str): CSV file
+        columns (dict, optional): CSV column of "site", "DAY", "lat", "long", "elev" and of the
+            INPUT_VARIABLES used, by default the same names. Sites are (lat, long) if there is no
+            site column. Defaults to None.
+        units (dict, optional): units of the weather columns, check DEFAULT_UNITS. Defaults to None.
+        sites (pd.DataFrame, optional): site, lat, long and elev of the sites, instead of the
+            CSV columns. Only these sites are read. Defaults to None.
+        chunksize (int, optional): rows per chunk. Defaults to 500000.
+        angstA (float, optional): Angstrom A. Defaults to 0.29.
+        angstB (float, optional): Angstrom B. Defaults to 0.49.
+        ETmodel (str, optional): "PM"|"P". Defaults to "PM".
+        read_csv_kwargs: keyword arguments of pd.read_csv (e.g. sep)
+
+    Returns:
+        dict: {site: ArrayWeatherDataProvider}
+    """
+
+    names = {k: k for k in ["site", "DAY", "lat", "long", "elev"] + INPUT_VARIABLES}
+    names.update(columns or {})
+    renames = {v: k for k, v in names.items()}
+    info = {} if sites is None else sites.set_index("site").to_dict("index")
+
+    site_columns = _SiteColumns()
+    for chunk in pd.read_csv(path, chunksize=chunksize, **read_csv_kwargs):
+        chunk = chunk.rename(columns=renames)
+        if "site" not in chunk:
+            chunk = chunk.assign(site=list(zip(chunk.lat, chunk.long)))
+        if sites is not None:
+            chunk = chunk[chunk.site.isin(list(info))]
+        chunk_days = pd.to_datetime(chunk.DAY).to_numpy().astype("datetime64[D]")
+        variables = [k for k in INPUT_VARIABLES if k in chunk]
+        codes, uniques = pd.factorize(chunk.site)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        for ix, site in enumerate(uniques):
+            rows = order[bounds[ix] : bounds[ix + 1]]
+            data = {k: chunk[k].to_numpy(dtype=np.float64)[rows] for k in variables}
+            data["DAY"] = chunk_days[rows]
+            site_columns.add(site, data)
+            if site not in info:
+                first = chunk.iloc[rows[0]]
+                info[site] = {
+                    "lat": float(first.lat),
+                    "long": float(first.long),
+                    "elev": float(first.elev) if "elev" in chunk else 0.0,
+                }
+
+    return _providers(
+        site_columns, info, units, angstA, angstB, ETmodel, f"Local weather {path}"
+    )
+
+
+def read_weather_netcdf(
+    path,
+    sites,
+    variables=None,
+    units=None,
+    dims=None,
+    chunk_days=3650,
+    angstA=0.29,
+    angstB=0.49,
+    ETmodel="PM",
+):
+    """ Weather of many sites from a gridded NetCDF file (time, lat, lon), in one pass
+
+    The grid cell nearest to each site is read for chunk_days days at a time, for all sites at
+    once. Units are read from the "units" attribute of the variables unless given.
+
+    Args:
+        path (str): NetCDF file
+        sites (pd.DataFrame): site, lat, long and elev (optional, defaults to 0) of the sites
+        variables (dict, optional): NetCDF variable of the INPUT_VARIABLES used, by default the
+            same names. Defaults to None.
+        units (dict, optional): units of the variables, check UNIT_CONVERSIONS. Defaults to None.
+        dims (dict, optional): names of the "time", "lat" and "long" dimensions. Defaults to None.
+        chunk_days (int, optional): days read per chunk. Defaults to 3650.
+        angstA (float, optional): Angstrom A. Defaults to 0.29.
+        angstB (float, optional): Angstrom B. Defaults to 0.49.
+        ETmodel (str, optional): "PM"|"P". Defaults to "PM".
+
+    Returns:
+        dict: {site: ArrayWeatherDataProvider}
+    """
+
+    if xarray is None:
+        raise ImportError(
+            "Reading NetCDF weather requires xarray, pip install xarray netCDF4"
+        )
+
+    dims = {"time": "time", "lat": "lat", "long": "lon", **(dims or {})}
+    sites = sites.assign(elev=sites.elev if "elev" in sites else 0.0)
+    info = sites.set_index("site").to_dict("index")
+    site_columns = _SiteColumns()
+    with xarray.open_dataset(path) as ds:
+        names = {k: k for k in INPUT_VARIABLES if k in ds.variables}
+        names.update(variables or {})
+        file_units = {
+            k: ds[v].attrs["units"] for k, v in names.items() if "units" in ds[v].attrs
+        }
+        units = {**file_units, **(units or {})}
+        points = {
+            dims["lat"]: xarray.DataArray(sites.lat.to_numpy(), dims="site"),
+            dims["long"]: xarray.DataArray(sites.long.to_numpy(), dims="site"),
+        }
+        n_days = ds.sizes[dims["time"]]
+        for start in range(0, n_days, chunk_days):
+            window = ds.isel({dims["time"]: slice(start, start + chunk_days)})
+            window = window[list(names.values())].sel(points, method="nearest").load()
+            days = window[dims["time"]].to_numpy().astype("datetime64[D]")
+            values = {
+                k: window[v].transpose(dims["time"], "site").to_numpy()
+                for k, v in names.items()
+            }
+            for ix, site in enumerate(sites.site):
+                columns = {k: v[:, ix] for k, v in values.items()}
+                columns["DAY"] = days
+                site_columns.add(site, columns)
+
+    return _providers(
+        site_columns, info, units, angstA, angstB, ETmodel, f"Local weather {path}"
+    )
@@ -0,0 +1,284 @@
+import argparse
+import json
+import logging
+import os
+import re
+import time
+
+import pandas as pd
+from pcse.settings import settings
+
+from .make_weather_cache import _get_cache_filename
+from .nasapower import cache_lock
+from .utils import NASAPowerWeatherDataFetcher
+
+INDEX_FILENAME = "meteo_cache_index.json"
+CACHE_PATTERN = re.compile(
+    r"^NASAPowerWeatherDataProvider_LAT(-?\d+)_LON(-?\d+)\.cache$"
+)
+SIZE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_size(value):
+    """ Bytes of a size such as 1048576, "512M" or "2G" (None stays None)"""
+    if value is None or isinstance(value, int):
+        return value
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", str(value).upper())
+    if match is None:
+        raise ValueError(f"Invalid size {value!r}. Use bytes or a K/M/G/T suffix.")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+class MeteoCache:
+    """ NASA POWER cache directory (settings.METEO_CACHE_DIR) bounded in bytes and/or entries
+
+    The cache files of the directory are listed in an index file, {filename: {"size", "atime"}},
+    so looking a site up never scans the directory (prune merges the index with one scan). Weather
+    fetched with fetch() records the access and evicts the least recently used cache files
+    beyond the quota. Cache files written by other code paths (e.g. NASAPowerWeatherDataFetcher
+    directly) are picked up by sync(), with the file access or modification time as last access.
+
+    The index is merged and rewritten atomically under a file lock, so any number of processes
+    can share a cache directory. Evicting a file another process is reading is harmless, the
+    reader keeps its open file.
+
+    Args:
+        max_bytes (int or str, optional): quota of the cache files, e.g. "2G". Defaults to None.
+        max_entries (int, optional): quota of cache files. Defaults to None.
+    """
+
+    def __init__(self, max_bytes=None, max_entries=None):
+        self.directory = settings.METEO_CACHE_DIR
+        self.index_path = os.path.join(self.directory, INDEX_FILENAME)
+        self.max_bytes = parse_size(max_bytes)
+        self.max_entries = max_entries
+        self.entries = self._read_index()
+        if self.entries is None:
+            self.sync()
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_index(self, entries):
+        tmp = f"{self.index_path}.tmp{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp, self.index_path)
+
+    def _scan(self):
+        """ Index entries of the cache files in the directory """
+        entries = {}
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if CACHE_PATTERN.match(item.name):
+                    stat = item.stat()
+                    entries[item.name] = {
+                        "size": stat.st_size,
+                        "atime": max(stat.st_atime, stat.st_mtime),
+                    }
+        return entries
+
+    def _merge_scan(self, entries):
+        """ Entries of the files in the directory, with the latest access of entries or the file """
+        found = self._scan()
+        for name, entry in found.items():
+            if name in entries:
+                entry["atime"] = max(entry["atime"], entries[name]["atime"])
+        return found
+
+    def _update(self, changes=None, removed=(), scan=False):
+        """ Merge changes into the index file, the latest access of an entry wins """
+        os.makedirs(self.directory, exist_ok=True)
+        with cache_lock(self.index_path):
+            entries = self._read_index() or {}
+            if scan:
+                entries = self._merge_scan(entries)
+            for name, entry in (changes or {}).items():
+                if name not in entries or entry["atime"] >= entries[name]["atime"]:
+                    entries[name] = entry
+            for name in removed:
+                entries.pop(name, None)
+            self._write_index(entries)
+        self.entries = entries
+        return entries
+
+    def sync(self):
+        """ Rebuild the index from the directory, keeping the recorded accesses """
+        return self._update(scan=True)
+
+    def filename(self, latitude, longitude):
+        return os.path.join(self.directory, _get_cache_filename(latitude, longitude))
+
+    def lookup(self, latitude, longitude):
+        """ Index entry of the cache file of a site, None if it is not cached """
+        return self.entries.get(_get_cache_filename(latitude, longitude))
+
+    def touch(self, latitude, longitude):
+        """ Record an access to the cache file of a site """
+        name = _get_cache_filename(latitude, longitude)
+        try:
+            size = os.stat(os.path.join(self.directory, name)).st_size
+        except OSError:
+            self._update(removed=[name])
+            return
+        self._update({name: {"size": size, "atime": time.time()}})
+
+    def fetch(self, latitude, longitude, **kwargs):
+        """ NASAPowerWeatherDataFetcher(latitude, longitude, **kwargs) within the quota
+
+        The site's cache file is used (or written), recorded as the most recent access and kept
+        while least recently used files are evicted beyond the quota.
+
+        Returns:
+            WeatherDataProvider: weather data container
+        """
+        weather = NASAPowerWeatherDataFetcher(latitude, longitude, **kwargs)
+        self.touch(latitude, longitude)
+        self.prune(keep=[_get_cache_filename(latitude, longitude)])
+        return weather
+
+    def warm(self, sites, **kwargs):
+        """ Fetch the weather of sites into the cache
+
+        Args:
+            sites (list): (latitude, longitude) pairs
+            kwargs: keyword arguments of NASAPowerWeatherDataFetcher
+
+        Returns:
+            list: sites that failed
+        """
+        failed = []
+        for latitude, longitude in sites:
+            try:
+                self.fetch(latitude, longitude, **kwargs)
+            except Exception as e:
+                logging.warning(f"Failed to warm ({latitude}, {longitude}) due to: {e}")
+                failed.append((latitude, longitude))
+        return failed
+
+    def usage(self):
+        """ Number of cache files and their total bytes """
+        return len(self.entries), sum(e["size"] for e in self.entries.values())
+
+    def prune(self, max_bytes=None, max_entries=None, keep=()):
+        """ Evict least recently used cache files until the quota holds
+
+        The index file is read again and merged with the directory under the lock, so files
+        written or accessed by other processes since this MeteoCache was created are accounted
+        for with their latest access.
+
+        Args:
+            max_bytes (int or str, optional): quota in bytes. Defaults to None (self.max_bytes).
+            max_entries (int, optional): quota of files. Defaults to None (self.max_entries).
+            keep (list, optional): file names never evicted. Defaults to ().
+
+        Returns:
+            list: evicted file names
+        """
+        max_bytes = parse_size(max_bytes) if max_bytes is not None else self.max_bytes
+        max_entries = max_entries if max_entries is not None else self.max_entries
+        if max_bytes is None and max_entries is None:
+            return []
+
+        os.makedirs(self.directory, exist_ok=True)
+        evicted = []
+        with cache_lock(self.index_path):
+            entries = self._merge_scan(self._read_index() or {})
+            count, total = len(entries), sum(e["size"] for e in entries.values())
+            for name, entry in sorted(entries.items(), key=lambda x: x[1]["atime"]):
+                if (max_bytes is None or total <= max_bytes) and (
+                    max_entries is None or count <= max_entries
+                ):
+                    break
+                if name in keep:
+                    continue
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                count -= 1
+                total -= entry["size"]
+                evicted.append(name)
+            for name in evicted:
+                del entries[name]
+            self._write_index(entries)
+        self.entries = entries
+        if evicted:
+            logging.info(
+                f"Evicted {len(evicted)} meteo cache file(s) from {self.directory}"
+            )
+        return evicted
+
+    def inspect(self):
+        """ Index as a DataFrame, most recently used first
+
+        Returns:
+            pd.DataFrame: file, latitude, longitude (0.1 degree cell), size in bytes, last access
+        """
+        rows = []
+        for name, entry in self.entries.items():
+            match = CACHE_PATTERN.match(name)
+            rows.append(
+                {
+                    "file": name,
+                    "latitude": int(match.group(1)) / 10,
+                    "longitude": int(match.group(2)) / 10,
+                    "size": entry["size"],
+                    "atime": pd.Timestamp(entry["atime"], unit="s"),
+                }
+            )
+        columns = ["file", "latitude", "longitude", "size", "atime"]
+        df = pd.DataFrame(rows, columns=columns)
+        return df.sort_values("atime", ascending=False, ignore_index=True)
+
+
+def _site(value):
+    latitude, longitude = value.split(",")
+    return float(latitude), float(longitude)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m spwk_agtech.meteo_cache",
+        description="Warm, inspect and prune the NASA POWER weather cache.",
+    )
+    parser.add_argument("--dir", help="cache directory (default: PCSE METEO_CACHE_DIR)")
+    parser.add_argument("--max-bytes", help="quota in bytes, e.g. 2G")
+    parser.add_argument("--max-entries", type=int, help="quota of cache files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    warm = commands.add_parser("warm", help="fetch sites into the cache")
+    warm.add_argument("sites", nargs="*", type=_site, help="LAT,LON")
+    warm.add_argument("--sites-file", help="CSV file with latitude,longitude columns")
+    commands.add_parser("inspect", help="list cache files, most recently used first")
+    commands.add_parser(
+        "prune", help="evict least recently used files beyond the quota"
+    )
+    args = parser.parse_args(argv)
+
+    if args.dir:
+        settings.METEO_CACHE_DIR = args.dir
+    cache = MeteoCache(args.max_bytes, args.max_entries)
+    if args.command == "warm":
+        sites = list(args.sites)
+        if args.sites_file:
+            df = pd.read_csv(args.sites_file)
+            sites += list(zip(df.latitude, df.longitude))
+        failed = cache.warm(sites)
+        print(f"Warmed {len(sites) - len(failed)}/{len(sites)} site(s)")
+    elif args.command == "inspect":
+        cache.sync()
+        with pd.option_context("display.max_rows", None, "display.width", None):
+            print(cache.inspect().to_string(index=False))
+    elif args.command == "prune":
+        cache.sync()
+        print(f"Evicted {len(cache.prune())} file(s)")
+    entries, total = cache.usage()
+    print(f"{entries} file(s), {total / 2 ** 20:.1f} MiB in {cache.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import json
+from bisect import bisect_left
+from time import perf_counter
+
+# Upper bounds (seconds) of the timing histogram buckets. The last bucket is +Inf.
+DEFAULT_BUCKETS = (
+    1e-5,
+    2.5e-5,
+    5e-5,
+    1e-4,
+    2.5e-4,
+    5e-4,
+    1e-3,
+    2.5e-3,
+    5e-3,
+    1e-2,
+    2.5e-2,
+    5e-2,
+    1e-1,
+    2.5e-1,
+    5e-1,
+    1.0,
+)
+
+# Phases timed by PcseEnv.reset and PcseEnv.step
+RESET_PHASES = ("reset", "engine_init", "get_output")
+STEP_PHASES = ("step", "denorm", "send_actions", "engine_run", "get_output", "reward")
+
+
+class Histogram:
+    """ Fixed-bucket histogram of observed values (bucket counts are made cumulative on export)
+
+    Args:
+        buckets (tuple): sorted upper bounds of the buckets
+    """
+
+    __slots__ = ("buckets", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """ Estimate the q-quantile from the bucket counts (upper bound of the bucket)
+
+        Args:
+            q (float): quantile in [0, 1]
+
+        Returns:
+            float: estimated quantile, nan if nothing was observed
+        """
+        if self.count == 0:
+            return float("nan")
+        rank = q * self.count
+        acc = 0
+        for bound, n in zip(self.buckets, self.counts):
+            acc += n
+            if acc >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else float("nan"),
+            "min": self.min if self.count else float("nan"),
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+
+class _PhaseTimer:
+    """ Reusable context manager recording the elapsed time of one phase """
+
+    __slots__ = ("metrics", "phase", "start")
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.phase, perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    """ No-op stand-in for _PhaseTimer when instrumentation is disabled """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+def null_timer(phase):
+    """ Timer factory used when instrumentation is disabled """
+    return NULL_TIMER
+
+
+class EnvMetrics:
+    """ Per-phase timings and counters of PcseEnv (opt-in instrumentation)
+
+    One instance can be shared by several environments to aggregate their timings.
+
+    Phases recorded by PcseEnv are listed in RESET_PHASES and STEP_PHASES.
+
+    Args:
+        buckets (tuple, optional): upper bounds (seconds) of histogram buckets. Defaults to DEFAULT_BUCKETS.
+        prefix (str, optional): metric name prefix used on export. Defaults to "pcse_env".
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix="pcse_env"):
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self.last = {}
+        self._timers = {}
+
+    def timer(self, phase):
+        """ Context manager timing a phase
+
+        Args:
+            phase (str): phase name (e.g. "engine_run")
+
+        Returns:
+            _PhaseTimer: context manager
+        """
+        timer = self._timers.get(phase)
+        if timer is None:
+            timer = self._timers[phase] = _PhaseTimer(self, phase)
+        return timer
+
+    def observe(self, phase, seconds):
+        hist = self.histograms.get(phase)
+        if hist is None:
+            hist = self.histograms[phase] = Histogram(self.buckets)
+        hist.observe(seconds)
+        self.last[phase] = seconds
+
+    def incr(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def last_timings(self, phases=None):
+        """ Timings (seconds) of the most recent occurrence of each phase
+
+        Args:
+            phases (tuple, optional): phases to report. Defaults to None (all phases).
+
+        Returns:
+            dict: {phase: seconds}
+        """
+        if phases is None:
+            return dict(self.last)
+        return {k: self.last[k] for k in phases if k in self.last}
+
+    def reset(self):
+        self.histograms.clear()
+        self.counters.clear()
+        self.last.clear()
+
+    def summary(self):
+        """ Summary of all histograms and counters
+
+        Returns:
+            dict: {"timings": {phase: histogram summary}, "counters": {name: value}}
+        """
+        return {
+            "timings": {k: v.to_dict() for k, v in self.histograms.items()},
+            "counters": dict(self.counters),
+        }
+
+    def to_json(self, path=None):
+        """ Export the summary as JSON
+
+        Args:
+            path (str, optional): file to write. Defaults to None (only return the string).
+
+        Returns:
+            str: JSON document
+        """
+        text = json.dumps(self.summary(), indent=2)
+        if path is not None:
+            with open(path, "w") as fp:
+                fp.write(text)
+        return text
+
+    def to_prometheus(self, path=None):
+        """ Export in the Prometheus text exposition format
+
+        Args:
+            path (str, optional): file to write (e.g. for the node exporter textfile collector).
+                Defaults to None (only return the string).
+
+        Returns:
+            str: exposition text
+        """
+        name = f"{self.prefix}_phase_seconds"
+        lines = [
+            f"# HELP {name} Time spent per phase of PcseEnv.reset/step.",
+            f"# TYPE {name} histogram",
+        ]
+        for phase, hist in sorted(self.histograms.items()):
+            acc = 0
+            for bound, n in zip(self.buckets, hist.counts):
+                acc += n
+                lines.append(f'{name}_bucket{{phase="{phase}",le="{bound}"}} {acc}')
+            lines.append(f'{name}_bucket{{phase="{phase}",le="+Inf"}} {hist.count}')
+            lines.append(f'{name}_sum{{phase="{phase}"}} {hist.sum!r}')
+            lines.append(f'{name}_count{{phase="{phase}"}} {hist.count}')
+        for counter, value in sorted(self.counters.items()):
+            cname = f"{self.prefix}_{counter}_total"
+            lines.append(f"# TYPE {cname} counter")
+            lines.append(f"{cname} {value}")
+        text = "\n".join(lines) + "\n"
+        if path is not None:
+            with open(path, "w") as fp:
+                fp.write(text)
+        return text
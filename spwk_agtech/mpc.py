@@ -0,0 +1,278 @@
+import copy
+import logging
+import math
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+from .const import ACTIONS, MANAGEMENT_ACTIONS
+from .fork import fork_env
+from .pcse_env import PcseEnv, get_profit, load_parameters
+
+# Index of the management actions in the full action
+MANAGEMENT_INDEX = {k: list(ACTIONS).index(k) for k in MANAGEMENT_ACTIONS}
+
+# Per-process shadow environment of the rollout workers
+_shadow = None
+
+
+class _Shadow:
+    """ Copy of the controlled environment kept in sync by replaying the applied actions
+
+    Termination predicates of env_kwargs are copied, the controlled env keeps its own. The
+    parameterprovider of env_kwargs can be shared with the controlled env: episodes and forks
+    run on their own copies of it (check copy_parameters), so rollouts reaching the time limit
+    do not clear its overrides.
+    """
+
+    def __init__(self, env_kwargs):
+        env_kwargs = dict(env_kwargs)
+        env_kwargs["termination"] = copy.deepcopy(env_kwargs.get("termination"))
+        env_kwargs.setdefault("parameterprovider", load_parameters())
+        self.env = PcseEnv(**env_kwargs)
+        self.obs = self.env.reset()
+        self.applied = []
+
+    def sync(self, applied):
+        """ Step the applied actions not replayed yet (reset if the episode changed) """
+        n = len(self.applied)
+        if n > len(applied) or not np.array_equal(
+            np.array(self.applied), np.array(applied[:n]), equal_nan=True
+        ):
+            self.obs = self.env.reset()
+            self.applied = []
+        for action in applied[len(self.applied) :]:
+            self.obs, _, _, _ = self.env.step(action)
+            self.applied.append(action)
+
+
+def _to_env_action(env, full):
+    return full if env.action_index is None else full[..., env.action_index]
+
+
+def rollout_value(env, plan, tail="base", deadline=None):
+    """ Profit of a plan from the current state of env, env is not modified
+
+    Args:
+        env (PcseEnv): environment in the middle of an episode
+        plan (np.ndarray): (horizon, 13) normalized actions
+        tail (str, optional): after the horizon, "base" runs without management until the end
+            of the episode and "terminal" sells the current yield. Defaults to "base".
+        deadline (float, optional): time.time() after which the rollout is abandoned.
+            Defaults to None.
+
+    Returns:
+        float: profit over the rollout, None if the deadline passed
+    """
+
+    if deadline is not None and time.time() > deadline:
+        return None
+    forked = fork_env(env)
+    start = forked.profit
+    base = plan[-1].copy()
+    base[list(MANAGEMENT_INDEX.values())] = -1
+    step = 0
+    while not forked.done:
+        if deadline is not None and time.time() > deadline:
+            return None
+        if step >= len(plan) and tail != "base":
+            state = forked.denorm(forked.obs, "obs")
+            return forked.profit - start + get_profit(state, np.zeros(13), True)
+        action = plan[step] if step < len(plan) else base
+        forked.step(_to_env_action(forked, action))
+        step += 1
+    return forked.profit - start
+
+
+def _init_worker(env_kwargs):
+    global _shadow
+    _shadow = _Shadow(env_kwargs)
+
+
+def _evaluate(task):
+    ix, applied, plan, tail, deadline = task
+    _shadow.sync(applied)
+    return ix, rollout_value(_shadow.env, plan, tail, deadline)
+
+
+class MPCController:
+    """ Receding-horizon controller of irrigation and N/P/K for pcse_runner
+
+    Every replan_every days the controller forks its copy of the environment (check fork.py)
+    and scores a population of management plans over horizon days: the previous best plan
+    shifted by the elapsed days, no management, mutations of the previous best and random
+    sparse plans. A plan is scored by its profit (get_profit) until the end of the episode,
+    without management after the horizon (tail="base"), or with the yield at the end of the
+    horizon sold (tail="terminal", cheaper but short-sighted). The first action of the best
+    plan is applied.
+
+    The controller does not see the environment, only the observations given to get_action:
+    it keeps a copy built from env_kwargs (the same as the controlled env) in sync by replaying
+    the actions it returned, and the rollout workers of the process pool do the same. Weather
+    actions are NaN (reference weather).
+
+    Decisions have a latency budget: rollouts still running after time_budget seconds are
+    abandoned and the best plan among the finished ones is used (the shifted previous plan
+    if none finished). Latencies are kept in self.latencies.
+
+    Example:
+        with MPCController(horizon=21, population=16, processes=8) as mpc:
+            actions, rewards = pcse_runner(PcseEnv(), mpc)
+
+    Args:
+        env_kwargs (dict, optional): keyword arguments of the controlled PcseEnv. Defaults to None.
+        horizon (int, optional): days of a plan. Defaults to 21.
+        population (int, optional): plans scored per decision. Defaults to 16.
+        replan_every (int, optional): days between decisions, the best plan is followed in
+            between (at most horizon days). Defaults to 1.
+        inputs (list, optional): planned MANAGEMENT_ACTIONS, others stay 0. Defaults to None (all).
+        event_rate (float, optional): probability of an application per day and input in random
+            plans. Defaults to 0.05.
+        tail (str, optional): "base" or "terminal", check rollout_value. Defaults to "base".
+        time_budget (float, optional): seconds per decision. Defaults to None (no budget).
+        processes (int, optional): rollout processes, 1 runs rollouts in this process.
+            Defaults to 1.
+        seed (int, optional): seed of the plans. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        env_kwargs=None,
+        horizon=21,
+        population=16,
+        replan_every=1,
+        inputs=None,
+        event_rate=0.05,
+        tail="base",
+        time_budget=None,
+        processes=1,
+        seed=None,
+    ):
+        if tail not in ("base", "terminal"):
+            raise ValueError(f"Unknown tail {tail!r}, use 'base' or 'terminal'.")
+        self.env_kwargs = env_kwargs or {}
+        self.horizon = horizon
+        self.population = population
+        self.replan_every = replan_every
+        self.inputs = [MANAGEMENT_INDEX[k] for k in (inputs or MANAGEMENT_ACTIONS)]
+        self.event_rate = event_rate
+        self.tail = tail
+        self.time_budget = time_budget
+        self.processes = processes
+        self.rng = np.random.default_rng(seed)
+        self.latencies = []
+
+        self._shadow = _Shadow(self.env_kwargs)
+        self._pool = None
+        if processes > 1:
+            self._pool = mp.Pool(
+                processes, initializer=_init_worker, initargs=(self.env_kwargs,)
+            )
+        self._pending = None
+        self._plan = None
+        self._age = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def _empty_plan(self):
+        plan = np.full((self.horizon, len(ACTIONS)), np.nan, dtype=np.float32)
+        plan[:, list(MANAGEMENT_INDEX.values())] = -1
+        return plan
+
+    def _random_events(self, plan):
+        events = self.rng.random((self.horizon, len(self.inputs))) < self.event_rate
+        amounts = self.rng.uniform(-1, 1, events.shape).astype(np.float32)
+        block = plan[:, self.inputs]
+        plan[:, self.inputs] = np.where(events, amounts, block)
+        return plan
+
+    def candidates(self):
+        """ Plans scored at a decision, the previous best shifted first """
+        plans = []
+        if self._plan is not None:
+            shifted = self._empty_plan()
+            shifted[: self.horizon - self._age] = self._plan[self._age :]
+            plans.append(shifted)
+        plans.append(self._empty_plan())
+        while len(plans) < self.population:
+            if self._plan is not None and len(plans) % 2:
+                mutant = plans[0].copy()
+                drop = self.rng.random(mutant.shape[0]) < self.event_rate * 4
+                mutant[drop[:, None] & ~np.isnan(mutant)] = -1
+                plans.append(self._random_events(mutant))
+            else:
+                plans.append(self._random_events(self._empty_plan()))
+        return plans[: self.population]
+
+    def _score(self, plans):
+        deadline = None
+        if self.time_budget is not None:
+            deadline = time.time() + self.time_budget
+        if self._pool is None:
+            return [
+                rollout_value(self._shadow.env, plan, self.tail, deadline)
+                for plan in plans
+            ]
+        applied = self._shadow.applied
+        tasks = [
+            (ix, applied, plan, self.tail, deadline) for ix, plan in enumerate(plans)
+        ]
+        scores = [None] * len(plans)
+        chunksize = max(1, math.ceil(len(tasks) / (self.processes * 2)))
+        for ix, score in self._pool.imap_unordered(_evaluate, tasks, chunksize):
+            scores[ix] = score
+        return scores
+
+    def get_action(self, obs, test=True):
+        """ Action for the observation, the next one of the environment built from env_kwargs
+
+        Args:
+            obs (np.ndarray): observation of the controlled environment
+            test (bool, optional): unused, plans are random either way. Defaults to True.
+
+        Returns:
+            np.ndarray: normalized action
+        """
+
+        start = time.perf_counter()
+        shadow = self._shadow
+        if self._pending is not None:
+            shadow.sync(shadow.applied + [self._pending])
+            self._pending = None
+        if shadow.env.done or not np.allclose(obs, shadow.obs, equal_nan=True):
+            # new episode
+            shadow.sync([])
+            self._plan = None
+            if not np.allclose(obs, shadow.obs, equal_nan=True):
+                raise ValueError(
+                    "Observation does not match the environment of env_kwargs."
+                )
+
+        if self._plan is None or self._age >= min(self.replan_every, self.horizon):
+            plans = self.candidates()
+            scores = self._score(plans)
+            finished = [ix for ix, score in enumerate(scores) if score is not None]
+            if finished:
+                best = max(finished, key=lambda ix: (scores[ix], -ix))
+                self._plan = plans[best]
+            else:
+                logging.warning("No rollout finished within the time budget.")
+                self._plan = plans[0]
+            self._age = 0
+
+        action = self._plan[self._age].copy()
+        self._age += 1
+        self._pending = action
+        self.latencies.append(time.perf_counter() - start)
+        return _to_env_action(shadow.env, action)
@@ -3,6 +3,8 @@
 # Allard de Wit (allard.dewit@wur.nl), July 2018
 import datetime as dt
 import os
+import pickle
+from contextlib import contextmanager
 
 import numpy as np
 import pandas as pd
@@ -10,13 +12,139 @@ import requests
 from pcse.base import WeatherDataContainer, WeatherDataProvider
 from pcse.exceptions import PCSEError
 from pcse.settings import settings
-from pcse.util import check_angstromAB, ea_from_tdew, reference_ET
+from pcse.util import check_angstromAB
 
-# Define some lambdas to take care of unit conversions.
+from .astro import load_astro_table
+
+try:
+    import fcntl
+except ImportError:  # no advisory file locks (Windows), cache population is not serialized
+    fcntl = None
+
+
+@contextmanager
+def cache_lock(cache_filename):
+    """Exclusive advisory lock of a cache file, shared by all processes of the host.
+
+    The lock is held on a separate "<cache_filename>.lock" file that is never removed, so
+    processes waiting for it always lock the same inode. The OS releases it if the holder dies.
+    """
+    os.makedirs(os.path.dirname(cache_filename) or ".", exist_ok=True)
+    with open(cache_filename + ".lock", "a") as fp:
+        if fcntl is not None:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+
+# Define some lambdas to take care of unit conversions (scalars or arrays).
 MJ_to_J = lambda x: x * 1e6
 mm_to_cm = lambda x: x / 10.0
-tdew_to_hpa = lambda x: ea_from_tdew(x) * 10.0
-to_date = lambda d: d.date()
+
+
+def tdew_to_hpa(tdew):
+    """ Vapour pressure (hPa) from the dew point temperature, ea_from_tdew over arrays """
+    tdew = np.asarray(tdew, dtype=np.float64)
+    invalid = (tdew < -95.0) | (tdew > 65.0)
+    if invalid.any():
+        msg = "tdew=%g is not in range -95 to +60 deg C" % tdew[invalid].flat[0]
+        raise ValueError(msg)
+    return 0.6108 * np.exp((17.27 * tdew) / (tdew + 237.3)) * 10.0
+
+
+def _day_of_year(days):
+    """ Day of year (Jan 1st = 1) of a datetime64 array """
+    days = days.astype("datetime64[D]")
+    return (days - days.astype("datetime64[Y]")).astype(np.int64) + 1
+
+
+def reference_ET_arrays(
+    days, lat, elev, tmin, tmax, irrad, vap, wind, angsta, angstb, etmodel="PM"
+):
+    """ pcse.util.reference_ET over arrays of days
+
+    Penman E0, ES0 and ET0 (or Penman-Monteith ET0) with the same formulas as PCSE, the
+    astronomical variables are read from the astro table of the latitude (check astro.py).
+
+    Args:
+        days (np.ndarray): datetime64 days
+        lat (float): latitude
+        elev (float): elevation in m
+        tmin (np.ndarray): minimum temperature in C
+        tmax (np.ndarray): maximum temperature in C
+        irrad (np.ndarray): daily shortwave radiation in J/m2/day
+        vap (np.ndarray): vapour pressure in hPa
+        wind (np.ndarray): wind speed at 2 m in m/s
+        angsta (float): Angstrom A
+        angstb (float): Angstrom B
+        etmodel (str, optional): "PM"|"P". Defaults to "PM".
+
+    Returns:
+        tuple(np.ndarray, np.ndarray, np.ndarray): E0, ES0, ET0 in mm/day
+    """
+
+    if etmodel not in ["PM", "P"]:
+        msg = "Variable ETMODEL can have values 'PM'|'P' only."
+        raise RuntimeError(msg)
+    table = load_astro_table(lat)[_day_of_year(days)]
+    DAYL, ANGOT = table[:, 0], table[:, 5]
+
+    # Penman
+    TMPA = (tmin + tmax) / 2.0
+    TDIF = tmax - tmin
+    BU = 0.54 + 0.35 * np.clip((TDIF - 12.0) / 4.0, 0.0, 1.0)
+    PBAR = 1013.0 * np.exp(-0.034 * elev / (TMPA + 273.0))
+    GAMMA = 0.67 * PBAR / 1013.0
+    SVAP = 6.10588 * np.exp(17.32491 * TMPA / (TMPA + 238.102))
+    DELTA = 238.102 * 17.32491 * SVAP / (TMPA + 238.102) ** 2
+    VAP = np.minimum(vap, SVAP)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ATMTR = np.where(DAYL > 0.0, irrad / ANGOT, 0.0)
+    RELSSD = np.clip((ATMTR - abs(angsta)) / abs(angstb), 0.0, 1.0)
+    STBC = 5.670373e-8 * 24 * 60 * 60
+    with np.errstate(invalid="ignore"):
+        RB = STBC * (TMPA + 273.0) ** 4 * (0.56 - 0.079 * np.sqrt(VAP))
+    RB = RB * (0.1 + 0.9 * RELSSD)
+    RNW = (irrad * (1.0 - 0.05) - RB) / 2.45e6
+    RNS = (irrad * (1.0 - 0.15) - RB) / 2.45e6
+    RNC = (irrad * (1.0 - 0.25) - RB) / 2.45e6
+    EA = 0.26 * np.maximum(0.0, (SVAP - VAP)) * (0.5 + BU * wind)
+    EAC = 0.26 * np.maximum(0.0, (SVAP - VAP)) * (1.0 + BU * wind)
+    E0 = np.maximum(0.0, (DELTA * RNW + GAMMA * EA) / (DELTA + GAMMA))
+    ES0 = np.maximum(0.0, (DELTA * RNS + GAMMA * EA) / (DELTA + GAMMA))
+    ET0 = np.maximum(0.0, (DELTA * RNC + GAMMA * EAC) / (DELTA + GAMMA))
+    invalid = np.isnan(RB)
+
+    if etmodel == "PM":
+        VAP = vap / 10.0
+        PATM = 101.3 * ((293.0 - (0.0065 * elev)) / 293.0) ** 5.26
+        GAMMA = 0.665 * PATM * 1.0e-3
+        svp = lambda temp: 0.6108 * np.exp((17.27 * temp) / (237.3 + temp))
+        DELTA = (4098.0 * svp(TMPA)) / (TMPA + 237.3) ** 2
+        SVAP = (svp(tmax) + svp(tmin)) / 2.0
+        VAP = np.minimum(VAP, SVAP)
+        STB_TMAX = 4.903e-3 * (tmax + 273.16) ** 4
+        STB_TMIN = 4.903e-3 * (tmin + 273.16) ** 4
+        with np.errstate(invalid="ignore"):
+            RNL_TMP = ((STB_TMAX + STB_TMIN) / 2.0) * (0.34 - 0.14 * np.sqrt(VAP))
+        invalid |= np.isnan(RNL_TMP)
+        CSKYRAD = (0.75 + (2e-05 * elev)) * ANGOT
+        with np.errstate(divide="ignore", invalid="ignore"):
+            RNL = RNL_TMP * (1.35 * (irrad / CSKYRAD) - 0.35)
+        RN = ((1 - 0.23) * irrad - RNL) / 2.45e6
+        EA = (900.0 / (TMPA + 273)) * wind * (SVAP - VAP)
+        MGAMMA = GAMMA * (1.0 + (70.0 / 208.0 * wind))
+        ET0 = (DELTA * (RN - 0.0)) / (DELTA + MGAMMA) + (GAMMA * EA) / (DELTA + MGAMMA)
+        ET0 = np.where(CSKYRAD > 0, np.maximum(0.0, ET0), 0.0)
+
+    if invalid.any():
+        ix = int(np.flatnonzero(invalid)[0])
+        msg = "math domain error (vapour pressure %g hPa on %s)" % (vap[ix], days[ix])
+        raise ValueError(msg)
+    return E0, ES0, ET0
 
 
 class NASAPowerWeatherDataProvider(WeatherDataProvider):
@@ -57,6 +185,12 @@ class NASAPowerWeatherDataProvider(WeatherDataProvider):
     it will fall back to the existing cache file. The update of the cache
     file can be forced by setting `force_update=True`.
 
+    Cache population is single-flight: when many processes start at once
+    for a location without a usable cache file, one of them requests the
+    data while the others wait on a file lock and then load the cache file
+    it wrote. Cache files are written to a temporary file and renamed, so
+    readers never see a partially written file.
+
     Finally, note that any latitude/longitude within a 0.5x0.5 degrees grid box
     will yield the same weather data, e.g. there is no difference between
     lat/lon 5.3/52.1 and lat/lon 5.1/52.4. Nevertheless slight differences
@@ -107,46 +241,76 @@ class NASAPowerWeatherDataProvider(WeatherDataProvider):
         msg = "Retrieving weather data from NASA Power for lat/lon: (%f, %f)."
         self.logger.info(msg % (self.latitude, self.longitude))
 
-        # Check for existence of a cache file
-        cache_file = self._find_cache_file(self.latitude, self.longitude)
-        if cache_file is None or force_update is True:
+        # Load a recent cache file without locking, the common case
+        cache_filename = self._get_cache_filename(self.latitude, self.longitude)
+        mtime = self._cache_mtime(cache_filename)
+        if not force_update and self._load_recent_cache_file(mtime):
+            return
+
+        # One process fetches, the others wait for the lock and then read what it wrote
+        with cache_lock(cache_filename):
+            new_mtime = self._cache_mtime(cache_filename)
+            if new_mtime != mtime and self._load_recent_cache_file(new_mtime):
+                return
+            self._populate_cache(new_mtime, force_update)
+
+    def _cache_mtime(self, cache_filename):
+        """Modification time of the cache file, None if there is none.
+        """
+        try:
+            return os.stat(cache_filename).st_mtime
+        except OSError:
+            return None
+
+    def _load_recent_cache_file(self, mtime):
+        """Loads the cache file if it is younger than 90 days. Return True if successful.
+        """
+        if mtime is None:
+            return False
+        age = (dt.date.today() - dt.date.fromtimestamp(mtime)).days
+        if age >= 90:
+            return False
+        msg = "Start loading weather data from cache file: %s" % self._get_cache_filename(
+            self.latitude, self.longitude
+        )
+        self.logger.debug(msg)
+        return self._load_cache_file()
+
+    def _populate_cache(self, mtime, force_update):
+        """Gets the data from NASA Power and writes the cache file, called with the cache lock.
+
+        Falls back to an outdated cache file if the request fails.
+        """
+        if mtime is None or force_update is True:
             msg = "No cache file or forced update, getting data from NASA Power."
             self.logger.debug(msg)
             # No cache file, we really have to get the data from the NASA server
             self._get_and_process_NASAPower(self.latitude, self.longitude)
             return
 
-        # get age of cache file, if age < 90 days then try to load it. If loading fails retrieve data
-        # from the NASA server .
-        r = os.stat(cache_file)
-        cache_file_date = dt.date.fromtimestamp(r.st_mtime)
-        age = (dt.date.today() - cache_file_date).days
+        age = (dt.date.today() - dt.date.fromtimestamp(mtime)).days
         if age < 90:
-            msg = "Start loading weather data from cache file: %s" % cache_file
+            # Recent cache file failed loading
+            msg = "Loading cache file failed, reloading data from NASA Power."
             self.logger.debug(msg)
+            self._get_and_process_NASAPower(self.latitude, self.longitude)
+            return
 
+        # Cache file is too old. Try loading new data from NASA
+        try:
+            msg = "Cache file older then 90 days, reloading data from NASA Power."
+            self.logger.debug(msg)
+            self._get_and_process_NASAPower(self.latitude, self.longitude)
+        except Exception:
+            msg = (
+                "Reloading data from NASA failed, reverting to (outdated) "
+                + "cache file"
+            )
+            self.logger.debug(msg)
             status = self._load_cache_file()
             if status is not True:
-                msg = "Loading cache file failed, reloading data from NASA Power."
-                self.logger.debug(msg)
-                # Loading cache file failed!
-                self._get_and_process_NASAPower(self.latitude, self.longitude)
-        else:
-            # Cache file is too old. Try loading new data from NASA
-            try:
-                msg = "Cache file older then 90 days, reloading data from NASA Power."
-                self.logger.debug(msg)
-                self._get_and_process_NASAPower(self.latitude, self.longitude)
-            except Exception:
-                msg = (
-                    "Reloading data from NASA failed, reverting to (outdated) "
-                    + "cache file"
-                )
-                self.logger.debug(msg)
-                status = self._load_cache_file()
-                if status is not True:
-                    msg = "Outdated cache file failed loading."
-                    raise PCSEError(msg)
+                msg = "Outdated cache file failed loading."
+                raise PCSEError(msg)
 
     def _get_and_process_NASAPower(self, latitude, longitude):
         """Handles the retrieval and processing of the NASA Power data
@@ -171,7 +335,7 @@ class NASAPowerWeatherDataProvider(WeatherDataProvider):
         df_pcse = self._POWER_to_PCSE(df_power)
 
         # Start building the weather data containers
-        self._make_WeatherDataContainers(df_pcse.to_dict(orient="records"))
+        self._make_WeatherDataContainers(df_pcse)
 
         # dump contents to a cache file
         cache_filename = self._get_cache_filename(latitude, longitude)
@@ -300,6 +464,30 @@ class NASAPowerWeatherDataProvider(WeatherDataProvider):
             msg = "Failed to write cache to file '%s' due to: %s" % (cache_filename, e)
             self.logger.warning(msg)
 
+    def _dump(self, cache_fname):
+        """Dumps the contents into cache_fname using pickle, through a temporary file.
+
+        The temporary file is renamed over cache_fname, so concurrent readers load either the
+        previous or the new contents, never a partially written file.
+        """
+        os.makedirs(os.path.dirname(cache_fname) or ".", exist_ok=True)
+        tmp = "%s.tmp%i" % (cache_fname, os.getpid())
+        try:
+            with open(tmp, "wb") as fp:
+                dmp = (
+                    self.store,
+                    self.elevation,
+                    self.longitude,
+                    self.latitude,
+                    self.description,
+                    self.ETmodel,
+                )
+                pickle.dump(dmp, fp, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache_fname)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
     def _load_cache_file(self):
         """Loads the data from the cache file. Return True if successful.
         """
@@ -314,58 +502,78 @@ class NASAPowerWeatherDataProvider(WeatherDataProvider):
             self.logger.warning(msg)
             return False
 
-    def _make_WeatherDataContainers(self, recs):
-        """Create a WeatherDataContainers from recs, compute ET and store the WDC's.
+    def _make_WeatherDataContainers(self, columns):
+        """Compute ET of all days at once and store one WDC per day.
+
+        :param columns: pd.DataFrame or dict of arrays with DAY, LAT, LON, ELEV, TMIN, TMAX,
+            TEMP, IRRAD, VAP, RAIN and WIND
         """
 
-        for rec in recs:
-            # Reference evapotranspiration in mm/day
-            try:
-                E0, ES0, ET0 = reference_ET(
-                    rec["DAY"],
-                    rec["LAT"],
-                    rec["ELEV"],
-                    rec["TMIN"],
-                    rec["TMAX"],
-                    rec["IRRAD"],
-                    rec["VAP"],
-                    rec["WIND"],
-                    self.angstA,
-                    self.angstB,
-                    self.ETmodel,
-                )
-            except ValueError as e:
-                msg = (
-                    ("Failed to calculate reference ET values on %s. " % rec["DAY"])
-                    + ("With input values:\n %s.\n" % str(rec))
-                    + ("Due to error: %s" % e)
-                )
-                raise PCSEError(msg)
+        days = np.asarray(columns["DAY"], dtype="datetime64[D]")
+        values = {
+            k: np.broadcast_to(np.asarray(columns[k], dtype=np.float64), days.shape)
+            for k in ("TMIN", "TMAX", "TEMP", "IRRAD", "VAP", "RAIN", "WIND")
+        }
+        lat, lon, elev = (
+            float(np.asarray(columns[k]).flat[0]) for k in ("LAT", "LON", "ELEV")
+        )
+        try:
+            E0, ES0, ET0 = reference_ET_arrays(
+                days,
+                lat,
+                elev,
+                values["TMIN"],
+                values["TMAX"],
+                values["IRRAD"],
+                values["VAP"],
+                values["WIND"],
+                self.angstA,
+                self.angstB,
+                self.ETmodel,
+            )
+        except ValueError as e:
+            msg = "Failed to calculate reference ET values due to error: %s" % e
+            raise PCSEError(msg)
 
-            # update record with ET values value convert to cm/day
-            rec.update({"E0": E0 / 10.0, "ES0": ES0 / 10.0, "ET0": ET0 / 10.0})
+        # ET values converted to cm/day
+        values.update({"E0": E0 / 10.0, "ES0": ES0 / 10.0, "ET0": ET0 / 10.0})
 
-            # Build weather data container from dict 't'
+        # Build one weather data container per day, with the range checks of PCSE
+        names = list(values)
+        columns = [values[k].tolist() for k in names]
+        for day, *row in zip(days.astype(object).tolist(), *columns):
+            rec = dict(zip(names, row), DAY=day, LAT=lat, LON=lon, ELEV=elev)
             wdc = WeatherDataContainer(**rec)
-
-            # add wdc to dictionary for thisdate
             self._store_WeatherDataContainer(wdc, wdc.DAY)
 
     def _process_POWER_records(self, powerdata):
         """Process the meteorological records returned by NASA POWER
+
+        The JSON columns are converted to float arrays at once, fill values become NaN and the
+        YYYYMMDD keys are parsed as integers.
         """
         msg = "Start parsing of POWER records from URL retrieval."
         self.logger.debug(msg)
 
         fill_value = float(powerdata["header"]["fill_value"])
+        parameters = powerdata["properties"]["parameter"]
+        keys = list(parameters[self.power_variables[0]])
 
         df_power = {}
         for varname in self.power_variables:
-            s = pd.Series(powerdata["properties"]["parameter"][varname])
-            s[s == fill_value] = np.NaN
+            records = parameters[varname]
+            if list(records) == keys:
+                s = np.fromiter(records.values(), dtype=np.float64, count=len(keys))
+            else:
+                s = pd.Series(records, dtype=np.float64).reindex(keys).to_numpy()
+            s[s == fill_value] = np.nan
             df_power[varname] = s
-        df_power = pd.DataFrame(df_power)
-        df_power["DAY"] = pd.to_datetime(df_power.index, format="%Y%m%d")
+
+        dates = np.array(keys).astype(np.int64)
+        years = (dates // 10000 - 1970).astype("datetime64[Y]")
+        months = years.astype("datetime64[M]") + (dates // 100 % 100 - 1)
+        df_power["DAY"] = months.astype("datetime64[D]") + (dates % 100 - 1)
+        df_power = pd.DataFrame(df_power, index=keys)
 
         # find all rows with one or more missing values (NaN)
         ix = df_power.isnull().any(axis=1)
@@ -379,14 +587,14 @@ class NASAPowerWeatherDataProvider(WeatherDataProvider):
         # Convert POWER data to a dataframe with PCSE compatible inputs
         df_pcse = pd.DataFrame(
             {
-                "TMAX": df_power.T2M_MAX,
-                "TMIN": df_power.T2M_MIN,
-                "TEMP": df_power.T2M,
-                "IRRAD": df_power.ALLSKY_SFC_SW_DWN.apply(MJ_to_J),
-                "RAIN": df_power.PRECTOTCORR.apply(mm_to_cm),
-                "WIND": df_power.WS2M,
-                "VAP": df_power.T2MDEW.apply(tdew_to_hpa),
-                "DAY": df_power.DAY.apply(to_date),
+                "TMAX": df_power.T2M_MAX.to_numpy(),
+                "TMIN": df_power.T2M_MIN.to_numpy(),
+                "TEMP": df_power.T2M.to_numpy(),
+                "IRRAD": MJ_to_J(df_power.ALLSKY_SFC_SW_DWN.to_numpy()),
+                "RAIN": mm_to_cm(df_power.PRECTOTCORR.to_numpy()),
+                "WIND": df_power.WS2M.to_numpy(),
+                "VAP": tdew_to_hpa(df_power.T2MDEW.to_numpy()),
+                "DAY": df_power.DAY.to_numpy(),
                 "LAT": self.latitude,
                 "LON": self.longitude,
                 "ELEV": self.elevation,
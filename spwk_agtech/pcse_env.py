@@ -2,6 +2,7 @@ import copy
 import datetime
 import logging
 import os
+from contextlib import nullcontext
 
 import gym
 import numpy as np
@@ -11,24 +12,79 @@ from pcse.base import ParameterProvider
 from pcse.engine import Engine
 from pcse.fileinput import CABOFileReader
 
-from .const import ACTIONS, OBSERVATIONS
-from .utils import NASAPowerWeatherDataFetcher, plot_pcse_engine, send_actions2engine
+from .astro import astro_tables_installed, load_astro_table
+from .const import ACTION_SUBSETS, ACTIONS, OBSERVATIONS, WEATHER_ACTIONS
+from .metrics import STEP_PHASES, EnvMetrics, null_timer
+from .render import IncrementalRenderer
+from .scaling import ACTION_SCALING, OBS_SCALING
+from .utils import NASAPowerWeatherDataFetcher, send_actions2engine
 
 pcse_data_dir = os.path.join(os.path.dirname(__file__), "data")
 
 
+def load_parameters():
+    """ Parse the bundled crop, soil and site CABO files into one ParameterProvider
+
+    Returns:
+        ParameterProvider: parameters of wofost_npk.crop, wofost_npk.soil and wofost_npk.site
+    """
+
+    crop = CABOFileReader(os.path.join(pcse_data_dir, "wofost_npk.crop"))
+    soil = CABOFileReader(os.path.join(pcse_data_dir, "wofost_npk.soil"))
+    site = CABOFileReader(os.path.join(pcse_data_dir, "wofost_npk.site"))
+    return ParameterProvider(soildata=soil, cropdata=crop, sitedata=site)
+
+
+def copy_parameters(parameterprovider):
+    """ New ParameterProvider over the parsed parameters of parameterprovider
+
+    The copy has its own overrides (a copy of the current ones) and crop activation state: PCSE
+    clears the overrides of the provider of an engine when its crop finishes, which must not
+    reach the given provider.
+
+    Args:
+        parameterprovider (ParameterProvider): provider to copy, e.g. from load_parameters
+
+    Returns:
+        ParameterProvider: provider sharing the crop, soil and site data of parameterprovider
+    """
+
+    params = ParameterProvider(
+        sitedata=parameterprovider._sitedata,
+        timerdata=dict(parameterprovider._timerdata),
+        soildata=parameterprovider._soildata,
+        cropdata=parameterprovider._cropdata,
+    )
+    for name, value in dict(parameterprovider._override).items():
+        params.set_override(name, value, check=False)
+    return params
+
+
 def get_profit(state, action, done):
     """ Get profit from state, action and done state.
 
+    Batches of transitions (state of shape (..., 11), action of shape (..., 13) and done of
+    shape (...)) give the profit of each transition.
+
     Args:
         state (np.ndarray or tensor): State from PCSE environment
         action (np.ndarray or tensor): Action from Actor
-        done (bool): Done state
+        done (bool or np.ndarray): Done state
 
     Returns:
-        float: Profit (Income - Cost)
+        float or np.ndarray: Profit (Income - Cost)
     """
 
+    if np.ndim(action) > 1 or np.ndim(done) > 0:
+        price = np.where(done, state[..., 3] * 279.34 / 1000, 0)
+        cost = (
+            action[..., 9] * 50 / 10
+            + action[..., 10] * 250 / 1000
+            + action[..., 11] * 460 / 1000
+            + action[..., 12] * 370 / 1000
+        )
+        return price - cost
+
     if done:
         price = state[3] * 279.34 / 1000  # wheat price is 279.34 USD / 1000 kg
     else:
@@ -107,6 +163,11 @@ class PcseEnv(gym.Env):
         'P': Amount of P fertilizer in kg/ha applied on this day
         'K': Amount of K fertilizer in kg/ha applied on this day
 
+        Only a subset of the actions can be controlled with controlled_actions, either a key of
+        ACTION_SUBSETS ("all", "weather", "management") or a list of action names. The action space
+        then shrinks to the controlled actions, uncontrolled weather follows the reference weather
+        and uncontrolled irrigation/fertilization is 0.
+
     Note: Check const.py for detailed information about obseravations and actions
 
     Reward:
@@ -118,10 +179,43 @@ class PcseEnv(gym.Env):
 
     Episode Termination:
         If 'DVS' > 2.
-        If simulation ends (365 days).
+        If simulation ends (365 days), flagged with info["TimeLimit.truncated"] = True.
+        If an early-termination predicate fires, e.g. termination=[CropDeath(), StalledDVS()]
+        (check termination.py). The current yield is then settled as at the end of a season.
+        The cause is given in info["termination"] ("maturity", "time_limit" or the predicate name).
+        Both keys are in the info of every step (None and False while the episode runs).
+        Predicates see the profit after the cost of the current action.
+
+    Weather:
+        By default the NASA POWER weather of lat/long is fetched. Any WeatherDataProvider can be
+        given instead with weather=..., e.g. a SharedWeatherDataProvider (check shared_weather.py)
+        so that multi-process workers share one copy of the weather of a site.
+
+    Parameters:
+        By default the bundled CABO files are parsed at every reset. A parsed ParameterProvider
+        (see load_parameters) can be shared instead with parameterprovider=..., parameter values
+        can then be changed with its set_override method without touching the files. Every episode
+        runs on its own copy (check copy_parameters), so the overrides stay set after the episode.
+
+    Astronomy:
+        Daylength and the radiation-independent astro variables only depend on latitude and day of
+        year. Opt-in with astro_tables=True: the crop modules then read them from a per-latitude
+        table built once and cached next to the weather cache (check astro.py). The PCSE functions
+        are only replaced while the env runs its engine; the replacement swaps module globals, so
+        do not run envs with and without tables in concurrent threads.
+
+    Rendering:
+        render() updates one figure with the days simulated since the last call (check render.py),
+        "human" draws it without blocking and "rgb_array" returns the image. Recorded episodes can be
+        exported headless with render.export_episodes.
+
+    Instrumentation:
+        Opt-in with metrics=True (or a shared EnvMetrics). Per-phase timings of reset/step are
+        recorded in env.metrics and the timings of the last step are returned in info["timings"].
+        Check metrics.py for exporting them (JSON / Prometheus text format).
     """
 
-    metadata = {"render.modes": ["human"]}
+    metadata = {"render.modes": ["human", "rgb_array"]}
 
     def __init__(
         self,
@@ -131,6 +225,12 @@ class PcseEnv(gym.Env):
         variety_name="winter-wheat",
         campaign_start_date="1988-01-01",
         emergence_date="1988-01-01",
+        metrics=None,
+        parameterprovider=None,
+        controlled_actions=None,
+        weather=None,
+        termination=None,
+        astro_tables=False,
     ):
         super().__init__()
         self.lat = lat
@@ -150,56 +250,83 @@ class PcseEnv(gym.Env):
             high=np.array([1] * 11, dtype=np.float32),
         )
 
+        self._init_controlled_actions(controlled_actions)
         self.action_space = Box(
-            low=np.array([-1] * 13, dtype=np.float32),
-            high=np.array([1] * 13, dtype=np.float32),
+            low=np.array([-1] * len(self.action_name), dtype=np.float32),
+            high=np.array([1] * len(self.action_name), dtype=np.float32),
         )
 
-        self.obs_min = np.array(
-            [v["min"] for v in OBSERVATIONS.values()], dtype=np.float32
-        )
-        self.obs_max = np.array(
-            [v["max"] for v in OBSERVATIONS.values()], dtype=np.float32
-        )
-        self.action_min = np.array(
-            [v["min"] for v in ACTIONS.values()], dtype=np.float32
-        )
-        self.action_max = np.array(
-            [v["max"] for v in ACTIONS.values()], dtype=np.float32
-        )
+        self.obs_min = OBS_SCALING.low
+        self.obs_max = OBS_SCALING.high
+        self.action_min = ACTION_SCALING.low
+        self.action_max = ACTION_SCALING.high
         self.obs_name = list(OBSERVATIONS.keys())
         self.obs_unit = [v["unit"] for v in OBSERVATIONS.values()]
 
-        self.ref_weather = NASAPowerWeatherDataFetcher(self.lat, self.long)
+        if metrics is True:
+            metrics = EnvMetrics()
+        self.metrics = metrics or None
+        self._timer = self.metrics.timer if self.metrics is not None else null_timer
+
+        self.parameterprovider = parameterprovider
+        if weather is None:
+            weather = NASAPowerWeatherDataFetcher(self.lat, self.long)
+        self.ref_weather = weather
+        self.termination = list(termination or [])
+        self._astro = nullcontext
+        if astro_tables:
+            self._astro = astro_tables_installed
+            load_astro_table(self.lat)
         self.profit = 0
         self.need_reset = True
         self.done = False
+        self._renderer = None
+
+    def _init_controlled_actions(self, controlled_actions):
+        if controlled_actions is None:
+            controlled_actions = "all"
+        if isinstance(controlled_actions, str):
+            controlled_actions = ACTION_SUBSETS[controlled_actions]
+        all_actions = list(ACTIONS.keys())
+        unknown = set(controlled_actions) - set(all_actions)
+        if unknown:
+            raise ValueError(f"Unknown action(s) {unknown}. Check const.py.")
+
+        # keep the order of const.py whatever the order of the request
+        self.action_name = [k for k in all_actions if k in controlled_actions]
+        self.weather_vars = [k for k in WEATHER_ACTIONS if k in self.action_name]
+        if len(self.action_name) == len(all_actions):
+            self.action_index = None
+            self.action_scaling = ACTION_SCALING
+            return
+
+        self.action_index = np.array([all_actions.index(k) for k in self.action_name])
+        self.action_scaling = ACTION_SCALING.subset(self.action_index)
+        # uncontrolled weather follows the reference weather (NaN), management is 0
+        self.default_action = np.array(
+            [np.nan if k in WEATHER_ACTIONS else 0 for k in all_actions],
+            dtype=np.float32,
+        )
 
     def denorm(self, value, cat):
         if cat == "act":
-            denorm_value = (
-                value * (self.action_max - self.action_min)
-                + self.action_min
-                + self.action_max
-            ) / 2
-            denorm_value = np.clip(denorm_value, self.action_min, self.action_max)
+            if self.action_index is None:
+                return ACTION_SCALING.denorm_clip(value)
+            value = self.action_scaling.denorm_clip(value)
+            full = np.empty(value.shape[:-1] + self.default_action.shape, np.float32)
+            full[...] = self.default_action
+            full[..., self.action_index] = value
+            return full
         elif cat == "obs":
-            denorm_value = (
-                value * (self.obs_max - self.obs_min) + self.obs_min + self.obs_max
-            ) / 2
-        return denorm_value
+            return OBS_SCALING.denorm(value)
 
     def norm(self, value, cat):
         if cat == "act":
-            norm_value = (2 * value - (self.action_max + self.action_min)) / (
-                self.action_max - self.action_min
-            )
+            if self.action_index is None:
+                return ACTION_SCALING.norm(value)
+            return self.action_scaling.norm(np.asarray(value)[..., self.action_index])
         elif cat == "obs":
-            norm_value = (2 * value - (self.obs_max + self.obs_min)) / (
-                self.obs_max - self.obs_min
-            )
-            norm_value = np.clip(norm_value, -1, 1)
-        return norm_value
+            return OBS_SCALING.norm_clip(value)
 
     def _module_init(self):
         self.weather = copy.deepcopy(self.ref_weather)
@@ -235,6 +362,12 @@ class PcseEnv(gym.Env):
             maxdur=365,
         )
 
+        if self.parameterprovider is not None:
+            # A new provider per episode: the engine activates its crop once and clears the
+            # overrides when the crop finishes
+            self.params = copy_parameters(self.parameterprovider)
+            return
+
         self.crop = CABOFileReader(os.path.join(pcse_data_dir, "wofost_npk.crop"))
         self.soil = CABOFileReader(os.path.join(pcse_data_dir, "wofost_npk.soil"))
         self.site = CABOFileReader(os.path.join(pcse_data_dir, "wofost_npk.site"))
@@ -262,11 +395,22 @@ class PcseEnv(gym.Env):
         return obs
 
     def reset(self, seed=None):
+        with self._timer("reset"):
+            obs = self._reset()
+        if self.metrics is not None:
+            self.metrics.incr("resets")
+        return obs
+
+    def _reset(self):
         self.profit = 0
         self.need_reset = False
         self.done = False
-        self._engine_init()
-        obs = self.get_obs(self.engine.get_output()[-1], self.obs_name)
+        for predicate in self.termination:
+            predicate.reset()
+        with self._timer("engine_init"), self._astro():
+            self._engine_init()
+        with self._timer("get_output"):
+            obs = self.get_obs(self.engine.get_output()[-1], self.obs_name)
         self.obs = obs
         return obs
 
@@ -275,39 +419,75 @@ class PcseEnv(gym.Env):
             logging.error("Needs reset")
             return None
 
-        action = self.denorm(action, "act")
-        send_actions2engine(action, self.engine)
-        self.engine.run(days=1)
-
+        with self._timer("step"):
+            next_obs, reward, done, info = self._step(action)
+        if self.metrics is not None:
+            self.metrics.incr("steps")
+            if done:
+                self.metrics.incr("episodes")
+            info["timings"] = self.metrics.last_timings(STEP_PHASES)
+        return next_obs, reward, done, info
+
+    def _step(self, action):
+        with self._timer("denorm"):
+            action = self.denorm(action, "act")
+        with self._timer("send_actions"):
+            send_actions2engine(action, self.engine, self.weather_vars)
+        with self._timer("engine_run"), self._astro():
+            self.engine.run(days=1)
+
+        termination = None
         if self.engine.day - self.current_date == datetime.timedelta(0):
             self.done = True
+            termination = "time_limit"
         else:
             self.current_date = self.engine.day
 
-        next_obs = self.get_obs(self.engine.get_output()[-1], self.obs_name)
-        if self.denorm(next_obs, "obs")[0] >= 2:
-            self.done = True
-
-        self.profit += get_profit(self.denorm(next_obs, "obs"), action, self.done)
-        reward = get_reward(
-            self.denorm(self.obs, "obs"),
-            self.denorm(next_obs, "obs"),
-            action,
-            self.done,
-        )
-        info = {}
+        with self._timer("get_output"):
+            next_obs = self.get_obs(self.engine.get_output()[-1], self.obs_name)
+
+        with self._timer("reward"):
+            next_state = self.denorm(next_obs, "obs")
+            # the cost of the action is paid before the predicates see the profit
+            self.profit += get_profit(next_state, action, False)
+            if next_state[0] >= 2:
+                self.done = True
+                termination = "maturity"
+            elif not self.done:
+                for predicate in self.termination:
+                    if predicate(next_state, self):
+                        self.done = True
+                        termination = predicate.name
+                        break
+
+            if self.done:
+                self.profit += get_profit(next_state, np.zeros_like(action), True)
+            reward = get_reward(
+                self.denorm(self.obs, "obs"), next_state, action, self.done
+            )
+        info = {
+            "termination": termination,
+            "TimeLimit.truncated": termination == "time_limit",
+        }
 
         self.obs = next_obs
         return next_obs, reward, self.done, info
 
     def render(self, mode="human"):
         print(f"profit: {self.profit} USD/ha")
-        try:
-            fig = plot_pcse_engine(self.engine.get_output())
-            return fig
-        except AttributeError:
+        if not hasattr(self, "engine"):
             logging.error("Needs reset. You should first initialize environment.")
             return None
+        if self._renderer is None:
+            self._renderer = IncrementalRenderer(
+                self.obs_name, interactive=mode == "human"
+            )
+        fig = self._renderer.update(self.engine)
+        if mode == "rgb_array":
+            return self._renderer.rgb_array()
+        return fig
 
     def close(self):
-        pass
+        if self._renderer is not None:
+            self._renderer.close()
+            self._renderer = None
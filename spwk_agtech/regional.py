@@ -0,0 +1,169 @@
+import logging
+import math
+import multiprocessing as mp
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .pcse_env import PcseEnv, load_parameters
+from .sweep import episode_summary, no_management_policy
+from .utils import NASAPowerWeatherDataFetcher, pcse_runner
+
+# Resolution of the NASA POWER grid in degrees
+POWER_TILE = 0.5
+
+RegionResult = namedtuple(
+    "RegionResult", ["cells", "lat", "long", "rasters", "cells_per_second"]
+)
+
+# Per-process parameters used by the regional workers
+_params = None
+
+
+def tile_of(lat, long, resolution=POWER_TILE):
+    """ South-west corner of the POWER tile holding a site
+
+    Args:
+        lat (float): latitude
+        long (float): longitude
+        resolution (float, optional): tile size in degrees. Defaults to POWER_TILE.
+
+    Returns:
+        tuple(float, float): latitude and longitude of the tile corner
+    """
+
+    return (
+        math.floor(lat / resolution) * resolution,
+        math.floor(long / resolution) * resolution,
+    )
+
+
+def grid_catalogue(lat_range, long_range, step=0.1):
+    """ Site catalogue of a regular grid (bounds included)
+
+    Args:
+        lat_range (tuple): (south, north) latitudes
+        long_range (tuple): (west, east) longitudes
+        step (float, optional): grid step in degrees. Defaults to 0.1.
+
+    Returns:
+        pd.DataFrame: one row per cell with lat and long
+    """
+
+    lats = np.round(np.arange(lat_range[0], lat_range[1] + step / 2, step), 6)
+    longs = np.round(np.arange(long_range[0], long_range[1] + step / 2, step), 6)
+    lat, long = np.meshgrid(lats, longs, indexing="ij")
+    return pd.DataFrame({"lat": lat.ravel(), "long": long.ravel()})
+
+
+def _init_worker():
+    global _params
+    _params = load_parameters()
+
+
+def _run_tile(task):
+    tile, cells, policy, env_kwargs = task
+    weather = NASAPowerWeatherDataFetcher(*tile)
+    env = PcseEnv(
+        lat=tile[0],
+        long=tile[1],
+        weather=weather,
+        parameterprovider=_params,
+        **env_kwargs,
+    )
+
+    rows = []
+    for cell in cells:
+        overrides = {k: v for k, v in cell.items() if k not in ("cell", "lat", "long")}
+        _params.clear_override()
+        for name, value in overrides.items():
+            _params.set_override(name, value)
+        try:
+            actions, rewards = pcse_runner(env, policy)
+        finally:
+            _params.clear_override()
+        row = {"cell": cell["cell"], "lat": cell["lat"], "long": cell["long"]}
+        row.update(episode_summary(env, actions, rewards))
+        rows.append(row)
+    return rows
+
+
+def run_region(
+    catalogue,
+    policy=no_management_policy,
+    processes=None,
+    output=None,
+    env_kwargs=None,
+):
+    """ Simulate every cell of a site catalogue, loading the weather once per POWER tile
+
+    Cells are grouped by 0.5 degree POWER tile (the weather of all cells of a tile is the same)
+    and the tiles are fanned out across processes. Columns of the catalogue other than lat and
+    long are parameter overrides of the cell (e.g. soil parameters), as in run_sweep.
+
+    Args:
+        catalogue (pd.DataFrame): one row per cell with lat, long and optional parameter columns
+        policy (function or class, optional): picklable policy, see pcse_runner. Defaults to no_management_policy.
+        processes (int, optional): number of worker processes, 1 runs in this process. Defaults to None (os.cpu_count()).
+        output (str, optional): .npz file the rasters are written to. Defaults to None.
+        env_kwargs (dict, optional): keyword arguments of PcseEnv. Defaults to None.
+
+    Returns:
+        RegionResult: per-cell results (pd.DataFrame in catalogue order), sorted unique latitudes
+            and longitudes, {variable: (lat, long) array} rasters and the throughput in cells/s
+    """
+
+    env_kwargs = env_kwargs or {}
+    processes = processes or os.cpu_count()
+    catalogue = catalogue.reset_index(drop=True)
+    records = catalogue.assign(cell=catalogue.index).to_dict(orient="records")
+
+    tiles = {}
+    for rec in records:
+        tiles.setdefault(tile_of(rec["lat"], rec["long"]), []).append(rec)
+    # largest tiles first for a better balance across processes
+    tasks = sorted(
+        ((tile, cells, policy, env_kwargs) for tile, cells in tiles.items()),
+        key=lambda task: -len(task[1]),
+    )
+
+    rows = []
+    start = time.perf_counter()
+    if processes == 1:
+        _init_worker()
+        for tile_rows in map(_run_tile, tasks):
+            rows.extend(tile_rows)
+    else:
+        with mp.Pool(processes, initializer=_init_worker) as pool:
+            for tile_rows in pool.imap_unordered(_run_tile, tasks):
+                rows.extend(tile_rows)
+    elapsed = time.perf_counter() - start
+    cells_per_second = len(records) / elapsed
+    logging.info(
+        f"{len(records)} cells in {len(tiles)} tiles, {elapsed:.1f} s "
+        f"({cells_per_second:.2f} cells/s)"
+    )
+
+    cells = pd.DataFrame(rows).sort_values("cell").set_index("cell")
+    lat = np.unique(cells["lat"].to_numpy())
+    long = np.unique(cells["long"].to_numpy())
+    ilat = np.searchsorted(lat, cells["lat"].to_numpy())
+    ilong = np.searchsorted(long, cells["long"].to_numpy())
+    rasters = {}
+    for varname in ("profit", "TWSO", "TAGP", "days"):
+        raster = np.full((len(lat), len(long)), np.nan)
+        raster[ilat, ilong] = cells[varname].to_numpy()
+        rasters[varname] = raster
+
+    if output is not None:
+        np.savez_compressed(output, lat=lat, long=long, **rasters)
+    return RegionResult(
+        cells=cells,
+        lat=lat,
+        long=long,
+        rasters=rasters,
+        cells_per_second=cells_per_second,
+    )
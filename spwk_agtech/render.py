@@ -0,0 +1,314 @@
+import html
+import io
+import multiprocessing as mp
+import os
+
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from .const import OBSERVATIONS
+
+OBS_NAME = list(OBSERVATIONS.keys())
+EXPORT_FORMATS = ("png", "svg", "html")
+
+# Per-process figure reused by the export workers
+_figure = None
+
+
+def _as_arrays(episode, obs_name=OBS_NAME):
+    """ Days (matplotlib date numbers) and (days, variables) values of a recorded episode
+
+    An episode is an engine output (list of dicts with "day", see engine.get_output()),
+    a pd.DataFrame indexed by day, or a (days, variables) array of physical observations
+    (days then count from 0).
+    """
+
+    if isinstance(episode, np.ndarray):
+        return np.arange(len(episode), dtype=np.float64), episode
+    if hasattr(episode, "to_dict"):
+        episode = episode.reset_index().to_dict(orient="records")
+    days = mdates.date2num([rec["day"] for rec in episode])
+    values = np.array(
+        [[np.nan if rec[k] is None else rec[k] for k in obs_name] for rec in episode],
+        dtype=np.float64,
+    )
+    return days, values
+
+
+class EpisodeFigure:
+    """4x3 grid of observation plots whose lines are updated in place
+
+    The figure, axes and line artists are created once. append() only adds the new days to
+    preallocated buffers and grows the axis limits with running min/max, so updating during an
+    episode costs O(new days) plus one draw.
+
+    Args:
+        fig (Figure, optional): figure to draw in, e.g. from plt.figure(). Defaults to None
+            (headless Agg figure).
+        obs_name (list, optional): variables to plot. Defaults to OBS_NAME.
+        capacity (int, optional): initial number of days of the buffers. Defaults to 400.
+        figsize (tuple, optional): size of the headless figure in inches. Defaults to (12, 14).
+    """
+
+    def __init__(self, fig=None, obs_name=OBS_NAME, capacity=400, figsize=(12, 14)):
+        if fig is None:
+            fig = Figure(figsize=figsize)
+            FigureCanvasAgg(fig)
+        self.fig = fig
+        self.obs_name = list(obs_name)
+        self.axes = fig.subplots(nrows=4, ncols=3).flatten()
+        self.lines = []
+        for ax, name in zip(self.axes, self.obs_name):
+            spec = OBSERVATIONS.get(name, {})
+            (line,) = ax.plot([], [])
+            ax.set_title(spec.get("mean", name))
+            ax.set_ylabel(spec.get("unit", ""), rotation=0, fontsize=10)
+            ax.yaxis.set_label_coords(0, 1.02)
+            self.lines.append(line)
+        for ax in self.axes[len(self.obs_name) :]:
+            ax.set_visible(False)
+        self.days = np.empty(capacity)
+        self.values = np.empty((capacity, len(self.obs_name)))
+        self.clear()
+
+    def clear(self):
+        """ Remove all days """
+        self.n = 0
+        self.low = np.full(len(self.obs_name), np.inf)
+        self.high = np.full(len(self.obs_name), -np.inf)
+        for line in self.lines:
+            line.set_data([], [])
+
+    def set_data(self, days, values):
+        """ Replace all days
+
+        Args:
+            days (np.ndarray): x values (matplotlib date numbers or day counts)
+            values (np.ndarray): (days, variables) values
+        """
+        self.clear()
+        self.append(days, values)
+
+    def append(self, days, values, autoscale=True):
+        """ Add new days
+
+        Args:
+            days (np.ndarray): x values (matplotlib date numbers or day counts)
+            values (np.ndarray): (new days, variables) values
+            autoscale (bool, optional): fit the axis limits to the data, otherwise keep the
+                limits unless the new days fall outside. Defaults to True.
+
+        Returns:
+            bool: True if axis limits changed (the whole figure has to be redrawn)
+        """
+        new = len(days)
+        if new == 0:
+            return False
+        if self.n + new > len(self.days):
+            capacity = max(2 * len(self.days), self.n + new)
+            self.days = np.resize(self.days, capacity)
+            self.values = np.resize(self.values, (capacity, len(self.obs_name)))
+        self.days[self.n : self.n + new] = days
+        self.values[self.n : self.n + new] = values
+        self.n += new
+
+        with np.errstate(invalid="ignore"):
+            self.low = np.fmin(self.low, np.nanmin(values, axis=0))
+            self.high = np.fmax(self.high, np.nanmax(values, axis=0))
+        x0, x1 = self.days[0], self.days[self.n - 1]
+        if self.n == new and x0 > 1000:
+            # x values are dates
+            for ax in self.axes:
+                locator = mdates.AutoDateLocator()
+                ax.xaxis.set_major_locator(locator)
+                ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+
+        changed = autoscale
+        for ix, (ax, line) in enumerate(zip(self.axes, self.lines)):
+            line.set_data(self.days[: self.n], self.values[: self.n, ix])
+            if autoscale or not ax.get_xlim()[0] <= x1 <= ax.get_xlim()[1]:
+                ax.set_xlim(x0, max(x1, x0 + 1))
+                changed = True
+            low, high = self.low[ix], self.high[ix]
+            bottom, top = ax.get_ylim()
+            if np.isfinite(low) and (autoscale or low < bottom or high > top):
+                margin = 0.05 * (high - low) or 0.5
+                ax.set_ylim(low - margin, high + margin)
+                changed = True
+        return changed
+
+    def set_limits(self, x0, x1):
+        """ Fix the x range and the y ranges to the bounds of OBSERVATIONS
+
+        Args:
+            x0 (float): first x value
+            x1 (float): last x value
+        """
+        for ax, name in zip(self.axes, self.obs_name):
+            ax.set_xlim(x0, x1)
+            if name in OBSERVATIONS:
+                low, high = OBSERVATIONS[name]["min"], OBSERVATIONS[name]["max"]
+                margin = 0.05 * (high - low)
+                ax.set_ylim(low - margin, high + margin)
+
+    def save(self, path, fmt=None, dpi=80, title=None):
+        """ Write the figure to a PNG, SVG or HTML (inline SVG) file
+
+        Args:
+            path (str): output file
+            fmt (str, optional): one of EXPORT_FORMATS. Defaults to None (extension of path).
+            dpi (int, optional): resolution of PNG files. Defaults to 80.
+            title (str, optional): title of the figure. Defaults to None.
+        """
+        fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown format {fmt}, use one of {EXPORT_FORMATS}.")
+        self.fig.suptitle(title or "")
+        if fmt == "html":
+            buffer = io.StringIO()
+            self.fig.savefig(buffer, format="svg")
+            with open(path, "w") as f:
+                f.write(
+                    f"<!DOCTYPE html>\n<html><head><meta charset='utf-8'>"
+                    f"<title>{html.escape(title or '')}</title></head>\n<body>\n{buffer.getvalue()}\n</body></html>\n"
+                )
+        else:
+            self.fig.savefig(path, format=fmt, dpi=dpi)
+
+
+class IncrementalRenderer:
+    """ Live plot of the engine output of an environment, updated with the new days only
+
+    Used by PcseEnv.render. The figure is created at the first update and reused across episodes
+    (a new episode is detected when the engine output gets shorter or the engine changes). The
+    axes span the whole season, so an update only blits the lines over a saved background and
+    the figure is fully redrawn only when a value leaves the bounds of OBSERVATIONS.
+
+    Args:
+        obs_name (list, optional): variables to plot. Defaults to OBS_NAME.
+        interactive (bool, optional): draw in a pyplot window without blocking, False renders
+            off-screen (rgb_array). Defaults to True.
+        dpi (int, optional): resolution of the figure. Defaults to 60.
+    """
+
+    def __init__(self, obs_name=OBS_NAME, interactive=True, dpi=60):
+        self.obs_name = list(obs_name)
+        self.interactive = interactive
+        self.dpi = dpi
+        self.figure = None
+        self._engine = None
+        self._background = None
+
+    def update(self, engine):
+        """ Plot the days of engine output not plotted yet
+
+        Args:
+            engine (Engine): PCSE engine
+
+        Returns:
+            Figure: updated figure
+        """
+        if self.figure is None:
+            fig = None
+            if self.interactive:
+                plt.ion()
+                fig = plt.figure(figsize=(12, 14), dpi=self.dpi)
+            self.figure = EpisodeFigure(fig, self.obs_name)
+            self.figure.fig.set_dpi(self.dpi)
+
+        figure = self.figure
+        canvas = figure.fig.canvas
+        output = engine.get_output()
+        redraw = False
+        if engine is not self._engine or len(output) < figure.n:
+            # new episode, axes span the whole season so that only the lines change
+            self._engine = engine
+            figure.clear()
+            x0 = mdates.date2num(output[0]["day"])
+            figure.set_limits(x0, x0 + 366)
+            redraw = True
+        days, values = _as_arrays(output[figure.n :], self.obs_name)
+        redraw |= figure.append(days, values, autoscale=False)
+
+        if redraw or self._background is None:
+            canvas.draw()
+            self._background = canvas.copy_from_bbox(figure.fig.bbox)
+        else:
+            # blit: restore the axes and redraw the lines only
+            canvas.restore_region(self._background)
+            for ax, line in zip(figure.axes, figure.lines):
+                ax.draw_artist(line)
+            canvas.blit(figure.fig.bbox)
+        if self.interactive:
+            canvas.flush_events()
+        return figure.fig
+
+    def rgb_array(self):
+        """ Current figure as a (height, width, 3) uint8 array """
+        canvas = self.figure.fig.canvas
+        return np.asarray(canvas.buffer_rgba())[..., :3].copy()
+
+    def close(self):
+        if self.figure is not None and self.interactive:
+            plt.close(self.figure.fig)
+        self.figure = None
+        self._engine = None
+        self._background = None
+
+
+def _export_one(task):
+    global _figure
+    path, episode, fmt, dpi, title, obs_name = task
+    if _figure is None or _figure.obs_name != list(obs_name):
+        _figure = EpisodeFigure(obs_name=obs_name)
+    _figure.set_data(*_as_arrays(episode, obs_name))
+    _figure.save(path, fmt=fmt, dpi=dpi, title=title)
+    return path
+
+
+def export_episodes(
+    episodes,
+    directory,
+    fmt="png",
+    names=None,
+    processes=None,
+    dpi=80,
+    obs_name=OBS_NAME,
+):
+    """ Headless export of recorded episodes to PNG, SVG or HTML files, in parallel
+
+    Every worker process draws all its episodes in one reused Agg figure (no pyplot, no window).
+
+    Args:
+        episodes (list): recorded episodes, engine outputs (list of dicts), pd.DataFrames indexed
+            by day or (days, variables) arrays of physical observations
+        directory (str): output directory, created if needed
+        fmt (str, optional): one of EXPORT_FORMATS. Defaults to "png".
+        names (list, optional): file names (without extension). Defaults to None (episode_00000, ...).
+        processes (int, optional): number of worker processes, 1 runs in this process. Defaults to None (os.cpu_count()).
+        dpi (int, optional): resolution of PNG files. Defaults to 80.
+        obs_name (list, optional): variables to plot. Defaults to OBS_NAME.
+
+    Returns:
+        list: paths of the written files, in the order of episodes
+    """
+
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format {fmt}, use one of {EXPORT_FORMATS}.")
+    os.makedirs(directory, exist_ok=True)
+    names = names or [f"episode_{ix:05d}" for ix in range(len(episodes))]
+    tasks = [
+        (os.path.join(directory, f"{name}.{fmt}"), episode, fmt, dpi, name, obs_name)
+        for name, episode in zip(names, episodes)
+    ]
+
+    processes = processes or os.cpu_count()
+    if processes == 1:
+        return list(map(_export_one, tasks))
+    with mp.Pool(processes) as pool:
+        return pool.map(
+            _export_one, tasks, chunksize=max(1, len(tasks) // (4 * processes))
+        )
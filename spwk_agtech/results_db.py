@@ -0,0 +1,411 @@
+import datetime
+import operator
+import time
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from .const import ACTIONS, OBSERVATIONS
+from .sweep import episode_summary
+
+# Per-episode float columns, check summarize_episode
+SUMMARY_COLUMNS = [
+    "profit",
+    "return",
+    "DVS",
+    "TAGP",
+    "TWSO",
+    "IRRIGATE",
+    "N",
+    "P",
+    "K",
+]
+# Development stages recorded as the first day they are reached
+DVS_DATES = {"anthesis": 1.0, "maturity": 2.0}
+# Episode ids reserved from the database at a time by a ResultsDB
+ID_BLOCK = 2**16
+# 64-bit ids (INTEGER is already 64-bit in SQLite)
+EpisodeId = sa.BigInteger().with_variant(sa.Integer(), "sqlite")
+# Operators of (column, op, value) conditions, values are bound parameters
+WHERE_OPS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda column, value: column.in_(list(value)),
+    "between": lambda column, value: column.between(*value),
+    "like": lambda column, value: column.like(value),
+}
+
+
+def _tables(metadata):
+    episodes = sa.Table(
+        "episodes",
+        metadata,
+        sa.Column("id", EpisodeId, primary_key=True, autoincrement=False),
+        sa.Column("site", sa.String(64), index=True),
+        sa.Column("season", sa.String(32), index=True),
+        sa.Column("policy", sa.String(64), index=True),
+        sa.Column("seed", sa.Integer, index=True),
+        sa.Column("days", sa.Integer),
+        *[sa.Column(k, sa.Float) for k in SUMMARY_COLUMNS],
+        sa.Column("start", sa.Date),
+        sa.Column("end", sa.Date),
+        *[sa.Column(k, sa.Date) for k in DVS_DATES],
+        sa.Column("termination", sa.String(32)),
+        sa.Column("outputs", sa.JSON),
+        sa.Index("ix_episodes_site_season_policy", "site", "season", "policy"),
+    )
+    trajectories = sa.Table(
+        "trajectories",
+        metadata,
+        sa.Column("episode_id", EpisodeId, sa.ForeignKey("episodes.id"), index=True),
+        sa.Column("step", sa.Integer),
+        sa.Column("day", sa.Date),
+        sa.Column("reward", sa.Float),
+        *[sa.Column(k, sa.Float) for k in OBSERVATIONS],
+        *[sa.Column(f"act_{k}", sa.Float) for k in ACTIONS],
+    )
+    id_blocks = sa.Table(
+        "id_blocks",
+        metadata,
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("reserved", sa.Float),
+    )
+    return episodes, trajectories, id_blocks
+
+
+def _jsonable(value):
+    if isinstance(value, (datetime.date, np.datetime64)):
+        return str(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def summarize_episode(env, actions, rewards, info=None):
+    """ Episode row and daily trajectory of the episode env just ran (see pcse_runner)
+
+    The summary is episode_summary plus the first days of anthesis and maturity, the
+    termination cause and the summary and terminal outputs of the engine (CROP_FINISH and
+    TERMINATE signals, only present when the engine got them) as a JSON dict.
+
+    Args:
+        env (PcseEnv): environment at the end of the episode
+        actions (list): normalized actions of the episode
+        rewards (list): rewards of the episode
+        info (dict, optional): info of the last step. Defaults to None.
+
+    Returns:
+        tuple(dict, pd.DataFrame): episode row and one trajectory row per step
+    """
+
+    row = episode_summary(env, actions, rewards)
+    output = pd.DataFrame(env.engine.get_output())
+    for name, dvs in DVS_DATES.items():
+        reached = output.day[output.DVS >= dvs]
+        row[name] = reached.iloc[0] if len(reached) else None
+    row["start"] = output.day.iloc[0]
+    row["end"] = output.day.iloc[-1]
+    row["termination"] = (info or {}).get("termination")
+    outputs = {}
+    for ix, summary in enumerate(env.engine.get_summary_output()):
+        outputs.update({f"{k}_{ix}": _jsonable(v) for k, v in summary.items()})
+    outputs.update(
+        {k: _jsonable(v) for k, v in (env.engine.get_terminal_output() or {}).items()}
+    )
+    row["outputs"] = outputs
+
+    steps = output.iloc[1 : len(rewards) + 1].reset_index(drop=True)
+    trajectory = pd.DataFrame(
+        {
+            "step": np.arange(len(steps)),
+            "day": steps.day,
+            "reward": rewards[: len(steps)],
+        }
+    )
+    for k in OBSERVATIONS:
+        trajectory[k] = steps[k].astype(np.float64)
+    act = env.denorm(np.array(actions, dtype=np.float32), "act")[: len(steps)]
+    for ix, k in enumerate(ACTIONS):
+        trajectory[f"act_{k}"] = act[:, ix].astype(np.float64)
+    return row, trajectory
+
+
+class ResultsDB:
+    """ SQL store of episode summaries and optional daily trajectories (SQLAlchemy Core)
+
+    Rows are buffered and written with one executemany per batch_size episodes, in a single
+    transaction. Episode ids are known as soon as a row is added: each ResultsDB reserves
+    blocks of ID_BLOCK ids from the database (one autoincremented id_blocks row per block), so
+    any number of writers, e.g. one per worker process, can add to the same database. Queries
+    filter on the indexed site, season, policy and seed columns and can be aggregated or
+    streamed in chunks by the database, without loading every run in pandas.
+
+    Example:
+        with ResultsDB("sqlite:///results.db") as db:
+            actions, rewards = pcse_runner(env, policy)
+            db.add_episode(env, actions, rewards, site="35,128", season="1987", policy="mpc")
+        db.aggregate(["policy"], "profit")
+
+    Args:
+        url (str, optional): SQLAlchemy database URL. Defaults to "sqlite:///results.db".
+        batch_size (int, optional): episodes per insert. Defaults to 1000.
+    """
+
+    def __init__(self, url="sqlite:///results.db", batch_size=1000):
+        self.url = url
+        self.batch_size = batch_size
+        self.engine = sa.create_engine(url)
+        if self.engine.dialect.name == "sqlite":
+            sa.event.listen(self.engine, "connect", self._sqlite_pragmas)
+        self.metadata = sa.MetaData()
+        self.episodes, self.trajectories, self.id_blocks = _tables(self.metadata)
+        self.metadata.create_all(self.engine)
+        self._columns = self.episodes.c.keys()
+        self._next_id = self._end_id = None
+        self._episodes = []
+        self._trajectories = []
+
+    @staticmethod
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        with self.engine.connect() as conn:
+            count = conn.execute(sa.select(sa.func.count()).select_from(self.episodes))
+            return count.scalar() + len(self._episodes)
+
+    def add(self, row, trajectory=None, site=None, season=None, policy=None, seed=None):
+        """ Buffer an episode row (see summarize_episode)
+
+        Args:
+            row (dict): episode summary, unknown keys are ignored
+            trajectory (pd.DataFrame, optional): daily rows of the episode. Defaults to None.
+            site (str, optional): site key, e.g. "35,128". Defaults to None.
+            season (str, optional): season key, e.g. "1987". Defaults to None.
+            policy (str, optional): policy name. Defaults to None.
+            seed (int, optional): seed of the episode. Defaults to None.
+
+        Returns:
+            int: episode id
+        """
+
+        record = dict.fromkeys(self._columns)
+        record.update((k, v) for k, v in row.items() if k in record)
+        keys = {"site": site, "season": season, "policy": policy, "seed": seed}
+        for k, v in keys.items():
+            if v is not None:
+                record[k] = v if k == "seed" else str(v)
+        for k in ["start", "end", *DVS_DATES]:
+            if record[k] is not None:
+                record[k] = pd.Timestamp(record[k]).date()
+        record["id"] = episode_id = self._new_id()
+        self._episodes.append(record)
+
+        if trajectory is not None:
+            columns = self.trajectories.c.keys()
+            rows = trajectory[[k for k in columns if k in trajectory]].assign(
+                episode_id=episode_id, day=pd.to_datetime(trajectory.day).dt.date
+            )
+            self._trajectories.extend(rows.to_dict("records"))
+        if len(self._episodes) >= self.batch_size:
+            self.flush()
+        return episode_id
+
+    def add_episode(
+        self,
+        env,
+        actions,
+        rewards,
+        info=None,
+        trajectory=False,
+        **keys,
+    ):
+        """ Buffer the episode env just ran (see pcse_runner)
+
+        Args:
+            env (PcseEnv): environment at the end of the episode
+            actions (list): normalized actions of the episode
+            rewards (list): rewards of the episode
+            info (dict, optional): info of the last step. Defaults to None.
+            trajectory (bool, optional): store the daily trajectory too. Defaults to False.
+            keys: site, season, policy and seed of the episode
+
+        Returns:
+            int: episode id
+        """
+
+        row, daily = summarize_episode(env, actions, rewards, info)
+        return self.add(row, daily if trajectory else None, **keys)
+
+    def _new_id(self):
+        if self._next_id is None or self._next_id == self._end_id:
+            with self.engine.begin() as conn:
+                result = conn.execute(
+                    self.id_blocks.insert(), {"reserved": time.time()}
+                )
+                block = result.inserted_primary_key[0]
+            self._next_id = (block - 1) * ID_BLOCK + 1
+            self._end_id = self._next_id + ID_BLOCK
+        episode_id = self._next_id
+        self._next_id += 1
+        return episode_id
+
+    def flush(self):
+        """ Insert the buffered rows in one transaction """
+        if not self._episodes:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(self.episodes.insert(), self._episodes)
+            if self._trajectories:
+                conn.execute(self.trajectories.insert(), self._trajectories)
+        self._episodes = []
+        self._trajectories = []
+
+    def close(self):
+        self.flush()
+        self.engine.dispose()
+
+    def _where(self, table, filters):
+        clauses = []
+        for k, v in filters.items():
+            if v is None:
+                continue
+            column = table.c[k]
+            if isinstance(v, (list, tuple, set, np.ndarray, pd.Series)):
+                clauses.append(column.in_(list(v)))
+            else:
+                clauses.append(column == v)
+        return clauses
+
+    def _conditions(self, table, where):
+        if where is None:
+            return []
+        if isinstance(where, (str, sa.sql.ClauseElement)) or (
+            isinstance(where, tuple) and where and isinstance(where[0], str)
+        ):
+            where = [where]
+        clauses = []
+        for condition in where:
+            if isinstance(condition, str):
+                clauses.append(sa.text(condition))
+            elif isinstance(condition, tuple):
+                name, op, value = condition
+                if op not in WHERE_OPS:
+                    raise ValueError(
+                        f"Unknown operator {op}, use one of {list(WHERE_OPS)}."
+                    )
+                clauses.append(WHERE_OPS[op](table.c[name], value))
+            else:
+                clauses.append(condition)
+        return clauses
+
+    def _select(self, columns=None, where=None, limit=None, **filters):
+        table = self.episodes
+        selected = [table.c[k] for k in columns] if columns else [table]
+        statement = sa.select(*selected).where(
+            *self._where(table, filters), *self._conditions(table, where)
+        )
+        if limit is not None:
+            statement = statement.limit(limit)
+        return statement.order_by(table.c.id)
+
+    def query(self, columns=None, where=None, limit=None, **filters):
+        """ Episodes matching the filters
+
+        Args:
+            columns (list, optional): columns to read. Defaults to None (all).
+            where (tuple, list or str, optional): extra conditions, a (column, op, value) tuple
+                with op in WHERE_OPS and a bound value, e.g. ("profit", ">", 0), a SQLAlchemy
+                expression (e.g. db.episodes.c.profit > 0) or a list of them. A str is pasted
+                as raw SQL, only pass trusted strings. Defaults to None.
+            limit (int, optional): max number of rows. Defaults to None.
+            filters: site, season, policy, seed (or any column) equal to a value or in a list
+
+        Returns:
+            pd.DataFrame: one row per episode
+        """
+
+        self.flush()
+        with self.engine.connect() as conn:
+            result = conn.execute(self._select(columns, where, limit, **filters))
+            return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+    def iter_query(self, chunksize=100000, columns=None, where=None, **filters):
+        """ query() streamed as DataFrames of chunksize rows """
+        self.flush()
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(
+                self._select(columns, where, **filters)
+            )
+            keys = list(result.keys())
+            for rows in result.partitions(chunksize):
+                yield pd.DataFrame(rows, columns=keys)
+
+    def aggregate(
+        self, by, values="profit", funcs=("count", "avg", "min", "max"), **filters
+    ):
+        """ Statistics of episode columns grouped by key columns, computed by the database
+
+        Args:
+            by (list): columns to group by, e.g. ["site", "policy"]
+            values (str or list, optional): aggregated columns. Defaults to "profit".
+            funcs (tuple, optional): SQL aggregate functions. Defaults to ("count", "avg", "min", "max").
+            filters: site, season, policy, seed (or any column) equal to a value or in a list
+
+        Returns:
+            pd.DataFrame: one row per group with "<value>_<func>" columns
+        """
+
+        self.flush()
+        table = self.episodes
+        values = [values] if isinstance(values, str) else list(values)
+        groups = [table.c[k] for k in by]
+        stats = [
+            getattr(sa.func, f)(table.c[v]).label(f"{v}_{f}")
+            for v in values
+            for f in funcs
+        ]
+        statement = (
+            sa.select(*groups, *stats)
+            .where(*self._where(table, filters))
+            .group_by(*groups)
+            .order_by(*groups)
+        )
+        with self.engine.connect() as conn:
+            result = conn.execute(statement)
+            return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+    def trajectory(self, episode_id):
+        """ Daily rows of an episode stored with its trajectory
+
+        Args:
+            episode_id (int or list): episode id(s)
+
+        Returns:
+            pd.DataFrame: one row per step
+        """
+
+        self.flush()
+        table = self.trajectories
+        statement = (
+            sa.select(table)
+            .where(*self._where(table, {"episode_id": episode_id}))
+            .order_by(table.c.episode_id, table.c.step)
+        )
+        with self.engine.connect() as conn:
+            result = conn.execute(statement)
+            return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
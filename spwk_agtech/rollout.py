@@ -0,0 +1,292 @@
+import multiprocessing as mp
+import queue
+import traceback
+import types
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .pcse_env import PcseEnv
+
+Fragment = namedtuple(
+    "Fragment",
+    [
+        "obs",
+        "actions",
+        "rewards",
+        "dones",
+        "truncated",
+        "last_obs",
+        "worker",
+        "env",
+        "version",
+    ],
+)
+
+
+def _buffer_specs(n_slots, fragment_length, obs_dim, act_dim):
+    """ Name, shape and dtype of the ring buffer arrays """
+    return {
+        "obs": ((n_slots, fragment_length, obs_dim), np.float32),
+        "actions": ((n_slots, fragment_length, act_dim), np.float32),
+        "rewards": ((n_slots, fragment_length), np.float64),
+        "dones": ((n_slots, fragment_length), np.bool_),
+        "truncated": ((n_slots, fragment_length), np.bool_),
+        "last_obs": ((n_slots, obs_dim), np.float32),
+    }
+
+
+def _attach(names, specs):
+    """ Attach numpy views to the shared memory blocks of the ring buffer """
+    blocks = {k: shared_memory.SharedMemory(name=names[k]) for k in specs}
+    arrays = {
+        k: np.ndarray(shape, dtype=dtype, buffer=blocks[k].buf)
+        for k, (shape, dtype) in specs.items()
+    }
+    return blocks, arrays
+
+
+def _get_action(policy, obs, env, test):
+    if isinstance(policy, types.FunctionType):
+        return policy(obs, env)
+    return policy.get_action(obs, test=test)
+
+
+def _rollout_worker(
+    worker_id,
+    names,
+    specs,
+    free_slots,
+    full_slots,
+    weights,
+    stop,
+    policy_fn,
+    env_fn,
+    env_kwargs,
+    envs_per_worker,
+    test,
+):
+    blocks, arrays = _attach(names, specs)
+    try:
+        envs = [env_fn(**env_kwargs) for _ in range(envs_per_worker)]
+        policy = policy_fn()
+        obs = [env.reset() for env in envs]
+        fragment_length = specs["rewards"][0][1]
+        version = 0
+        k = 0
+        while not stop.is_set():
+            # use the latest broadcast weights, if any
+            latest = None
+            while True:
+                try:
+                    latest = weights.get_nowait()
+                except queue.Empty:
+                    break
+            if latest is not None:
+                version, params = latest
+                policy.set_weights(params)
+
+            try:
+                slot = free_slots.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            env = envs[k]
+            for t in range(fragment_length):
+                act = _get_action(policy, obs[k], env, test)
+                next_obs, reward, done, info = env.step(act)
+                arrays["obs"][slot, t] = obs[k]
+                arrays["actions"][slot, t] = act
+                arrays["rewards"][slot, t] = reward
+                arrays["dones"][slot, t] = done
+                arrays["truncated"][slot, t] = info.get("TimeLimit.truncated", False)
+                obs[k] = env.reset() if done else next_obs
+            arrays["last_obs"][slot] = obs[k]
+            full_slots.put((slot, worker_id, k, version))
+            k = (k + 1) % len(envs)
+    except Exception:
+        full_slots.put(("error", worker_id, traceback.format_exc(), None))
+    finally:
+        arrays.clear()
+        for block in blocks.values():
+            block.close()
+
+
+class RolloutPipeline:
+    """ Streaming rollout collection overlapping with learning
+
+    Worker processes step their own environments with a local copy of the policy and write
+    fixed-length trajectory fragments into a ring buffer of shared memory slots. Iterating
+    over the pipeline yields the fragments in completion order and hands the slots back.
+    Workers wait for a free slot when the consumer falls behind (backpressure), and
+    broadcast() sends new policy weights to all workers, which apply them with
+    policy.set_weights() before their next fragment.
+
+    Fragments are contiguous in one environment and may span episode boundaries, check dones.
+    truncated flags the steps where an episode ended at the time limit
+    (info["TimeLimit.truncated"]), whose value should be bootstrapped rather than taken as
+    terminal.
+
+    Example:
+        with RolloutPipeline(make_policy, n_workers=4, fragment_length=64) as pipeline:
+            for ix, fragment in enumerate(pipeline):
+                learner.update(fragment)
+                pipeline.broadcast(learner.get_weights())
+
+    Args:
+        policy_fn (callable): picklable factory of the policy, called once per worker.
+            The policy is a function (obs, env) or has get_action(obs, test) (see pcse_runner).
+        n_workers (int, optional): number of worker processes. Defaults to 2.
+        envs_per_worker (int, optional): environments stepped in turn by each worker. Defaults to 1.
+        fragment_length (int, optional): number of steps per fragment. Defaults to 32.
+        n_slots (int, optional): number of ring buffer slots. Defaults to None (2 * n_workers).
+        env_fn (callable, optional): picklable factory of environments. Defaults to None (PcseEnv).
+        env_kwargs (dict, optional): keyword arguments of env_fn. Defaults to None.
+        test (bool, optional): if True, no stochastic. Defaults to False.
+        mp_context (str, optional): multiprocessing start method. Defaults to None (platform default).
+    """
+
+    def __init__(
+        self,
+        policy_fn,
+        n_workers=2,
+        envs_per_worker=1,
+        fragment_length=32,
+        n_slots=None,
+        env_fn=None,
+        env_kwargs=None,
+        test=False,
+        mp_context=None,
+    ):
+        env_fn = env_fn or PcseEnv
+        env_kwargs = env_kwargs or {}
+        ctx = mp.get_context(mp_context)
+
+        probe = env_fn(**env_kwargs)
+        obs_dim = probe.observation_space.shape[0]
+        act_dim = probe.action_space.shape[0]
+        probe.close()
+
+        n_slots = n_slots or 2 * n_workers
+        self.specs = _buffer_specs(n_slots, fragment_length, obs_dim, act_dim)
+        self.blocks = {
+            k: shared_memory.SharedMemory(
+                create=True, size=int(np.prod(shape)) * np.dtype(dtype).itemsize
+            )
+            for k, (shape, dtype) in self.specs.items()
+        }
+        names = {k: v.name for k, v in self.blocks.items()}
+        self.arrays = {
+            k: np.ndarray(shape, dtype=dtype, buffer=self.blocks[k].buf)
+            for k, (shape, dtype) in self.specs.items()
+        }
+
+        self.free_slots = ctx.Queue()
+        self.full_slots = ctx.Queue()
+        for slot in range(n_slots):
+            self.free_slots.put(slot)
+        self.weights = [ctx.Queue() for _ in range(n_workers)]
+        self.stop = ctx.Event()
+        self.version = 0
+
+        self.workers = [
+            ctx.Process(
+                target=_rollout_worker,
+                args=(
+                    worker_id,
+                    names,
+                    self.specs,
+                    self.free_slots,
+                    self.full_slots,
+                    self.weights[worker_id],
+                    self.stop,
+                    policy_fn,
+                    env_fn,
+                    env_kwargs,
+                    envs_per_worker,
+                    test,
+                ),
+                daemon=True,
+            )
+            for worker_id in range(n_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            yield self.get()
+
+    def get(self, timeout=None):
+        """ Wait for the next fragment
+
+        Args:
+            timeout (float, optional): seconds to wait. Defaults to None (wait until a fragment arrives).
+
+        Returns:
+            Fragment: copies of obs, actions, rewards, dones, truncated and last_obs with their origin
+        """
+        while True:
+            try:
+                slot, worker, env, version = self.full_slots.get(
+                    timeout=timeout if timeout is not None else 1.0
+                )
+                break
+            except queue.Empty:
+                if timeout is not None:
+                    raise
+                if not any(w.is_alive() for w in self.workers):
+                    raise RuntimeError("All rollout workers exited.")
+        if slot == "error":
+            raise RuntimeError(f"Rollout worker {worker} failed:\n{env}")
+
+        fragment = Fragment(
+            obs=self.arrays["obs"][slot].copy(),
+            actions=self.arrays["actions"][slot].copy(),
+            rewards=self.arrays["rewards"][slot].copy(),
+            dones=self.arrays["dones"][slot].copy(),
+            truncated=self.arrays["truncated"][slot].copy(),
+            last_obs=self.arrays["last_obs"][slot].copy(),
+            worker=worker,
+            env=env,
+            version=version,
+        )
+        self.free_slots.put(slot)
+        return fragment
+
+    def broadcast(self, weights):
+        """ Send policy weights to all workers (applied before their next fragment)
+
+        Args:
+            weights (object): picklable weights passed to policy.set_weights()
+
+        Returns:
+            int: version of the weights, reported in the fragments collected with them
+        """
+        self.version += 1
+        for q in self.weights:
+            q.put((self.version, weights))
+        return self.version
+
+    def close(self):
+        """ Stop the workers and release the ring buffer """
+        self.stop.set()
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        for q in [self.free_slots, self.full_slots] + self.weights:
+            q.cancel_join_thread()
+            q.close()
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
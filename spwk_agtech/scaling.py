@@ -0,0 +1,79 @@
+import numpy as np
+
+from .const import ACTIONS, OBSERVATIONS
+
+
+class ScalingSpec:
+    """ Precompiled affine scaling between the normalized range [-1, 1] and physical values
+
+    denorm(x) = x * scale + offset with scale = (max - min) / 2 and offset = (max + min) / 2,
+    norm is the inverse mapping. Vectors are float32 and read-only, so one spec can be shared by
+    single environments, batched environments and wrappers. Inputs of shape (..., n) are
+    broadcast, outputs are always float32.
+
+    Args:
+        spec (dict): {name: {"min": ..., "max": ...}} as OBSERVATIONS and ACTIONS in const.py
+    """
+
+    __slots__ = ("names", "low", "high", "scale", "offset", "inv_scale", "inv_offset")
+
+    def __init__(self, spec):
+        self.names = list(spec.keys())
+        low = np.array([v["min"] for v in spec.values()], dtype=np.float32)
+        high = np.array([v["max"] for v in spec.values()], dtype=np.float32)
+        self._compile(low, high)
+
+    def _compile(self, low, high):
+        self.low = low
+        self.high = high
+        self.scale = (high - low) / np.float32(2)
+        self.offset = (high + low) / np.float32(2)
+        self.inv_scale = np.float32(1) / self.scale
+        self.inv_offset = -self.offset * self.inv_scale
+        for arr in (self.low, self.high, self.scale, self.offset):
+            arr.setflags(write=False)
+        self.inv_scale.setflags(write=False)
+        self.inv_offset.setflags(write=False)
+
+    def __len__(self):
+        return len(self.names)
+
+    def subset(self, indices):
+        """ Scaling spec restricted to some dimensions
+
+        Args:
+            indices (list): indices of the dimensions to keep
+
+        Returns:
+            ScalingSpec: restricted spec
+        """
+        sub = ScalingSpec.__new__(ScalingSpec)
+        sub.names = [self.names[i] for i in indices]
+        sub._compile(self.low[indices].copy(), self.high[indices].copy())
+        return sub
+
+    def denorm(self, value, out=None):
+        """ Normalized value(s) to physical value(s) """
+        out = np.multiply(value, self.scale, out=out, dtype=np.float32)
+        out += self.offset
+        return out
+
+    def denorm_clip(self, value, out=None):
+        """ Normalized value(s) to physical value(s) clipped to [min, max] """
+        out = self.denorm(value, out=out)
+        return np.clip(out, self.low, self.high, out=out)
+
+    def norm(self, value, out=None):
+        """ Physical value(s) to normalized value(s) """
+        out = np.multiply(value, self.inv_scale, out=out, dtype=np.float32)
+        out += self.inv_offset
+        return out
+
+    def norm_clip(self, value, out=None):
+        """ Physical value(s) to normalized value(s) clipped to [-1, 1] """
+        out = self.norm(value, out=out)
+        return np.clip(out, -1, 1, out=out)
+
+
+OBS_SCALING = ScalingSpec(OBSERVATIONS)
+ACTION_SCALING = ScalingSpec(ACTIONS)
@@ -0,0 +1,256 @@
+import datetime
+import logging
+import multiprocessing as mp
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .const import ACTIONS, MANAGEMENT_ACTIONS, OBSERVATIONS
+from .episode_cache import EpisodeCache
+from .pcse_env import PcseEnv, get_profit
+
+ScheduleResult = namedtuple("ScheduleResult", ["schedule", "profit", "trace"])
+
+# Per-process environment and episode cache used by the optimizer workers
+_env = None
+_cache = None
+
+
+class ScheduleSpace:
+    """ Sparse irrigation and N/P/K event schedules encoded as vectors in [0, 1]
+
+    A candidate holds n_irrigation events (day, amount) followed by n_fertilization events
+    (day, N, P, K). Events fall within the first season_days days of the campaign, which should
+    end before maturity so that every event is applied (and paid for). Events on the same day add
+    up, clipped to the limits of const.py.
+
+    Args:
+        n_irrigation (int, optional): number of irrigation events. Defaults to 4.
+        n_fertilization (int, optional): number of fertilization events. Defaults to 3.
+        season_days (int, optional): days of the campaign open to events. Defaults to 150.
+        max_irrigation (float, optional): max cm of water per event. Defaults to 10.
+        max_fertilizer (float, optional): max kg/ha of N, P and K per event. Defaults to 100.
+        horizon (int, optional): days of the decoded schedule. Defaults to 366.
+    """
+
+    def __init__(
+        self,
+        n_irrigation=4,
+        n_fertilization=3,
+        season_days=150,
+        max_irrigation=10,
+        max_fertilizer=100,
+        horizon=366,
+    ):
+        self.n_irrigation = n_irrigation
+        self.n_fertilization = n_fertilization
+        self.season_days = season_days
+        self.max_irrigation = max_irrigation
+        self.max_fertilizer = max_fertilizer
+        self.horizon = horizon
+        self.dim = 2 * n_irrigation + 4 * n_fertilization
+        self.limits = np.array(
+            [ACTIONS[k]["max"] for k in MANAGEMENT_ACTIONS], dtype=np.float32
+        )
+
+    def decode(self, params):
+        """ Daily management of candidates
+
+        Args:
+            params (np.ndarray): candidates of shape (dim,) or (n, dim) in [0, 1]
+
+        Returns:
+            np.ndarray: IRRIGATE, N, P, K of shape (horizon, 4) or (n, horizon, 4)
+        """
+        params = np.clip(np.asarray(params, dtype=np.float64), 0, 1)
+        single = params.ndim == 1
+        params = np.atleast_2d(params)
+        n = len(params)
+        schedule = np.zeros((n, self.horizon, 4), dtype=np.float32)
+        rows = np.arange(n)
+
+        irrigation = params[:, : 2 * self.n_irrigation].reshape(n, -1, 2)
+        days = self._days(irrigation[..., 0])
+        for ix in range(self.n_irrigation):
+            np.add.at(
+                schedule,
+                (rows, days[:, ix], 0),
+                irrigation[:, ix, 1] * self.max_irrigation,
+            )
+
+        fertilization = params[:, 2 * self.n_irrigation :].reshape(n, -1, 4)
+        days = self._days(fertilization[..., 0])
+        for ix in range(self.n_fertilization):
+            for jx in range(1, 4):
+                np.add.at(
+                    schedule,
+                    (rows, days[:, ix], jx),
+                    fertilization[:, ix, jx] * self.max_fertilizer,
+                )
+
+        np.minimum(schedule, self.limits, out=schedule)
+        return schedule[0] if single else schedule
+
+    def _days(self, fraction):
+        return np.minimum(
+            (fraction * self.season_days).astype(int), self.season_days - 1
+        )
+
+
+def schedule_costs(schedules):
+    """ Cost of management schedules with the vectorized get_profit
+
+    Args:
+        schedules (np.ndarray): IRRIGATE, N, P, K of shape (..., days, 4)
+
+    Returns:
+        np.ndarray: total cost of shape (...)
+    """
+
+    schedules = np.asarray(schedules)
+    actions = np.zeros(schedules.shape[:-1] + (len(ACTIONS),), dtype=np.float64)
+    actions[..., 9:] = schedules
+    states = np.zeros(schedules.shape[:-1] + (len(OBSERVATIONS),))
+    return -get_profit(states, actions, np.zeros(schedules.shape[:-1], bool)).sum(-1)
+
+
+def schedule_policy(schedule):
+    """ Policy (see pcse_runner) following a schedule in an env with controlled_actions="management"
+
+    Args:
+        schedule (np.ndarray): IRRIGATE, N, P, K of shape (days, 4)
+
+    Returns:
+        function: policy(obs, env)
+    """
+
+    def policy(obs, env):
+        start = datetime.datetime.strptime(env.campaign_start_date, "%Y-%m-%d").date()
+        day = (env.current_date - start).days
+        return env.action_scaling.norm(schedule[min(day, len(schedule) - 1)])
+
+    return policy
+
+
+def _init_worker(env_kwargs):
+    global _env, _cache
+    _env = PcseEnv(controlled_actions="management", **env_kwargs)
+    _cache = EpisodeCache(maxsize=256, max_snapshots=32)
+
+
+def _evaluate(task):
+    ix, schedule = task
+    result = _cache.evaluate(_env, _env.action_scaling.norm(schedule))
+    return ix, result.profit
+
+
+def optimize_schedule(
+    space=None,
+    population=32,
+    elite_frac=0.25,
+    iterations=20,
+    processes=None,
+    seed=None,
+    max_yield=None,
+    env_kwargs=None,
+):
+    """ Cross-entropy search of the most profitable irrigation and N/P/K schedule
+
+    Every iteration samples a population of sparse schedules (see ScheduleSpace), evaluates
+    them in parallel through PcseEnv and refits the sampling distribution on the elites.
+    Costs are known before simulation (vectorized get_profit), so candidates that cannot beat
+    the best profit even with max_yield are dropped without running the engine. Workers keep
+    an EpisodeCache, so schedules sharing a prefix without events resume from a snapshot.
+
+    Args:
+        space (ScheduleSpace, optional): schedule encoding. Defaults to None (ScheduleSpace()).
+        population (int, optional): candidates per iteration. Defaults to 32.
+        elite_frac (float, optional): fraction of the population refitting the distribution. Defaults to 0.25.
+        iterations (int, optional): number of iterations. Defaults to 20.
+        processes (int, optional): number of worker processes, 1 runs in this process. Defaults to None (os.cpu_count()).
+        seed (int, optional): random seed. Defaults to None.
+        max_yield (float, optional): upper bound of TWSO in kg/ha for pruning. Defaults to None (max of const.py).
+        env_kwargs (dict, optional): keyword arguments of PcseEnv. Defaults to None.
+
+    Returns:
+        ScheduleResult: best schedule (days, 4), its profit and the convergence trace (pd.DataFrame)
+    """
+
+    space = space or ScheduleSpace()
+    env_kwargs = env_kwargs or {}
+    processes = processes or os.cpu_count()
+    max_yield = max_yield if max_yield is not None else OBSERVATIONS["TWSO"]["max"]
+    max_income = get_profit(
+        np.array([0, 0, 0, max_yield]), np.zeros(len(ACTIONS)), True
+    )
+    n_elites = max(1, int(round(population * elite_frac)))
+    rng = np.random.default_rng(seed)
+
+    mean = np.full(space.dim, 0.5)
+    std = np.full(space.dim, 0.3)
+    best_profit, best_params = -np.inf, None
+    trace = []
+
+    pool = None
+    if processes == 1:
+        _init_worker(env_kwargs)
+        imap = map
+    else:
+        pool = mp.Pool(processes, initializer=_init_worker, initargs=(env_kwargs,))
+        imap = pool.imap_unordered
+
+    start = time.perf_counter()
+    try:
+        for iteration in range(iterations):
+            params = np.clip(rng.normal(mean, std, (population, space.dim)), 0, 1)
+            if iteration == 0:
+                params[0] = 0  # no management
+            schedules = space.decode(params)
+            bounds = max_income - schedule_costs(schedules)
+
+            # hopeless candidates are not simulated and cannot be elites
+            profits = np.full(population, -np.inf)
+            tasks = [
+                (ix, schedules[ix])
+                for ix in np.argsort(-bounds)
+                if bounds[ix] > best_profit
+            ]
+            for ix, profit in imap(_evaluate, tasks):
+                profits[ix] = profit
+
+            elites = np.argsort(-profits)[: min(n_elites, len(tasks))]
+            if len(elites):
+                if profits[elites[0]] > best_profit:
+                    best_profit, best_params = profits[elites[0]], params[elites[0]]
+                mean = 0.7 * params[elites].mean(0) + 0.3 * mean
+                std = 0.7 * params[elites].std(0) + 0.3 * std + 1e-3
+
+            trace.append(
+                {
+                    "iteration": iteration,
+                    "best": best_profit,
+                    "elite_mean": (
+                        float(profits[elites].mean()) if len(elites) else np.nan
+                    ),
+                    "evaluated": len(tasks),
+                    "pruned": population - len(tasks),
+                    "elapsed": time.perf_counter() - start,
+                }
+            )
+            logging.info(
+                f"iteration {iteration}: best {best_profit:.2f} USD/ha, "
+                f"{len(tasks)} evaluated, {population - len(tasks)} pruned"
+            )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return ScheduleResult(
+        schedule=space.decode(best_params),
+        profit=float(best_profit),
+        trace=pd.DataFrame(trace),
+    )
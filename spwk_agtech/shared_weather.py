@@ -0,0 +1,311 @@
+import datetime as dt
+import os
+import sys
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from pcse.base import WeatherDataContainer, WeatherDataProvider
+from pcse.exceptions import WeatherDataProviderError
+
+from .utils import NASAPowerWeatherDataFetcher
+
+# Columns of the shared weather array, DAY is stored as a proleptic Gregorian ordinal
+WEATHER_FIELDS = [
+    "DAY",
+    "IRRAD",
+    "TMIN",
+    "TMAX",
+    "VAP",
+    "RAIN",
+    "E0",
+    "ES0",
+    "ET0",
+    "WIND",
+    "TEMP",
+]
+
+SharedWeatherHandle = namedtuple(
+    "SharedWeatherHandle",
+    [
+        "name",
+        "shape",
+        "first_ordinal",
+        "latitude",
+        "longitude",
+        "elevation",
+        "angstA",
+        "angstB",
+        "ETmodel",
+        "description",
+    ],
+)
+
+# Blocks attached in this process, {name: (SharedMemory, read-only array)}
+_attached = {}
+
+
+def _attach_block(handle):
+    """ Array of a shared block, attached once per process
+
+    The attachment is not tracked (before Python 3.13 every attach registers the block with the
+    resource tracker, which unlinks what it tracks when it exits): the SharedWeatherStore that
+    created the block owns it and unlinks it.
+    """
+
+    block = _attached.get(handle.name)
+    if block is None:
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=handle.name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=handle.name)
+            if os.name == "posix":
+                resource_tracker.unregister(shm._name, "shared_memory")
+        data = np.ndarray(handle.shape, dtype=np.float64, buffer=shm.buf)
+        data.setflags(write=False)
+        block = _attached[handle.name] = (shm, data)
+    return block
+
+
+def _pack_weather(weather):
+    """ Pack the records of a WeatherDataProvider into a (days, WEATHER_FIELDS) array
+
+    Missing days are rows of NaN.
+    """
+
+    if isinstance(weather, ArrayWeatherDataProvider):
+        return np.array(weather.data)
+    days = sorted(day for day, _ in weather.store.keys())
+    first, last = days[0].toordinal(), days[-1].toordinal()
+    data = np.full((last - first + 1, len(WEATHER_FIELDS)), np.nan, dtype=np.float64)
+    data[:, 0] = np.arange(first, last + 1)
+    for day in days:
+        wdc = weather(day)
+        row = data[day.toordinal() - first]
+        for ix, varname in enumerate(WEATHER_FIELDS[1:], start=1):
+            row[ix] = getattr(wdc, varname, np.nan)
+    return data
+
+
+class SharedWeatherStore:
+    """ Owner of shared memory blocks holding the weather of sites (parent process)
+
+    Load the weather of each site once in the parent process and pass the handles to the
+    worker processes, which attach read-only SharedWeatherDataProviders to them.
+
+    Example:
+        with SharedWeatherStore() as store:
+            handle = store.add_site(35, 128)
+            # in the workers
+            env = PcseEnv(weather=SharedWeatherDataProvider(handle))
+    """
+
+    def __init__(self):
+        self.blocks = {}
+        self.handles = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_site(self, latitude, longitude, **fetch_kwargs):
+        """ Fetch the weather of a site (see NASAPowerWeatherDataFetcher) and share it
+
+        Args:
+            latitude (int or float): latitude of the site
+            longitude (int or float): longitude of the site
+            fetch_kwargs: keyword arguments of NASAPowerWeatherDataFetcher
+
+        Returns:
+            SharedWeatherHandle: picklable handle to attach providers in other processes
+        """
+        key = (latitude, longitude)
+        if key not in self.handles:
+            weather = NASAPowerWeatherDataFetcher(latitude, longitude, **fetch_kwargs)
+            self.handles[key] = self.add(weather, key=key)
+        return self.handles[key]
+
+    def add(self, weather, key=None):
+        """ Share the content of a WeatherDataProvider
+
+        Args:
+            weather (WeatherDataProvider): weather to share
+            key (hashable, optional): key of the site in self.handles. Defaults to None.
+
+        Returns:
+            SharedWeatherHandle: picklable handle to attach providers in other processes
+        """
+        data = _pack_weather(weather)
+        shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+        np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[:] = data
+
+        handle = SharedWeatherHandle(
+            name=shm.name,
+            shape=data.shape,
+            first_ordinal=int(data[0, 0]),
+            latitude=weather.latitude,
+            longitude=weather.longitude,
+            elevation=weather.elevation,
+            angstA=weather.angstA,
+            angstB=weather.angstB,
+            ETmodel=weather.ETmodel,
+            description=weather.description,
+        )
+        self.blocks[shm.name] = shm
+        if key is not None:
+            self.handles[key] = handle
+        return handle
+
+    def close(self):
+        """ Release and unlink all shared memory blocks """
+        for shm in self.blocks.values():
+            shm.close()
+            if os.name == "posix" and sys.version_info < (3, 13):
+                # attachments in processes sharing the resource tracker of this one unregister
+                # the block, unlink unregisters it again
+                resource_tracker.register(shm._name, "shared_memory")
+            shm.unlink()
+        self.blocks.clear()
+        self.handles.clear()
+
+
+class ArrayWeatherDataProvider(WeatherDataProvider):
+    """ Read-only WeatherDataProvider over a (days, WEATHER_FIELDS) array of consecutive days
+
+    WeatherDataContainers are built lazily from the array and kept in a private store, so
+    changes made to them (e.g. by send_actions2engine) do not touch the array. Copies
+    (copy.deepcopy, as done by PcseEnv at every reset) share the array with an empty store.
+
+    Args:
+        data (np.ndarray): weather array, one row per day from the first day, NaN rows are missing
+        latitude (float): latitude
+        longitude (float): longitude
+        elevation (float): elevation in m
+        angstA (float, optional): Angstrom A. Defaults to 0.29.
+        angstB (float, optional): Angstrom B. Defaults to 0.49.
+        ETmodel (str, optional): "PM"|"P" model of the reference ET columns. Defaults to "PM".
+        description (list, optional): description lines. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        data,
+        latitude,
+        longitude,
+        elevation,
+        angstA=0.29,
+        angstB=0.49,
+        ETmodel="PM",
+        description=None,
+    ):
+        WeatherDataProvider.__init__(self)
+        self.data = data
+        self.data.setflags(write=False)
+        self.first_ordinal = int(data[0, 0])
+        self.latitude = latitude
+        self.longitude = longitude
+        self.elevation = elevation
+        self.angstA = angstA
+        self.angstB = angstB
+        self.ETmodel = ETmodel
+        self.description = description or []
+
+    def __deepcopy__(self, memo):
+        return ArrayWeatherDataProvider(
+            self.data,
+            self.latitude,
+            self.longitude,
+            self.elevation,
+            self.angstA,
+            self.angstB,
+            self.ETmodel,
+            self.description,
+        )
+
+    @property
+    def first_date(self):
+        return dt.date.fromordinal(self.first_ordinal)
+
+    @property
+    def last_date(self):
+        return dt.date.fromordinal(self.first_ordinal + self.data.shape[0] - 1)
+
+    @property
+    def missing(self):
+        return int(np.isnan(self.data[:, 1]).sum())
+
+    def export(self):
+        weather_data = []
+        for ix in np.flatnonzero(~np.isnan(self.data[:, 1])):
+            wdc = self(dt.date.fromordinal(self.first_ordinal + int(ix)))
+            weather_data.append(
+                {k: getattr(wdc, k) for k in wdc.__slots__ if hasattr(wdc, k)}
+            )
+        return weather_data
+
+    def __call__(self, day, member_id=0):
+        if member_id != 0:
+            msg = "Retrieving ensemble weather is not supported by %s"
+            raise WeatherDataProviderError(msg % self.__class__.__name__)
+
+        keydate = self.check_keydate(day)
+        wdc = self.store.get((keydate, 0))
+        if wdc is not None:
+            return wdc
+
+        ix = keydate.toordinal() - self.first_ordinal
+        if not 0 <= ix < self.data.shape[0] or np.isnan(self.data[ix, 1]):
+            raise WeatherDataProviderError("No weather data for %s." % keydate)
+
+        row = self.data[ix]
+        rec = {"DAY": keydate, "LAT": self.latitude, "LON": self.longitude}
+        rec["ELEV"] = self.elevation
+        for jx, varname in enumerate(WEATHER_FIELDS[1:], start=1):
+            if not np.isnan(row[jx]):
+                rec[varname] = row[jx]
+        wdc = WeatherDataContainer(**rec)
+        self.store[(keydate, 0)] = wdc
+        return wdc
+
+
+class SharedWeatherDataProvider(ArrayWeatherDataProvider):
+    """ Read-only WeatherDataProvider attached to a block of a SharedWeatherStore
+
+    WeatherDataContainers are built lazily from the shared array and kept in a private store,
+    so changes made to them (e.g. by send_actions2engine) stay in this process. A process
+    attaches to a block once, every provider of the block (copies made by copy.deepcopy at
+    every reset of PcseEnv, unpickled providers) reads the same mapping with an empty private
+    store, and pickling only transfers the handle.
+
+    Args:
+        handle (SharedWeatherHandle): handle returned by SharedWeatherStore
+    """
+
+    def __init__(self, handle):
+        WeatherDataProvider.__init__(self)
+        self._attach(handle)
+
+    def _attach(self, handle):
+        self.handle = handle
+        self._shm, self.data = _attach_block(handle)
+        self.first_ordinal = handle.first_ordinal
+
+        self.latitude = handle.latitude
+        self.longitude = handle.longitude
+        self.elevation = handle.elevation
+        self.angstA = handle.angstA
+        self.angstB = handle.angstB
+        self.ETmodel = handle.ETmodel
+        self.description = handle.description
+
+    def __getstate__(self):
+        return {"handle": self.handle}
+
+    def __setstate__(self, state):
+        WeatherDataProvider.__init__(self)
+        self._attach(state["handle"])
+
+    def __deepcopy__(self, memo):
+        return SharedWeatherDataProvider(self.handle)
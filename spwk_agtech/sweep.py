@@ -0,0 +1,207 @@
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from .const import ACTIONS
+from .pcse_env import PcseEnv, load_parameters
+from .utils import pcse_runner
+
+# Per-process environment used by the sweep workers
+_env = None
+
+
+def parameter_grid(grid):
+    """ Full factorial design over the given parameter values
+
+    Args:
+        grid (dict): {parameter name: list of values}, e.g. {"WAV": [10, 30, 50], "NSOILBASE": [5, 10]}
+
+    Returns:
+        list: list of {parameter name: value} dicts
+    """
+
+    names = list(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def latin_hypercube(bounds, n, seed=None):
+    """ Latin hypercube design within the given parameter bounds
+
+    Args:
+        bounds (dict): {parameter name: (low, high)}
+        n (int): number of samples
+        seed (int, optional): random seed. Defaults to None.
+
+    Returns:
+        list: list of {parameter name: value} dicts
+    """
+
+    rng = np.random.default_rng(seed)
+    names = list(bounds.keys())
+    low = np.array([bounds[k][0] for k in names], dtype=np.float64)
+    high = np.array([bounds[k][1] for k in names], dtype=np.float64)
+
+    # one stratum per sample and dimension, strata shuffled independently per dimension
+    strata = np.argsort(rng.random((n, len(names))), axis=0)
+    unit = (strata + rng.random((n, len(names)))) / n
+    samples = low + unit * (high - low)
+    return [dict(zip(names, row.tolist())) for row in samples]
+
+
+def no_management_policy(obs, env):
+    """ Reference weather (NaN weather actions) without irrigation and fertilization """
+
+    act = np.full(len(ACTIONS), np.nan, dtype=np.float32)
+    act[9:] = -1
+    return act
+
+
+def _init_worker(env_kwargs):
+    global _env
+    _env = PcseEnv(parameterprovider=load_parameters(), **env_kwargs)
+
+
+def _run_design(task):
+    ix, design, policy = task
+    params = _env.parameterprovider
+    params.clear_override()
+    for name, value in design.items():
+        params.set_override(name, value)
+
+    try:
+        actions, rewards = pcse_runner(_env, policy)
+    finally:
+        params.clear_override()
+
+    row = {"run": ix}
+    row.update(design)
+    row.update(episode_summary(_env, actions, rewards))
+    return row
+
+
+def episode_summary(env, actions, rewards):
+    """ Profit, yield and inputs of the episode env just ran (see pcse_runner)
+
+    Args:
+        env (PcseEnv): environment at the end of the episode
+        actions (list): normalized actions of the episode
+        rewards (list): rewards of the episode
+
+    Returns:
+        dict: profit, return, days, DVS, TAGP, TWSO and total IRRIGATE, N, P, K
+    """
+
+    act = env.denorm(np.array(actions, dtype=np.float32), "act")
+    last = env.engine.get_output()[-1]
+    return {
+        "profit": env.profit,
+        "return": float(np.sum(rewards)),
+        "days": len(rewards),
+        "DVS": last["DVS"],
+        "TAGP": last["TAGP"],
+        "TWSO": last["TWSO"],
+        "IRRIGATE": float(np.nansum(act[:, 9])),
+        "N": float(np.nansum(act[:, 10])),
+        "P": float(np.nansum(act[:, 11])),
+        "K": float(np.nansum(act[:, 12])),
+    }
+
+
+class ColumnarWriter:
+    """ Collect sweep rows into columns, flushing chunks to a CSV file while the sweep runs
+
+    Args:
+        path (str, optional): CSV file to stream into. Defaults to None (keep in memory only).
+        chunk_rows (int, optional): number of rows per flushed chunk. Defaults to 256.
+    """
+
+    def __init__(self, path=None, chunk_rows=256):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.columns = {}
+        self._flushed = 0
+        self._header = True
+
+    def __len__(self):
+        return len(self.columns.get("run", []))
+
+    def append(self, row):
+        if not self.columns:
+            self.columns = {k: [] for k in row}
+        for k, v in row.items():
+            self.columns[k].append(v)
+        if self.path is not None and len(self) - self._flushed >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if self.path is None or len(self) == self._flushed:
+            return
+        chunk = pd.DataFrame({k: v[self._flushed :] for k, v in self.columns.items()})
+        chunk.to_csv(
+            self.path,
+            mode="w" if self._header else "a",
+            header=self._header,
+            index=False,
+        )
+        self._header = False
+        self._flushed = len(self)
+
+    def to_frame(self):
+        if not self.columns:
+            return pd.DataFrame()
+        return pd.DataFrame(self.columns).sort_values("run").reset_index(drop=True)
+
+
+def run_sweep(
+    designs,
+    policy=no_management_policy,
+    processes=None,
+    output=None,
+    chunksize=4,
+    env_kwargs=None,
+):
+    """ Run one episode per design, fanned out across processes
+
+    Every worker parses the CABO files once and applies each design as overrides on its
+    ParameterProvider, so no file is written or re-read per run.
+
+    Args:
+        designs (list): list of {parameter name: value} dicts (see parameter_grid, latin_hypercube)
+        policy (function or class, optional): picklable policy, see pcse_runner. Defaults to no_management_policy.
+        processes (int, optional): number of worker processes, 1 runs in this process. Defaults to None (os.cpu_count()).
+        output (str, optional): CSV file the results are streamed to. Defaults to None.
+        chunksize (int, optional): designs sent to a worker at once. Defaults to 4.
+        env_kwargs (dict, optional): keyword arguments of PcseEnv. Defaults to None.
+
+    Returns:
+        pd.DataFrame: one row per design with the design values, profit, yield and inputs
+    """
+
+    env_kwargs = env_kwargs or {}
+    processes = processes or os.cpu_count()
+    tasks = [(ix, design, policy) for ix, design in enumerate(designs)]
+    writer = ColumnarWriter(output)
+
+    start = time.perf_counter()
+    if processes == 1:
+        _init_worker(env_kwargs)
+        for row in map(_run_design, tasks):
+            writer.append(row)
+    else:
+        with mp.Pool(
+            processes, initializer=_init_worker, initargs=(env_kwargs,)
+        ) as pool:
+            for row in pool.imap_unordered(_run_design, tasks, chunksize=chunksize):
+                writer.append(row)
+    writer.flush()
+
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"{len(tasks)} runs in {elapsed:.1f} s ({len(tasks) / elapsed:.2f} runs/s)"
+    )
+    return writer.to_frame()
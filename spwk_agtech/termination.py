@@ -0,0 +1,112 @@
+from collections import deque
+
+import numpy as np
+
+from .const import OBSERVATIONS
+from .pcse_env import get_profit
+
+OBS_INDEX = {k: ix for ix, k in enumerate(OBSERVATIONS)}
+
+
+class TerminationPredicate:
+    """ Early-termination condition of PcseEnv(termination=[...])
+
+    Called after every step with the physical (denormalized) observation and the env, returns
+    True to end the episode. The episode is then settled as a terminal one (the current yield
+    is sold, check get_profit). Subclasses keep their state between steps and clear it in reset.
+    """
+
+    name = "predicate"
+
+    def reset(self):
+        pass
+
+    def __call__(self, obs, env):
+        raise NotImplementedError
+
+    def __repr__(self):
+        params = ", ".join(
+            f"{k}={v!r}" for k, v in sorted(vars(self).items()) if not k.startswith("_")
+        )
+        return f"{type(self).__name__}({params})"
+
+
+class CropDeath(TerminationPredicate):
+    """ The crop died: LAI stayed below min_lai and TAGP did not grow for patience days
+
+    Args:
+        min_lai (float, optional): LAI of a dead canopy. Defaults to 0.01.
+        patience (int, optional): consecutive days before termination. Defaults to 10.
+        min_dvs (float, optional): not checked before this development stage. Defaults to 0.1.
+    """
+
+    name = "crop_death"
+
+    def __init__(self, min_lai=0.01, patience=10, min_dvs=0.1):
+        self.min_lai = min_lai
+        self.patience = patience
+        self.min_dvs = min_dvs
+        self.reset()
+
+    def reset(self):
+        self._days = 0
+        self._tagp = -np.inf
+
+    def __call__(self, obs, env):
+        tagp = obs[OBS_INDEX["TAGP"]]
+        dead = (
+            obs[OBS_INDEX["DVS"]] >= self.min_dvs
+            and obs[OBS_INDEX["LAI"]] < self.min_lai
+            and tagp <= self._tagp
+        )
+        self._tagp = max(self._tagp, tagp)
+        self._days = self._days + 1 if dead else 0
+        return self._days >= self.patience
+
+
+class ProfitCeiling(TerminationPredicate):
+    """ The profit can no longer reach threshold, even if the yield grows to max_yield
+
+    Args:
+        threshold (float, optional): profit in USD/ha worth simulating for. Defaults to 0.
+        max_yield (float, optional): upper bound of TWSO in kg/ha. Defaults to None (max of const.py).
+    """
+
+    name = "profit_ceiling"
+
+    def __init__(self, threshold=0, max_yield=None):
+        self.threshold = threshold
+        self.max_yield = (
+            max_yield if max_yield is not None else OBSERVATIONS["TWSO"]["max"]
+        )
+        self._max_income = get_profit(
+            np.array([0, 0, 0, self.max_yield]), np.zeros(13), True
+        )
+
+    def __call__(self, obs, env):
+        return env.profit + self._max_income < self.threshold
+
+
+class StalledDVS(TerminationPredicate):
+    """ The development stage increased less than min_increase in the last days days
+
+    Args:
+        days (int, optional): window in days. Defaults to 30.
+        min_increase (float, optional): DVS increase expected within the window. Defaults to 1e-3.
+    """
+
+    name = "stalled_dvs"
+
+    def __init__(self, days=30, min_increase=1e-3):
+        self.days = days
+        self.min_increase = min_increase
+        self.reset()
+
+    def reset(self):
+        self._history = deque(maxlen=self.days + 1)
+
+    def __call__(self, obs, env):
+        self._history.append(obs[OBS_INDEX["DVS"]])
+        if len(self._history) <= self.days:
+            return False
+        return self._history[-1] - self._history[0] < self.min_increase
@@ -7,7 +7,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
-from .const import OBSERVATIONS
+from .const import OBSERVATIONS, WEATHER_ACTIONS
 from .nasapower import NASAPowerWeatherDataProvider
 
 OUTPUT_VARNAME = {k: v["mean"] for k, v in OBSERVATIONS.items()}
@@ -28,6 +28,8 @@ COL = [
     "K",
 ]
 
+WEATHER_INDEX = {k: ix for ix, k in enumerate(WEATHER_ACTIONS)}
+
 # Tick Setting
 locator = mdates.AutoDateLocator()
 formatter = mdates.ConciseDateFormatter(locator)
@@ -105,45 +107,49 @@ def NASAPowerWeatherDataFetcher(
             filled_weather = full_range_weather.fillna(method=fill, axis=0)
         else:
             filled_weather = full_range_weather.interpolate(method="linear", axis=0)
-        weather._make_WeatherDataContainers(filled_weather.to_dict(orient="records"))
+        weather._make_WeatherDataContainers(filled_weather)
 
     return weather
 
 
-def send_actions2engine(actions, engine):
+def _campaign_dispatchers(agromanager, date):
+    """ Timed event dispatchers of the campaign running on date (multi-campaign agromanagement)
+
+    The agromanager drops the previous campaign on the first day of the next one, so on the
+    day before date the running campaign is the first one, unless date starts the next one.
+    """
+
+    if date in agromanager.campaign_start_dates[1:]:
+        return agromanager.timed_event_dispatchers[1]
+    return agromanager.timed_event_dispatchers[0]
+
+
+def send_actions2engine(actions, engine, weather_vars=WEATHER_ACTIONS):
     """ Send actions to PCSE engine
 
     Args:
         actions (np.ndarray): Actions to be sent
         engine ([type]): Engine to receive action
+        weather_vars (list, optional): weather variables to override, others keep the reference
+            weather. The weather data container is not touched if it is empty. Defaults to WEATHER_ACTIONS.
 
     Returns:
         tuple(dict, dict, dict): weather actions, irrigation action, apply npk action.
     """
-    weather_act_list = [
-        "IRRAD",
-        "TMIN",
-        "TMAX",
-        "VAP",
-        "RAIN",
-        "E0",
-        "ES0",
-        "ET0",
-        "WIND",
-    ]
-    assert len(actions[:9]) == len(weather_act_list)
+    assert len(actions[:9]) == len(WEATHER_ACTIONS)
 
     date = engine.day + datetime.timedelta(days=1)
-    date_wdc = engine.weatherdataprovider(date)
-    irrigate = engine.agromanager.timed_event_dispatchers[0][0]
-    apply_npk = engine.agromanager.timed_event_dispatchers[0][1]
+    irrigate, apply_npk = _campaign_dispatchers(engine.agromanager, date)[:2]
 
     weather_act = dict()
-    for ix, varname in enumerate(weather_act_list):
-        if np.isnan(actions[ix]):
-            continue
-        date_wdc.__setattr__(varname, actions[ix])
-        weather_act[varname] = actions[ix]
+    if weather_vars:
+        date_wdc = engine.weatherdataprovider(date)
+        for varname in weather_vars:
+            value = actions[WEATHER_INDEX[varname]]
+            if np.isnan(value):
+                continue
+            date_wdc.__setattr__(varname, value)
+            weather_act[varname] = value
 
     if np.isfinite(actions[9]):
         irrigate_act = {"amount": actions[9], "efficiency": 0.7}
@@ -210,6 +216,47 @@ def pcse_runner(env, policy, test=True):
     return actions, rewards
 
 
+def pcse_batch_runner(envs, policy, test=True):
+    """ Run environments in lockstep with one (batched) policy call per step
+
+    Observations of the running environments are gathered into one (n_running, 11) array and
+    the policy is called once per step. Finished environments leave the batch while the others
+    keep running.
+
+    Args:
+        envs (list): list of PcseEnv
+        policy (function or class): batched fixed_policy (function) called as policy(obs, envs) with the
+            list of running envs, or trained (class) / optimized model (class) called as get_action(obs, test=test).
+            It returns actions of shape (n_running, n_actions).
+        test (bool, optional): if True, no stochastic. Defaults to True.
+
+    Returns:
+        tuple(list, list): per environment, list of actions and list of rewards
+    """
+
+    actions = [[] for _ in envs]
+    rewards = [[] for _ in envs]
+    obs = np.stack([env.reset() for env in envs])
+    running = list(range(len(envs)))
+    while running:
+        if isinstance(policy, types.FunctionType):
+            acts = policy(obs[running], [envs[ix] for ix in running])
+        else:
+            acts = policy.get_action(obs[running], test=test)
+        acts = np.asarray(acts)
+
+        still_running = []
+        for act, ix in zip(acts, running):
+            next_obs, reward, done, info = envs[ix].step(act)
+            actions[ix].append(act)
+            rewards[ix].append(reward)
+            obs[ix] = next_obs
+            if not done:
+                still_running.append(ix)
+        running = still_running
+    return actions, rewards
+
+
 def plot_pcse_env_obs(env, policies: list, policy_name: list, test: list):
     """
     Visualize observations from running environment using policies
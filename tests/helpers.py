@@ -0,0 +1,30 @@
+import numpy as np
+from gym.spaces import Box
+
+
+class CountdownEnv:
+    """ Tiny stand-in environment that ends after `length` steps
+
+    With time_limit=True the end is flagged as a truncation (info["TimeLimit.truncated"]).
+    """
+
+    observation_space = Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    action_space = Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+
+    def __init__(self, length=3, time_limit=False):
+        self.length = length
+        self.time_limit = time_limit
+        self.t = 0
+
+    def reset(self):
+        self.t = 0
+        return np.zeros(1, dtype=np.float32)
+
+    def step(self, action):
+        self.t += 1
+        done = self.t >= self.length
+        info = {"TimeLimit.truncated": done and self.time_limit}
+        return np.full(1, self.t, dtype=np.float32), float(action[0]), done, info
+
+    def close(self):
+        pass
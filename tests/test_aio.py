@@ -0,0 +1,40 @@
+import asyncio
+
+import numpy as np
+
+from spwk_agtech.aio import AsyncEnvPool, run_episode
+from tests.helpers import CountdownEnv
+
+
+def policy(obs, env):
+    return np.ones(1, dtype=np.float32)
+
+
+def test_run_episodes_concurrently():
+    async def main():
+        async with AsyncEnvPool(processes=2, max_inflight=4, env_fn=CountdownEnv) as pool:
+            envs = [await pool.make_env(length=n) for n in range(1, 9)]
+            results = await asyncio.gather(*[run_episode(env, policy) for env in envs])
+            length = await envs[2].aget("length")
+            await envs[0].aclose()
+        return results, length
+
+    results, length = asyncio.run(main())
+    assert [len(rewards) for _, rewards in results] == list(range(1, 9))
+    assert all(sum(rewards) == len(rewards) for _, rewards in results)
+    assert length == 3
+
+
+def test_remote_errors_are_raised():
+    async def main():
+        async with AsyncEnvPool(processes=1, env_fn=CountdownEnv) as pool:
+            env = await pool.make_env()
+            await env.areset()
+            await env.astep(None)
+
+    try:
+        asyncio.run(main())
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("remote exception was not propagated")
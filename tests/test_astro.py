@@ -0,0 +1,41 @@
+import datetime
+import os
+
+import numpy as np
+import pcse.crop.assimilation
+import pcse.util
+from pcse.settings import settings
+
+from spwk_agtech import astro
+from spwk_agtech.pcse_env import PcseEnv
+
+
+def test_tables_match_pcse():
+    for latitude in (35, -60.5, 89.9):
+        for iday in range(0, 366, 5):
+            day = datetime.date(1988, 1, 1) + datetime.timedelta(days=iday)
+            for radiation in (0.0, 3.0e6, 2.5e7):
+                assert astro.astro(day, latitude, radiation) == pcse.util.astro(
+                    day, latitude, radiation
+                )
+            assert astro.daylength(day, latitude) == pcse.util.daylength(day, latitude)
+
+
+def test_table_cached_on_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "METEO_CACHE_DIR", str(tmp_path))
+    latitude = 12.345
+    table = astro.load_astro_table(latitude)
+    assert os.path.exists(astro.astro_table_filename(latitude))
+    astro._tables.clear()
+    astro._rows.clear()
+    assert (astro.load_astro_table(latitude)[1:] == table[1:]).all()
+
+
+def test_env_scopes_tables():
+    env = PcseEnv(astro_tables=True)
+    env.reset()
+    env.step(env.action_space.sample())
+    assert pcse.crop.assimilation.astro is pcse.util.astro
+    assert astro.astro_table_filename(35) == astro.astro_table_filename(
+        np.float64(35.0)
+    )
@@ -0,0 +1,24 @@
+import numpy as np
+
+from spwk_agtech.batch_core import BatchWaterbalanceFD, validate_against_pcse
+from spwk_agtech.pcse_env import PcseEnv, load_parameters
+
+
+def test_matches_reference_modules():
+    env = PcseEnv()
+    env.reset()
+    action = env.norm(np.array([np.nan] * 9 + [2, 30, 10, 10], dtype=np.float32), "act")
+    deviation = validate_against_pcse(env.engine, lambda: env.step(action)[2], n=4)
+    assert deviation["TOTIRR"] == 0 and deviation["NAVAIL"] == 0
+    assert deviation.max() < 1e-9
+
+
+def test_water_balance_closes_without_crop():
+    water = BatchWaterbalanceFD(load_parameters(), n=8)
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        water.integrate()
+        water.calc_rates(rng.exponential(0.3, 8), 0.4, 0.3, irrigation=rng.random(8))
+    root_zone, total = water.balance()
+    assert np.abs(root_zone).max() < 1e-9
+    assert np.abs(total).max() < 1e-9
@@ -0,0 +1,43 @@
+import numpy as np
+
+from spwk_agtech.pcse_env import PcseEnv
+from spwk_agtech.utils import pcse_batch_runner, pcse_runner
+
+
+def no_management(obs, envs):
+    act = np.full((len(obs), 13), np.nan, dtype=np.float32)
+    act[:, 9:] = -1
+    return act
+
+
+class IrrigateWhenDry:
+    """ Deterministic policy of the observation, single or batched """
+
+    def get_action(self, obs, test=True):
+        obs = np.asarray(obs)
+        act = np.full(obs.shape[:-1] + (13,), np.nan, dtype=np.float32)
+        act[..., 9:] = -1
+        act[..., 9] = np.where(obs[..., 9] < 0, 0.0, -1.0)  # SM
+        act[..., 10] = np.where(obs[..., 0] < -0.5, -0.5, -1.0)  # N early on
+        return act
+
+
+def test_batch_matches_sequential():
+    dates = ["1988-01-01", "1988-03-01"]  # different episode lengths
+    for policy in (no_management, IrrigateWhenDry()):
+        envs = [PcseEnv(emergence_date=d, campaign_start_date=d) for d in dates]
+        actions, rewards = pcse_batch_runner(envs, policy)
+        for env, date, batch_actions, batch_rewards in zip(
+            envs, dates, actions, rewards
+        ):
+            single = PcseEnv(emergence_date=date, campaign_start_date=date)
+            if policy is no_management:
+                expected = pcse_runner(
+                    single, lambda obs, env: no_management([obs], [env])[0]
+                )
+            else:
+                expected = pcse_runner(single, policy)
+            np.testing.assert_array_equal(batch_actions, expected[0])
+            np.testing.assert_array_equal(batch_rewards, expected[1])
+            assert env.profit == single.profit
+        assert len(rewards[0]) != len(rewards[1])
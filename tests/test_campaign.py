@@ -0,0 +1,52 @@
+import datetime
+import os
+
+import numpy as np
+from pcse.engine import Engine
+
+from spwk_agtech.campaign import run_campaigns, successive_seasons
+from spwk_agtech.pcse_env import load_parameters, pcse_data_dir
+from spwk_agtech.utils import NASAPowerWeatherDataFetcher, send_actions2engine
+
+
+def test_successive_seasons_in_one_engine():
+    result = run_campaigns(successive_seasons(1987, 2))
+    assert len(result.seasons) == 2
+    assert result.seasons["campaign_start"].tolist() == [
+        datetime.date(1987, 1, 1),
+        datetime.date(1988, 1, 1),
+    ]
+    # the second crop starts from the N left by the first one
+    first = result.seasons.iloc[0]
+    np.testing.assert_allclose(
+        result.output.loc[datetime.date(1988, 1, 1), "NSOIL"],
+        first["NSOIL"] + first["NAVAIL"],
+    )
+
+
+def test_actions_go_to_the_running_campaign():
+    engine = Engine(
+        load_parameters(),
+        NASAPowerWeatherDataFetcher(35, 128),
+        successive_seasons(1987, 2),
+        config=os.path.join(pcse_data_dir, "Wofost71_NPK.conf"),
+    )
+    engine.run(days=(datetime.date(1987, 12, 31) - engine.day).days)
+    action = np.array([np.nan] * 9 + [0, 50, 0, 0], dtype=np.float32)
+    send_actions2engine(action, engine)
+    next_campaign = engine.agromanager.timed_event_dispatchers[1][1]
+    assert datetime.date(1988, 1, 1) in next_campaign.days_with_events
+
+
+def test_overrides_of_every_cycle_on_a_copy():
+    params = load_parameters()
+    nsoilbase = params["NSOILBASE"]
+    result = run_campaigns(
+        successive_seasons(1987, 2),
+        parameterprovider=params,
+        carry_npk=False,
+        overrides={"NSOILBASE": 42.0},
+    )
+    assert params["NSOILBASE"] == nsoilbase
+    for day in (datetime.date(1987, 1, 1), datetime.date(1988, 1, 1)):
+        assert result.output.loc[day, "NSOIL"] == 42.0
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from spwk_agtech.const import WEATHER_ACTIONS
+from spwk_agtech.pcse_env import PcseEnv
+from spwk_agtech.sweep import no_management_policy
+from spwk_agtech.utils import pcse_runner, send_actions2engine
+
+
+def test_action_space_of_subset():
+    env = PcseEnv(controlled_actions=["N", "IRRIGATE"])
+    assert env.action_space.shape == (2,)
+    assert env.action_name == ["IRRIGATE", "N"]  # order of const.py
+    assert PcseEnv(controlled_actions="weather").action_space.shape == (9,)
+    assert PcseEnv().action_index is None
+    with pytest.raises(ValueError):
+        PcseEnv(controlled_actions=["MANURE"])
+
+
+def test_uncontrolled_actions_use_defaults():
+    env = PcseEnv(controlled_actions=["N", "IRRIGATE"])
+    full = env.denorm(np.array([1, 1], dtype=np.float32), "act")
+    assert np.isnan(full[:9]).all()  # reference weather
+    assert full[11] == 0 and full[12] == 0  # no P, K
+    assert full[9] > 0 and full[10] > 0
+
+    reference = PcseEnv()
+    pcse_runner(reference, no_management_policy)
+    management = PcseEnv(controlled_actions="management")
+    pcse_runner(management, lambda obs, env: -np.ones(4, dtype=np.float32))
+    assert np.isclose(management.profit, reference.profit)
+
+
+def test_weather_skipped_when_not_controlled(monkeypatch):
+    env = PcseEnv(controlled_actions="management")
+    assert env.weather_vars == []
+    env.reset()
+    weather = env.engine.weatherdataprovider
+    calls = []
+    call = type(weather).__call__
+
+    def recording(self, day, *args, **kwargs):
+        calls.append(day)
+        return call(self, day, *args, **kwargs)
+
+    monkeypatch.setattr(type(weather), "__call__", recording)
+    action = env.denorm(-np.ones(4, dtype=np.float32), "act")
+    send_actions2engine(action, env.engine, env.weather_vars)
+    assert calls == []
+    send_actions2engine(action, env.engine, WEATHER_ACTIONS)
+    assert len(calls) == 1
@@ -0,0 +1,83 @@
+import numpy as np
+
+from spwk_agtech.episode_cache import EpisodeCache, config_digest
+from spwk_agtech.fork import OverlayWeatherDataProvider, fork_env
+from spwk_agtech.pcse_env import PcseEnv, load_parameters
+from spwk_agtech.sweep import no_management_policy
+from spwk_agtech.termination import CropDeath, StalledDVS
+
+
+def test_episode_cache_hits_and_resumes(tmp_path):
+    env = PcseEnv(controlled_actions="management")
+    rng = np.random.default_rng(0)
+    actions = rng.uniform(-1, 1, (40, 4)).astype(np.float32)
+    other = actions.copy()
+    other[35:] = -1
+
+    cache = EpisodeCache(snapshot_every=10, path=str(tmp_path / "episodes.pkl"))
+    first = cache.evaluate(env, actions)
+    assert cache.evaluate(env, actions) is first
+    resumed = cache.evaluate(env, other)
+    assert cache.stats == {"hits": 1, "resumed": 1, "misses": 1, "steps": 50}
+
+    fresh = EpisodeCache(snapshot_every=0).evaluate(env, other)
+    assert resumed.rewards == fresh.rewards
+    assert resumed.profit == fresh.profit
+    np.testing.assert_array_equal(resumed.obs, fresh.obs)
+
+    cache.save()
+    reloaded = EpisodeCache(path=str(tmp_path / "episodes.pkl"))
+    assert reloaded.evaluate(env, other).profit == fresh.profit
+    assert reloaded.stats["hits"] == 1
+
+
+def test_fork_does_not_touch_parent_state():
+    env = PcseEnv(termination=[StalledDVS(days=5), CropDeath()], metrics=True)
+    env.reset()
+    for _ in range(10):
+        env.step(no_management_policy(None, env))
+    history = list(env.termination[0]._history)
+    tagp = env.termination[1]._tagp
+    steps = env.metrics.counters.copy()
+
+    forked = fork_env(env)
+    assert list(forked.termination[0]._history) == history
+    for _ in range(10):
+        forked.step(no_management_policy(None, forked))
+    assert list(env.termination[0]._history) == history
+    assert env.termination[1]._tagp == tagp
+    assert env.metrics.counters == steps
+    assert forked.metrics is not env.metrics
+
+
+def test_fork_keeps_parent_overrides():
+    params = load_parameters()
+    params.set_override("TSUM2", 5000)
+    env = PcseEnv(parameterprovider=params)
+    env.reset()
+    forked = fork_env(env)
+    while not forked.done:
+        forked.step(no_management_policy(None, forked))
+    # the fork ran to the time limit, which clears the overrides of its own provider only
+    assert params["TSUM2"] == 5000
+    assert env.params["TSUM2"] == 5000
+    assert forked.params is not env.params
+
+
+def test_config_digest_is_stable():
+    params = load_parameters()
+    params.set_override("TSUM2", 5000)
+    env = PcseEnv(parameterprovider=params, controlled_actions="management")
+    digest = config_digest(env).hexdigest()
+    cache = EpisodeCache(snapshot_every=0)
+    actions = np.full((400, 4), -1, dtype=np.float32)
+    assert cache.evaluate(env, actions).steps >= 365  # time limit
+    assert config_digest(env).hexdigest() == digest
+    assert cache.evaluate(env, actions) is cache.evaluate(env, actions)
+
+    overlay = PcseEnv(
+        weather=OverlayWeatherDataProvider(env.ref_weather),
+        parameterprovider=params,
+        controlled_actions="management",
+    )
+    assert config_digest(overlay).hexdigest() != digest
@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+from pcse.exceptions import PCSEError
+
+from spwk_agtech.episode_pool import EpisodePool
+
+
+def test_pool_matches_in_process_runs(tmp_path):
+    tasks = [
+        {"design": {"TSUM2": tsum2}, "seed": i} for i, tsum2 in enumerate([600, 1600])
+    ]
+    tasks.append({"env_kwargs": {"emergence_date": "1988-01-15"}, "trajectory": True})
+    with EpisodePool(processes=1) as pool:
+        expected = pool.run(tasks, output=str(tmp_path / "runs.csv"))
+        assert len(pool._runner.envs) == 2  # reused across the TSUM2 designs
+    assert expected.days.tolist()[:2] == [176, 217]
+    assert len(expected.rewards[2]) == expected.days[2]
+    written = pd.read_csv(tmp_path / "runs.csv")
+    assert written.seed.isna().tolist() == [False, False, True]
+
+    with EpisodePool(processes=2) as pool:
+        rows = list(pool.imap_unordered(tasks))
+        assert sorted(row["run"] for row in rows) == [0, 1, 2]
+        assert pool.stats["days"] == expected.days.sum()
+        for row in rows:
+            assert row["profit"] == expected.profit[row["run"]]
+
+
+def test_failed_task_raises_and_pool_restarts():
+    with EpisodePool(processes=2) as pool:
+        with pytest.raises(PCSEError):
+            list(pool.imap_unordered([{"design": {"NOPE": 1}}, None, None]))
+        assert not pool.workers
+        df = pool.run([{"design": {"TSUM2": 600}}])
+    assert df.days.tolist() == [176]
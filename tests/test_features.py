@@ -0,0 +1,46 @@
+import numpy as np
+
+from spwk_agtech.features import BatchFeatureWrapper, FeatureWrapper, RingBuffer
+from spwk_agtech.pcse_env import PcseEnv
+from spwk_agtech.termination import ProfitCeiling
+
+
+def test_ring_buffer_matches_window_stats():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(20, 2, 3))
+    buffer = RingBuffer(2, 5, 3)
+    for ix, value in enumerate(values):
+        buffer.push(value)
+        window = values[max(0, ix - 4) : ix + 1]
+        assert np.allclose(buffer.mean(), window.mean(axis=0))
+        assert np.allclose(buffer.std(), window.std(axis=0))
+        assert np.allclose(buffer.oldest(), window[0])
+
+
+def test_feature_wrapper():
+    env = FeatureWrapper(PcseEnv(), lag=3)
+    features = env.reset()
+    assert env.observation_space.shape == features.shape
+    action = np.zeros(13, dtype=np.float32)
+    action[9] = 1
+    obs = [features[:11]]
+    for _ in range(5):
+        features, _, _, _ = env.step(action)
+        obs.append(features[:11])
+    inputs = features[29:33]
+    assert np.isclose(inputs[0], 5 * env.env.action_max[9] / 50)
+    assert np.isclose(features[33], 5 / 365)
+    assert np.allclose(features[34:], obs[-1] - obs[-4])
+
+
+def test_batch_feature_wrapper_autoreset():
+    envs = [PcseEnv(termination=[ProfitCeiling(threshold=0)]) for _ in range(2)]
+    batch = BatchFeatureWrapper(envs)
+    batch.reset()
+    actions = np.zeros((2, 13), dtype=np.float32)
+    done = np.zeros(2, dtype=bool)
+    while not done.any():
+        features, _, done, infos = batch.step(actions)
+    assert "terminal_observation" in infos[0]
+    assert features[0, -12] == 0
+    assert infos[0]["terminal_observation"][-12] > 0
@@ -0,0 +1,16 @@
+import numpy as np
+
+from spwk_agtech.golden import check_modes, load_golden, record_golden
+
+
+def test_golden_modes(tmp_path):
+    path = str(tmp_path / "golden.npz")
+    golden = record_golden(path, seeds=(1,))
+    loaded = load_golden(path)
+    np.testing.assert_array_equal(loaded[1]["obs"], golden[1]["obs"])
+    np.testing.assert_array_equal(loaded[1]["actions"], golden[1]["actions"])
+
+    report = check_modes(path, ["reference", "astro_tables", "fork", "batch"])
+    assert report.ok.all(), report
+    assert (report.steps == 0).all()
+    assert "speedup" in report
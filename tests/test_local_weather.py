@@ -0,0 +1,70 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+from pcse.util import reference_ET
+
+from spwk_agtech.local_weather import read_weather_csv
+from spwk_agtech.pcse_env import PcseEnv
+from spwk_agtech.sweep import no_management_policy
+from spwk_agtech.utils import NASAPowerWeatherDataFetcher, pcse_runner
+
+FIELDS = ["TMIN", "TMAX", "TEMP", "IRRAD", "RAIN", "WIND", "VAP", "ET0"]
+ET_INPUTS = ["TMIN", "TMAX", "IRRAD", "VAP", "WIND"]
+
+
+def test_csv_matches_nasapower(tmp_path):
+    ref = NASAPowerWeatherDataFetcher(35, 128)
+    df = pd.DataFrame(ref.export())
+    site = pd.DataFrame(
+        {
+            "site": "bundled",
+            "DAY": df.DAY,
+            "lat": 35.0,
+            "long": 128.0,
+            "elev": ref.elevation,
+            "TMIN": df.TMIN + 273.15,
+            "TMAX": df.TMAX + 273.15,
+            "TEMP": df.TEMP + 273.15,
+            "IRRAD": df.IRRAD / 1e6,
+            "RAIN": df.RAIN * 10,
+            "WIND": df.WIND,
+            "VAP": df.VAP,
+        }
+    )
+    # a second site with a missing day
+    other = site.iloc[:3].assign(site="other", lat=36.0)
+    other.loc[1, "TMAX"] = np.nan
+    path = tmp_path / "weather.csv"
+    pd.concat([site, other]).to_csv(path, index=False)
+
+    units = {k: "K" for k in ("TMIN", "TMAX", "TEMP")}
+    providers = read_weather_csv(
+        path, units=units, chunksize=5000, angstA=ref.angstA, angstB=ref.angstB
+    )
+    assert sorted(providers) == ["bundled", "other"]
+    assert providers["other"].missing == 1
+    weather = providers["bundled"]
+    assert weather.first_date == ref.first_date and weather.last_date == ref.last_date
+    for day in (ref.first_date, datetime.date(1988, 7, 1), ref.last_date):
+        expected, actual = ref(day), weather(day)
+        assert np.allclose(
+            [getattr(actual, k) for k in FIELDS],
+            [getattr(expected, k) for k in FIELDS],
+            rtol=1e-9,
+        )
+        # E0 and ES0 of the bundled cache depend on Angstrom A/B that are not cached
+        e0 = reference_ET(
+            day,
+            35.0,
+            ref.elevation,
+            *[getattr(actual, k) for k in ET_INPUTS],
+            ref.angstA,
+            ref.angstB,
+            "PM"
+        )
+        assert np.allclose([actual.E0, actual.ES0], np.array(e0[:2]) / 10, rtol=1e-12)
+
+    env = PcseEnv(weather=weather)
+    pcse_runner(env, no_management_policy)
+    assert env.engine.day <= weather.last_date and np.isfinite(env.profit)
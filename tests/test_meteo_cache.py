@@ -0,0 +1,75 @@
+import os
+
+from pcse.settings import settings
+
+import spwk_agtech.meteo_cache as meteo_cache
+from spwk_agtech.make_weather_cache import _get_cache_filename
+from spwk_agtech.meteo_cache import MeteoCache, parse_size
+
+
+def _write(tmp_path, latitude, longitude, size, atime):
+    path = tmp_path / _get_cache_filename(latitude, longitude)
+    path.write_bytes(b"x" * size)
+    os.utime(path, (atime, atime))
+    return path.name
+
+
+def test_lru_eviction(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "METEO_CACHE_DIR", str(tmp_path))
+    names = [_write(tmp_path, 35, 128 + ix, 100, 1000 + ix) for ix in range(4)]
+    (tmp_path / "AstroTable_LAT35.npy").write_bytes(b"x")
+
+    cache = MeteoCache()
+    assert cache.usage() == (4, 400)
+    assert cache.lookup(35, 128)["size"] == 100
+    assert cache.lookup(0, 0) is None
+
+    # the oldest site becomes the most recent one
+    cache.touch(35, 128)
+    assert cache.prune(max_entries=3) == [names[1]]
+    assert cache.prune(max_bytes=200) == [names[2]]
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [
+            names[0],
+            names[3],
+            "AstroTable_LAT35.npy",
+            meteo_cache.INDEX_FILENAME,
+            meteo_cache.INDEX_FILENAME + ".lock",
+        ]
+    )
+
+    # the index is shared through its file
+    assert MeteoCache().usage() == (2, 200)
+    assert list(cache.inspect().file) == [names[0], names[3]]
+
+
+def test_fetch_keeps_quota(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "METEO_CACHE_DIR", str(tmp_path))
+
+    def fetcher(latitude, longitude, **kwargs):
+        _write(tmp_path, latitude, longitude, 100, 2000)
+        return (latitude, longitude)
+
+    monkeypatch.setattr(meteo_cache, "NASAPowerWeatherDataFetcher", fetcher)
+    cache = MeteoCache(max_bytes="250B")
+    for longitude in range(5):
+        assert cache.fetch(35, longitude) == (35, longitude)
+    assert cache.usage() == (2, 200)
+    assert cache.lookup(35, 4) is not None and cache.lookup(35, 3) is not None
+
+    meteo_cache.main(["--max-entries", "1", "prune"])
+    assert MeteoCache().usage() == (1, 100)
+    assert parse_size("2G") == 2**31
+
+
+def test_prune_sees_other_processes(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "METEO_CACHE_DIR", str(tmp_path))
+    names = [_write(tmp_path, 35, 128 + ix, 100, 1000 + ix) for ix in range(3)]
+    cache = MeteoCache()
+
+    # another process accesses the oldest site and writes a new one outside the index
+    MeteoCache().touch(35, 128)
+    new = _write(tmp_path, 35, 200, 100, 3000)
+
+    assert cache.prune(max_entries=2) == [names[1], names[2]]
+    assert sorted(cache.entries) == sorted([names[0], new])
@@ -0,0 +1,31 @@
+import json
+
+from spwk_agtech.metrics import EnvMetrics, Histogram
+
+
+def test_histogram_buckets():
+    hist = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        hist.observe(value)
+    assert hist.counts == [2, 1, 1]
+    assert hist.count == 4
+    assert hist.max == 2.0
+    assert hist.quantile(0.5) == 0.1
+
+
+def test_metrics_export(tmp_path):
+    metrics = EnvMetrics(buckets=(0.1, 1.0))
+    with metrics.timer("engine_run"):
+        pass
+    metrics.observe("engine_run", 0.5)
+    metrics.incr("steps", 2)
+
+    summary = json.loads(metrics.to_json(tmp_path / "metrics.json"))
+    assert summary["timings"]["engine_run"]["count"] == 2
+    assert summary["counters"] == {"steps": 2}
+    assert metrics.last_timings() == {"engine_run": 0.5}
+
+    text = metrics.to_prometheus(tmp_path / "metrics.prom")
+    assert 'pcse_env_phase_seconds_bucket{phase="engine_run",le="+Inf"} 2' in text
+    assert "pcse_env_steps_total 2" in text
+    assert (tmp_path / "metrics.prom").read_text() == text
@@ -0,0 +1,69 @@
+import numpy as np
+
+from spwk_agtech.mpc import MPCController, rollout_value
+from spwk_agtech.pcse_env import PcseEnv, load_parameters
+from spwk_agtech.sweep import no_management_policy
+from spwk_agtech.termination import StalledDVS
+from spwk_agtech.utils import pcse_runner
+
+
+def test_budget_exhausted_falls_back_to_no_management():
+    env, reference = PcseEnv(), PcseEnv()
+    pcse_runner(reference, no_management_policy)
+    mpc = MPCController(horizon=3, population=2, replan_every=50, time_budget=0)
+    for _ in range(2):  # the second episode resyncs the controller
+        actions, rewards = pcse_runner(env, mpc)
+        assert np.isclose(env.profit, reference.profit)
+    assert len(mpc.latencies) == 2 * len(actions)
+    assert np.all(np.array(actions)[:, 9:] == -1)
+
+
+def test_pool_rollouts_match_in_process():
+    env = PcseEnv()
+    obs = env.reset()
+    applied = []
+    for _ in range(60):
+        applied.append(no_management_policy(obs, env))
+        obs, _, _, _ = env.step(applied[-1])
+    plan = np.tile(no_management_policy(obs, env), (5, 1))
+    plan[0, 10] = 0  # N
+    expected = rollout_value(env, plan, tail="terminal")
+    # env is not modified by rollouts
+    assert env.engine.day == env.current_date and len(env.engine.get_output()) == 61
+
+    with MPCController(horizon=5, tail="terminal", processes=2) as mpc:
+        mpc._shadow.sync(applied)
+        assert mpc._score([plan, plan]) == [expected, expected]
+
+
+def test_controlled_termination_matches_replay():
+    def env_kwargs():
+        return {
+            "termination": [StalledDVS(days=30, min_increase=0.055)],
+            "parameterprovider": load_parameters(),
+        }
+
+    kwargs = env_kwargs()
+    env = PcseEnv(**kwargs)  # shares its predicates with the controller's env_kwargs
+    mpc = MPCController(kwargs, horizon=3, population=3, replan_every=5, seed=0)
+    actions, _ = pcse_runner(env, mpc)
+
+    replay = PcseEnv(**env_kwargs())
+    replay.reset()
+    for action in actions:
+        _, _, done, info = replay.step(action)
+    assert done and info["termination"] == "stalled_dvs"
+    assert env.current_date == replay.current_date
+    assert np.isclose(env.profit, replay.profit)
+
+
+def test_rollouts_keep_shared_overrides():
+    params = load_parameters()
+    params.set_override("TSUM2", 5000)  # rollouts run to the time limit
+    env = PcseEnv(parameterprovider=params)
+    mpc = MPCController({"parameterprovider": params}, horizon=3, population=2, seed=0)
+    obs = env.reset()
+    env.step(mpc.get_action(obs))
+    assert params["TSUM2"] == 5000
+    assert env.params["TSUM2"] == 5000
+    assert mpc._shadow.env.params["TSUM2"] == 5000
@@ -0,0 +1,107 @@
+import datetime
+import multiprocessing
+import time
+
+import numpy as np
+from pcse.base import WeatherDataProvider
+from pcse.settings import settings
+from pcse.util import reference_ET
+
+from spwk_agtech.nasapower import NASAPowerWeatherDataProvider
+
+N_DAYS = 400
+
+
+def powerdata():
+    rng = np.random.default_rng(0)
+    days = [
+        datetime.date(1987, 1, 1) + datetime.timedelta(days=d) for d in range(N_DAYS)
+    ]
+    keys = [d.strftime("%Y%m%d") for d in days]
+    tmin = rng.uniform(-5, 20, N_DAYS)
+
+    def column(values):
+        return dict(zip(keys, np.round(values, 2).tolist()))
+
+    parameters = {
+        "TOA_SW_DWN": column(rng.uniform(25, 40, N_DAYS)),
+        "ALLSKY_SFC_SW_DWN": column(rng.uniform(2, 25, N_DAYS)),
+        "T2M": column(tmin + 5),
+        "T2M_MIN": column(tmin),
+        "T2M_MAX": column(tmin + rng.uniform(2, 15, N_DAYS)),
+        "T2MDEW": column(tmin - 2),
+        "WS2M": column(rng.uniform(0, 6, N_DAYS)),
+        "PRECTOTCORR": column(rng.exponential(3, N_DAYS)),
+    }
+    parameters["T2M"]["19870105"] = -999.0
+    return {
+        "header": {"title": "test", "fill_value": -999.0},
+        "geometry": {"coordinates": [128.0, 35.0, 55.0]},
+        "properties": {"parameter": parameters},
+    }
+
+
+def test_vectorized_ingestion_matches_pcse(monkeypatch):
+    monkeypatch.setattr(
+        NASAPowerWeatherDataProvider,
+        "_query_NASAPower_server",
+        lambda self, lat, long: powerdata(),
+    )
+    monkeypatch.setattr(NASAPowerWeatherDataProvider, "_dump", lambda self, f: None)
+    weather = NASAPowerWeatherDataProvider.__new__(NASAPowerWeatherDataProvider)
+    WeatherDataProvider.__init__(weather)
+    weather.latitude, weather.longitude, weather.ETmodel = 35.0, 128.0, "PM"
+    weather._get_and_process_NASAPower(35.0, 128.0)
+
+    # the day with a fill value is dropped
+    assert len(weather.store) == N_DAYS - 1
+    assert (datetime.date(1987, 1, 5), 0) not in weather.store
+    wdc = weather(datetime.date(1987, 3, 1))
+    assert isinstance(wdc.DAY, datetime.date)
+    expected = reference_ET(
+        wdc.DAY,
+        wdc.LAT,
+        wdc.ELEV,
+        wdc.TMIN,
+        wdc.TMAX,
+        wdc.IRRAD,
+        wdc.VAP,
+        wdc.WIND,
+        weather.angstA,
+        weather.angstB,
+        "PM",
+    )
+    assert np.allclose([wdc.E0, wdc.ES0, wdc.ET0], np.array(expected) / 10, rtol=1e-12)
+
+
+def _construct(queue):
+    weather = NASAPowerWeatherDataProvider(35.0, 128.0)
+    queue.put(len(weather.store))
+
+
+def test_single_flight_cache_population(monkeypatch, tmp_path):
+    calls = tmp_path / "calls"
+
+    def query(self, lat, long):
+        with open(calls, "a") as f:
+            f.write("x")
+        time.sleep(0.5)
+        return powerdata()
+
+    monkeypatch.setattr(settings, "METEO_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(NASAPowerWeatherDataProvider, "_query_NASAPower_server", query)
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    workers = [ctx.Process(target=_construct, args=(queue,)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+    # a crashed worker fails the test here instead of a blocking get
+    assert [worker.exitcode for worker in workers] == [0] * 4
+    sizes = [queue.get(timeout=5) for _ in workers]
+
+    # one request for the site, every worker got the full store from it or its cache file
+    assert calls.read_text() == "x"
+    assert sizes == [N_DAYS - 1] * 4
+    assert [p.name for p in tmp_path.iterdir() if ".tmp" in p.name] == []
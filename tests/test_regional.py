@@ -0,0 +1,19 @@
+import numpy as np
+
+from spwk_agtech.regional import grid_catalogue, run_region, tile_of
+
+
+def test_tile_of():
+    assert tile_of(35.3, 128.49) == (35.0, 128.0)
+    assert tile_of(35.5, -0.2) == (35.5, -0.5)
+
+
+def test_run_region_rasters(tmp_path):
+    catalogue = grid_catalogue((35.0, 35.1), (128.0, 128.0))
+    catalogue["NSOILBASE"] = [10.0, 40.0]
+    result = run_region(catalogue, processes=1, output=str(tmp_path / "region.npz"))
+    assert result.rasters["profit"].shape == (2, 1)
+    assert result.rasters["TWSO"][1, 0] > result.rasters["TWSO"][0, 0]
+    assert result.cells_per_second > 0
+    saved = np.load(tmp_path / "region.npz")
+    np.testing.assert_array_equal(saved["profit"], result.rasters["profit"])
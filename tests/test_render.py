@@ -0,0 +1,54 @@
+import datetime
+
+import numpy as np
+
+from spwk_agtech.const import OBSERVATIONS
+from spwk_agtech.render import EpisodeFigure, IncrementalRenderer, export_episodes
+
+
+class RecordedEngine:
+    def __init__(self, days):
+        start = datetime.date(1988, 1, 1)
+        self.output = [
+            dict(
+                day=start + datetime.timedelta(days=ix),
+                **{k: 1.0 for k in OBSERVATIONS}
+            )
+            for ix in range(days)
+        ]
+        self.n = 0
+
+    def get_output(self):
+        return self.output[: self.n]
+
+
+def test_incremental_renderer_appends_new_days():
+    engine = RecordedEngine(30)
+    renderer = IncrementalRenderer(interactive=False)
+    for n in (1, 10, 30):
+        engine.n = n
+        renderer.update(engine)
+        assert renderer.figure.n == n
+        assert len(renderer.figure.lines[0].get_xdata()) == n
+    assert renderer.rgb_array().ndim == 3
+
+    engine.n = 5  # new episode
+    renderer.update(engine)
+    assert renderer.figure.n == 5
+    renderer.close()
+
+
+def test_export_episodes(tmp_path):
+    episodes = [np.random.rand(20, 11), RecordedEngine(20).output]
+    paths = export_episodes(episodes, tmp_path, fmt="png", processes=1)
+    assert [p.endswith(".png") for p in paths] == [True, True]
+    (html,) = export_episodes(episodes[:1], tmp_path, fmt="html", processes=1)
+    assert "<svg" in open(html).read()
+
+
+def test_html_title_is_escaped(tmp_path):
+    path = str(tmp_path / "episode.html")
+    EpisodeFigure().save(path, title="<script>N & P</script>")
+    text = open(path).read()
+    assert "<title>&lt;script&gt;N &amp; P&lt;/script&gt;</title>" in text
+    assert "<script>" not in text
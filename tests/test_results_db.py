@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from spwk_agtech.pcse_env import PcseEnv
+from spwk_agtech.results_db import ResultsDB
+from spwk_agtech.sweep import no_management_policy
+from spwk_agtech.utils import pcse_runner
+
+
+def test_store_and_query(tmp_path):
+    url = f"sqlite:///{tmp_path / 'results.db'}"
+    env = PcseEnv()
+    actions, rewards = pcse_runner(env, no_management_policy)
+
+    with ResultsDB(url, batch_size=2) as db:
+        first = db.add_episode(
+            env, actions, rewards, trajectory=True, site="35,128", policy="none", seed=0
+        )
+        row = {"profit": 1.0, "TWSO": 2.0, "days": 3}
+        for seed in range(3):
+            db.add(row, site="35,128", season="1987", policy="fixed", seed=seed)
+
+    db = ResultsDB(url)
+    assert len(db) == 4
+    episode = db.query(policy="none").iloc[0]
+    assert episode.id == first and np.isclose(episode.profit, env.profit)
+    assert episode.days == len(rewards) and episode.maturity == env.engine.day
+    assert db.query(["seed"], policy="fixed", seed=[1, 2]).seed.tolist() == [1, 2]
+    assert len(db.query(where="profit < 100")) == 3
+
+    stats = db.aggregate(["policy"], ["profit"], funcs=("count", "avg"))
+    assert stats.policy.tolist() == ["fixed", "none"]
+    assert stats.profit_count.tolist() == [3, 1]
+    assert sum(len(chunk) for chunk in db.iter_query(chunksize=3)) == 4
+
+    trajectory = db.trajectory(first)
+    assert len(trajectory) == len(rewards)
+    assert np.allclose(trajectory.reward, rewards)
+    assert trajectory.day.iloc[-1] == env.engine.day
+    db.close()
+
+
+def test_concurrent_writers(tmp_path):
+    url = f"sqlite:///{tmp_path / 'results.db'}"
+    trajectory = pd.DataFrame({"step": [0, 1], "day": ["1988-01-02", "1988-01-03"]})
+    writers = [ResultsDB(url, batch_size=2), ResultsDB(url, batch_size=2)]
+    ids = []
+    for seed in range(3):
+        for policy, db in enumerate(writers):
+            ids.append(db.add({"profit": 1.0}, trajectory, policy=policy, seed=seed))
+        writers[0].flush()
+    for db in writers:
+        db.close()
+
+    db = ResultsDB(url)
+    assert sorted(db.query(["id"]).id) == sorted(ids) and len(set(ids)) == 6
+    assert db.aggregate(["policy"]).profit_count.tolist() == [3, 3]
+    assert len(db.trajectory(ids)) == 12
+    db.close()
+
+
+def test_where_conditions_are_bound(tmp_path):
+    db = ResultsDB(f"sqlite:///{tmp_path / 'results.db'}")
+    for seed in range(4):
+        db.add({"profit": float(seed)}, policy="it's", seed=seed)
+    assert db.query(["seed"], where=("profit", ">=", 2)).seed.tolist() == [2, 3]
+    assert len(db.query(where=[("policy", "==", "it's"), ("seed", "in", [0, 3])])) == 2
+    assert len(db.query(where=db.episodes.c.profit.between(1, 2))) == 2
+    assert len(db.query(where=("policy", "==", "x' OR 1=1 --"))) == 0
+    assert sum(len(c) for c in db.iter_query(where=("profit", "<", 1))) == 1
+    db.close()
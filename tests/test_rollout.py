@@ -0,0 +1,39 @@
+import numpy as np
+
+from spwk_agtech.rollout import RolloutPipeline
+from tests.helpers import CountdownEnv
+
+
+class ConstantPolicy:
+    def __init__(self):
+        self.value = 0.0
+
+    def get_action(self, obs, test=False):
+        return np.full(1, self.value, dtype=np.float32)
+
+    def set_weights(self, weights):
+        self.value = weights
+
+
+def test_fragments_and_weight_broadcast():
+    with RolloutPipeline(
+        ConstantPolicy,
+        n_workers=2,
+        fragment_length=5,
+        n_slots=2,
+        env_fn=CountdownEnv,
+        env_kwargs={"length": 3, "time_limit": True},
+    ) as pipeline:
+        fragment = pipeline.get(timeout=30)
+        assert fragment.obs.shape == (5, 1)
+        assert fragment.dones.tolist() == [False, False, True, False, False]
+        assert (fragment.truncated == fragment.dones).all()
+        assert fragment.version == 0
+
+        version = pipeline.broadcast(1.0)
+        for _ in range(20):
+            fragment = pipeline.get(timeout=30)
+            if fragment.version == version:
+                break
+        assert fragment.version == version
+        assert np.all(fragment.rewards == 1.0)
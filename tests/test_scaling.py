@@ -0,0 +1,26 @@
+import numpy as np
+
+from spwk_agtech.const import ACTIONS, OBSERVATIONS
+from spwk_agtech.scaling import ACTION_SCALING, OBS_SCALING
+
+
+def test_denorm_matches_const_ranges():
+    low = np.array([v["min"] for v in ACTIONS.values()], dtype=np.float32)
+    high = np.array([v["max"] for v in ACTIONS.values()], dtype=np.float32)
+    np.testing.assert_allclose(ACTION_SCALING.denorm(-np.ones(13)), low, atol=1e-4)
+    np.testing.assert_allclose(ACTION_SCALING.denorm(np.ones(13)), high, atol=1e-4)
+    np.testing.assert_allclose(ACTION_SCALING.denorm_clip(np.full(13, 3.0)), high)
+
+
+def test_norm_roundtrip_batched():
+    rng = np.random.default_rng(0)
+    value = rng.uniform(-1, 1, size=(5, len(OBSERVATIONS)))
+    out = OBS_SCALING.norm_clip(OBS_SCALING.denorm(value))
+    assert out.dtype == np.float32
+    np.testing.assert_allclose(out, value, atol=1e-5)
+
+
+def test_subset():
+    sub = ACTION_SCALING.subset([9, 10])
+    assert sub.names == ["IRRIGATE", "N"]
+    np.testing.assert_allclose(sub.denorm([1, -1]), [50, 0])
@@ -0,0 +1,26 @@
+import numpy as np
+
+from spwk_agtech.schedule import ScheduleSpace, optimize_schedule, schedule_costs
+
+
+def test_decode_sparse_events():
+    space = ScheduleSpace(n_irrigation=2, n_fertilization=1, season_days=100)
+    params = np.array([0.1, 0.5, 0.1, 1.0, 0.5, 0.2, 0.0, 0.0])
+    schedule = space.decode(params)
+    assert schedule.shape == (366, 4)
+    np.testing.assert_allclose(schedule[10], [15, 0, 0, 0])
+    np.testing.assert_allclose(schedule[50], [0, 20, 0, 0])
+    assert np.count_nonzero(schedule) == 2
+    np.testing.assert_allclose(schedule_costs(schedule), 15 * 5 + 20 * 0.25)
+    np.testing.assert_allclose(
+        schedule_costs(space.decode(np.stack([params] * 3))), [80] * 3
+    )
+
+
+def test_optimize_schedule_prunes_hopeless_candidates():
+    result = optimize_schedule(
+        population=2, iterations=2, processes=1, seed=0, max_yield=0
+    )
+    assert result.schedule.shape == (366, 4)
+    assert result.trace["evaluated"].tolist() == [2, 0]
+    assert result.profit == result.trace["best"].iloc[-1]
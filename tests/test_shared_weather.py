@@ -0,0 +1,62 @@
+import copy
+import datetime as dt
+import pickle
+
+import pytest
+from pcse.base import WeatherDataContainer, WeatherDataProvider
+from pcse.exceptions import WeatherDataProviderError
+
+from spwk_agtech import shared_weather
+from spwk_agtech.shared_weather import SharedWeatherDataProvider, SharedWeatherStore
+
+
+def make_weather(days=3):
+    weather = WeatherDataProvider()
+    weather.latitude, weather.longitude, weather.elevation = 35.0, 128.0, 92.0
+    for ix in range(days):
+        day = dt.date(1988, 1, 1) + dt.timedelta(days=ix)
+        wdc = WeatherDataContainer(
+            DAY=day,
+            LAT=35.0,
+            LON=128.0,
+            ELEV=92.0,
+            IRRAD=1e7,
+            TMIN=float(ix),
+            TMAX=10.0,
+            VAP=8.0,
+            RAIN=0.1,
+            E0=0.2,
+            ES0=0.15,
+            ET0=0.18,
+            WIND=2.0,
+        )
+        weather._store_WeatherDataContainer(wdc, day)
+    return weather
+
+
+def test_attach_and_private_overrides():
+    with SharedWeatherStore() as store:
+        handle = store.add(make_weather())
+        weather = SharedWeatherDataProvider(handle)
+        assert weather.first_date == dt.date(1988, 1, 1)
+        assert weather.last_date == dt.date(1988, 1, 3)
+        assert weather(dt.date(1988, 1, 2)).TMIN == 1.0
+        assert len(weather.export()) == 3
+
+        episode = copy.deepcopy(weather)
+        episode(dt.date(1988, 1, 2)).TMIN = 5.0
+        assert weather(dt.date(1988, 1, 2)).TMIN == 1.0
+        assert pickle.loads(pickle.dumps(episode))(dt.date(1988, 1, 2)).TMIN == 1.0
+
+        with pytest.raises(WeatherDataProviderError):
+            weather(dt.date(1988, 1, 4))
+
+
+def test_copies_share_one_attachment():
+    with SharedWeatherStore() as store:
+        weather = SharedWeatherDataProvider(store.add(make_weather()))
+        copies = [copy.deepcopy(weather) for _ in range(3)]
+        copies.append(pickle.loads(pickle.dumps(weather)))
+        for episode in copies:
+            assert episode._shm is weather._shm and episode.data is weather.data
+        assert weather.handle.name in shared_weather._attached
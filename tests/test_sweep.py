@@ -0,0 +1,65 @@
+import numpy as np
+
+from spwk_agtech.pcse_env import PcseEnv, load_parameters
+from spwk_agtech.sweep import (
+    ColumnarWriter,
+    latin_hypercube,
+    no_management_policy,
+    parameter_grid,
+)
+from spwk_agtech.utils import pcse_runner
+
+
+def test_parameter_grid():
+    designs = parameter_grid({"WAV": [10, 50], "NSOILBASE": [5, 10, 20]})
+    assert len(designs) == 6
+    assert designs[0] == {"WAV": 10, "NSOILBASE": 5}
+
+
+def test_latin_hypercube_strata():
+    designs = latin_hypercube({"WAV": (0, 50), "NSOILBASE": (0, 10)}, n=10, seed=1)
+    wav = np.array([d["WAV"] for d in designs])
+    # exactly one sample per stratum in every dimension
+    assert sorted((wav // 5).astype(int).tolist()) == list(range(10))
+    assert latin_hypercube({"WAV": (0, 50)}, n=3, seed=1) == latin_hypercube(
+        {"WAV": (0, 50)}, n=3, seed=1
+    )
+
+
+def test_columnar_writer_streams_chunks(tmp_path):
+    path = tmp_path / "sweep.csv"
+    writer = ColumnarWriter(path, chunk_rows=2)
+    for run in (2, 0, 1):
+        writer.append({"run": run, "profit": float(run)})
+    assert len(path.read_text().splitlines()) == 3
+    writer.flush()
+    assert len(path.read_text().splitlines()) == 4
+    assert writer.to_frame()["run"].tolist() == [0, 1, 2]
+
+
+def test_shared_parameters_across_episodes(caplog):
+    params = load_parameters()
+    env = PcseEnv(parameterprovider=params)
+    profits = []
+    for _ in range(2):
+        pcse_runner(env, no_management_policy)
+        profits.append(env.profit)
+    assert profits[0] == profits[1]
+    assert env.params is not params  # one provider per episode
+    assert "second crop" not in caplog.text
+    params.set_override("TSUM2", 600)
+    pcse_runner(env, no_management_policy)
+    assert env.profit < profits[0]
+
+
+def test_overrides_survive_time_limit():
+    params = load_parameters()
+    params.set_override("TSUM2", 5000)
+    env = PcseEnv(parameterprovider=params)
+    lengths = []
+    for _ in range(2):
+        _, rewards = pcse_runner(env, no_management_policy)
+        lengths.append(len(rewards))
+        assert params["TSUM2"] == 5000
+    # the crop never matures, both episodes run to the 365-day limit
+    assert lengths[0] == lengths[1] >= 365
@@ -0,0 +1,53 @@
+import numpy as np
+
+from spwk_agtech.pcse_env import PcseEnv
+from spwk_agtech.termination import CropDeath, ProfitCeiling, StalledDVS
+
+
+def obs(dvs=0.5, lai=1.0, tagp=1000.0):
+    state = np.zeros(11)
+    state[:3] = dvs, lai, tagp
+    return state
+
+
+def test_predicates():
+    death = CropDeath(patience=3)
+    # the first day has no previous TAGP to compare with
+    assert not any(death(obs(lai=0.0), None) for _ in range(3))
+    assert death(obs(lai=0.0), None)
+    death.reset()
+    assert not death(obs(lai=0.0), None)
+
+    stalled = StalledDVS(days=2)
+    assert [stalled(obs(dvs=d), None) for d in (0.5, 0.6, 0.6, 0.6)] == [
+        False,
+        False,
+        False,
+        True,
+    ]
+
+
+def test_early_termination_settles_episode():
+    env = PcseEnv(termination=[ProfitCeiling(threshold=0)])
+    env.reset()
+    done, steps = False, 0
+    while not done:
+        _, reward, done, info = env.step(np.zeros(13, dtype=np.float32))
+        steps += 1
+    assert steps < 100
+    assert info == {"termination": "profit_ceiling", "TimeLimit.truncated": False}
+    # the current yield is sold at termination
+    assert env.profit + ProfitCeiling()._max_income < 0
+
+
+def test_predicates_see_current_cost():
+    ceiling = ProfitCeiling()
+    env = PcseEnv(termination=[ProfitCeiling(threshold=ceiling._max_income - 1)])
+    env.reset()
+    action = -np.ones(13, dtype=np.float32)
+    action[:9] = np.nan  # reference weather
+    _, _, done, info = env.step(action)
+    assert not done and info == {"termination": None, "TimeLimit.truncated": False}
+    action[9] = 1  # irrigation costs more than 1 USD/ha
+    _, _, done, info = env.step(action)
+    assert done and info["termination"] == "profit_ceiling"